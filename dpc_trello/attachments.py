@@ -0,0 +1,429 @@
+"""Concurrent and cached fetching of trello hosted attachments content
+
+The pipeline is enabled with the `attachments` crawl configuration, a dict
+accepting the following keys:
+
+- `cache_dir` (mandatory): local directory where contents are stored
+- `max_size`: maximum size of a downloaded file, in bytes (default 2MB),
+  every uploaded file is held in memory
+- `max_cache_size`: maximum size of the cache directory, in bytes, least
+  recently used contents are evicted beyond it (default 1GB)
+- `concurrency`: maximum number of concurrent downloads (default 8)
+- `per_host`: maximum number of concurrent downloads per host (default 2)
+
+Contents are streamed to the cache directory by chunks, then uploaded to
+the index's binary store, one file at a time, the way thumbnails are. The
+pushed file attachments refer to their uploaded content with a
+`_content_id` field. Uploaded contents are recorded in the key-value store,
+so that a content is uploaded once per account, along with the contents of
+every card. Contents are deleted once superseded by a new version, or with
+their card, see `delete_card_contents`.
+
+Files uploaded to trello.com are downloaded with the account's trello
+client, the others are downloaded from S3 with a plain HTTP session, out of
+the trello rate limit.
+"""
+
+import base64
+import errno
+import json
+import os
+import os.path as osp
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import tempfile
+import threading
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+DEFAULT_MAX_SIZE = 2 * 1024 * 1024
+DEFAULT_MAX_CACHE_SIZE = 1024 * 1024 * 1024
+# a multiple of 3 bytes, so that chunks are base64 encoded independently
+CHUNK_SIZE = 63 * 1024
+TRELLO_HOSTS = ('trello.com', 'trello-attachments.s3.amazonaws.com')
+
+
+class AttachmentTooLarge(Exception):
+    """An exception to throw when an attachment exceeds the size cap"""
+
+
+def is_trello_hosted(attachment):
+    """ Tell whether a docido file attachment is hosted by trello
+
+    :param dict attachment: A docido attachment
+
+    :rtype: bool
+    """
+    if attachment.get('type') != u'file':
+        return False
+    host = urlparse(attachment.get('url') or '').netloc
+    return any(host == h or host.endswith('.' + h) for h in TRELLO_HOSTS)
+
+
+def content_opener(trello, timeout, per_host=2):
+    """ Create the callable opening the download of attachments contents
+
+    :param TrelloClient trello: The client downloading files uploaded to
+    trello.com, which require the account's credentials
+    :param timeout: The (connect, read) timeouts of other downloads, in
+    seconds
+    :param int per_host: Maximum number of connections per host
+
+    :return: A callable returning a streamed `requests` response from an
+    url, to be closed by the caller
+    """
+    # requests is expensive to import, see dpc_trello.crawler
+    import requests
+    session = requests.Session()
+    session.mount('https://', requests.adapters.HTTPAdapter(
+        pool_maxsize=per_host))
+
+    def open_stream(url):
+        if urlparse(url).netloc == 'trello.com':
+            return trello.download(url)
+        response = session.get(url, stream=True, timeout=timeout)
+        if response.status_code != 200:
+            response.close()
+            response.raise_for_status()
+        return response
+    return open_stream
+
+
+def content_kv_key(content_id):
+    """ Build the kv store key recording the upload of a content
+
+    :param str content_id: The content identifier, see
+    `AttachmentFetcher.content_id`
+
+    :rtype: str
+    """
+    return 'content:{}'.format(content_id)
+
+
+def card_contents_key(card_id):
+    """ Build the kv store key recording the contents uploaded for a card
+
+    :param str card_id: The card identifier
+
+    :rtype: str
+    """
+    return 'contents:{}'.format(card_id)
+
+
+def encode_content(path):
+    """ Base64 encode a file by chunks, without holding its raw content in
+    memory
+
+    :rtype: bytes
+    """
+    chunks = []
+    with open(path, 'rb') as istr:
+        for chunk in iter(lambda: istr.read(CHUNK_SIZE), b''):
+            chunks.append(base64.b64encode(chunk))
+    return b''.join(chunks)
+
+
+def delete_contents(push_api, content_ids):
+    """ Delete uploaded contents from the index's binary store
+
+    :param push_api: The IndexAPI contents were uploaded to
+    :param list content_ids: The contents identifiers
+    """
+    if not content_ids:
+        return
+    push_api.delete_thumbnails_by_id(list(content_ids))
+    for content_id in content_ids:
+        push_api.delete_kv(content_kv_key(content_id))
+
+
+def record_card_contents(push_api, card_id, content_ids):
+    """ Record the contents uploaded for a card, deleting the contents it
+    does not refer to anymore
+
+    :param push_api: The IndexAPI contents were uploaded to
+    :param str card_id: The card identifier
+    :param list content_ids: The contents the card refers to
+    """
+    content_ids = sorted(content_ids)
+    previous = push_api.get_kv(card_contents_key(card_id))
+    previous = json.loads(previous) if previous is not None else []
+    if previous == content_ids:
+        return
+    delete_contents(push_api, sorted(set(previous) - set(content_ids)))
+    if content_ids:
+        push_api.set_kv(card_contents_key(card_id), json.dumps(content_ids))
+    else:
+        push_api.delete_kv(card_contents_key(card_id))
+
+
+def delete_card_contents(push_api, card_ids, logger):
+    """ Delete the contents uploaded for deleted cards
+
+    :param push_api: The IndexAPI contents were uploaded to
+    :param list card_ids: The identifiers of the deleted documents, those
+    which are not cards are ignored
+    :param logger: A logging.logger instance
+    """
+    content_ids = []
+    for card_id in card_ids:
+        recorded = push_api.get_kv(card_contents_key(card_id))
+        if recorded is not None:
+            content_ids.extend(json.loads(recorded))
+            push_api.delete_kv(card_contents_key(card_id))
+    if content_ids:
+        logger.info('deleting {} attachments contents'.format(
+            len(content_ids)))
+        delete_contents(push_api, content_ids)
+
+
+class AttachmentFetcher(object):
+    """ Download attachments concurrently into a local cache, keyed by
+    attachment id and size so that unchanged files are downloaded once.
+    """
+
+    def __init__(self, directory, open_stream=None,
+                 max_size=DEFAULT_MAX_SIZE,
+                 max_cache_size=DEFAULT_MAX_CACHE_SIZE, concurrency=8,
+                 per_host=2):
+        """ Create a new fetcher
+
+        :param str directory: The cache directory
+        :param open_stream: A callable returning a streamed `requests`
+        response from an url, see `content_opener`, None to only use cached
+        contents
+        :param int max_size: Maximum size of a file, in bytes
+        :param int max_cache_size: Maximum size of the cache directory, in
+        bytes, see `evict`
+        :param int concurrency: Maximum number of concurrent downloads
+        :param int per_host: Maximum number of concurrent downloads per host
+        """
+        self.__directory = directory
+        self.__open_stream = open_stream
+        self.__max_size = max_size
+        self.__max_cache_size = max_cache_size
+        self.__concurrency = concurrency
+        self.__per_host = per_host
+        self.__host_slots = {}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def content_id(attachment):
+        """ Get the identifier of an attachment's content, which changes
+        with the content
+
+        :param dict attachment: A docido file attachment
+
+        :rtype: str
+        """
+        return '{}-{}'.format(attachment['origin_id'], attachment['size'])
+
+    def path(self, attachment):
+        """ Get the cache path of an attachment's content
+
+        :param dict attachment: A docido file attachment
+
+        :rtype: str
+        """
+        return osp.join(self.__directory, self.content_id(attachment))
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self.__lock:
+            slot = self.__host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.__per_host)
+                self.__host_slots[host] = slot
+        return slot
+
+    def _download(self, attachment, path):
+        """ Stream an attachment's content into the cache, never holding more
+        than a chunk in memory
+        """
+        slot = self._host_slot(attachment['url'])
+        with slot:
+            response = self.__open_stream(attachment['url'])
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.__directory,
+                                                suffix='.tmp')
+                try:
+                    size = 0
+                    with os.fdopen(fd, 'wb') as ostr:
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            size += len(chunk)
+                            if size > self.__max_size:
+                                raise AttachmentTooLarge(attachment['url'])
+                            ostr.write(chunk)
+                    os.rename(tmp_path, path)
+                except:
+                    os.remove(tmp_path)
+                    raise
+            finally:
+                response.close()
+
+    def fetch(self, attachments, logger):
+        """ Make sure the content of the given attachments is cached
+
+        :param list attachments: docido file attachments
+        :param logger: A logging.logger instance
+
+        :return: The cache path of every available content, by attachment
+        `origin_id`
+        :rtype: dict
+        """
+        try:
+            os.makedirs(self.__directory)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        paths = {}
+        pending = queue.Queue()
+        for attachment in attachments:
+            path = self.path(attachment)
+            if osp.exists(path):
+                # keep recently used contents, see `evict`
+                os.utime(path, None)
+                paths[attachment['origin_id']] = path
+            elif self.__open_stream is not None and \
+                    (attachment.get('size') or 0) <= self.__max_size:
+                pending.put((attachment, path))
+        downloads = pending.qsize()
+
+        def worker():
+            while True:
+                try:
+                    attachment, path = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self._download(attachment, path)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception('could not download attachment {}'.format(
+                        attachment['origin_id']))
+                else:
+                    with self.__lock:
+                        paths[attachment['origin_id']] = path
+
+        workers = [
+            threading.Thread(target=worker)
+            for _ in range(min(self.__concurrency, downloads))
+        ]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        logger.info('{} attachments available, {} downloaded'.format(
+            len(paths), downloads))
+        return paths
+
+    def evict(self):
+        """ Remove the least recently used contents until the cache fits
+        in its maximum size
+
+        :return: The number of removed contents
+        :rtype: int
+        """
+        if not osp.isdir(self.__directory):
+            return 0
+        contents = []
+        for name in os.listdir(self.__directory):
+            if name.endswith('.tmp'):
+                continue
+            path = osp.join(self.__directory, name)
+            stat = os.stat(path)
+            contents.append((stat.st_mtime, stat.st_size, path))
+        total = sum(c[1] for c in contents)
+        removed = 0
+        for _, size, path in sorted(contents):
+            if total <= self.__max_cache_size:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+
+def upload_contents(push_api, attachments, paths, logger):
+    """ Upload cached contents to the index's binary store, unless they
+    already were
+
+    :param push_api: The IndexAPI to upload contents to
+    :param list attachments: docido file attachments
+    :param dict paths: The cache path of the available contents, by
+    attachment `origin_id`
+    :param logger: A logging.logger instance
+
+    :return: The identifiers of the uploaded contents, by attachment
+    `origin_id`
+    :rtype: dict
+    """
+    content_ids = {}
+    uploads = 0
+    for attachment in attachments:
+        path = paths.get(attachment['origin_id'])
+        if path is None:
+            continue
+        content_id = AttachmentFetcher.content_id(attachment)
+        if push_api.get_kv(content_kv_key(content_id)) is None:
+            # the binary store only accepts whole base64 encoded items,
+            # a single encoded file is held in memory at a time
+            errors = push_api.push_thumbnails([(
+                content_id, encode_content(path),
+                attachment.get('mime_type') or 'application/octet-stream',
+            )])
+            if errors:
+                logger.error('could not upload attachment {}: {}'.format(
+                    attachment['origin_id'], errors))
+                continue
+            push_api.set_kv(content_kv_key(content_id), '1')
+            uploads += 1
+        content_ids[attachment['origin_id']] = content_id
+    logger.info('{} attachments contents uploaded'.format(uploads))
+    return content_ids
+
+
+def attach_contents(docido_cards, fetcher, push_api, logger):
+    """ Fetch and upload the content of the trello hosted files attached to
+    cards
+
+    :param list docido_cards: The cards to push, they are not modified
+    :param AttachmentFetcher fetcher: Where contents are fetched from
+    :param push_api: The IndexAPI to upload contents to
+    :param logger: A logging.logger instance
+
+    :return: The cards whose uploaded contents are referenced by the
+    `_content_id` field of their file attachments, see
+    `record_card_contents`
+    :rtype: list
+    """
+    hosted = [
+        a for card in docido_cards for a in card.get('attachments', [])
+        if is_trello_hosted(a)
+    ]
+    content_ids = {}
+    if hosted:
+        paths = fetcher.fetch(hosted, logger)
+        content_ids = upload_contents(push_api, hosted, paths, logger)
+        fetcher.evict()
+    result = []
+    for card in docido_cards:
+        attachments = card.get('attachments', [])
+        record_card_contents(push_api, card['id'], [
+            content_ids[a['origin_id']] for a in attachments
+            if is_trello_hosted(a) and a['origin_id'] in content_ids
+        ])
+        if any(a.get('origin_id') in content_ids for a in attachments
+               if is_trello_hosted(a)):
+            # attachments may be shared with cached snapshots
+            card = dict(card)
+            card['attachments'] = [
+                dict(a, _content_id=content_ids[a['origin_id']])
+                if is_trello_hosted(a) and a['origin_id'] in content_ids
+                else a
+                for a in attachments
+            ]
+        result.append(card)
+    return result
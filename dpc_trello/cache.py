@@ -0,0 +1,98 @@
+"""Local cache of boards snapshots shared by all crawled accounts"""
+
+import errno
+import gzip
+import json
+import os
+import os.path as osp
+import tempfile
+
+
+def dump_json_gz(path, obj):
+    """ Atomically write a gzip compressed JSON file, so that concurrent
+    readers never see a partially written file
+
+    :param str path: The file to write
+    :param obj: The JSON serializable object to write
+    """
+    directory = osp.dirname(path)
+    try:
+        os.makedirs(directory)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw_ostr:
+            with gzip.GzipFile(fileobj=raw_ostr, mode='wb') as ostr:
+                ostr.write(json.dumps(obj, separators=(',', ':')).encode())
+        os.rename(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def load_json_gz(path):
+    """ Read a gzip compressed JSON file
+
+    :param str path: The file to read
+
+    :return: The decoded object, or None if the file does not exist
+    """
+    try:
+        with gzip.open(path, 'rb') as istr:
+            return json.loads(istr.read().decode('utf-8'))
+    except IOError as exc:
+        if exc.errno == errno.ENOENT:
+            return None
+        raise
+
+
+class BoardSnapshotCache(object):
+    """ A directory of user independent boards documents, keyed by board
+    identifier and snapshot key. Keys are opaque to the cache, the crawler
+    builds them with `dpc_trello.crawler.board_snapshot_key` from the
+    board's `dateLastActivity` and what the documents depend on.
+
+    Every board has a single snapshot file, replaced as soon as the board
+    is crawled with another key.
+    """
+
+    def __init__(self, directory):
+        """ Create a cache backed by a local directory
+
+        :param str directory: The directory where snapshots are stored, it
+        is created on first write
+        """
+        self.__directory = directory
+
+    def _path(self, board_id):
+        return osp.join(self.__directory, '{}.json.gz'.format(board_id))
+
+    def get(self, board_id, key):
+        """ Retrieve a board's snapshot
+
+        :param str board_id: The board identifier
+        :param str key: The board's current snapshot key
+
+        :return: The snapshot entries, or None if the board is not cached or
+        its snapshot was made with another key
+        :rtype: list
+        """
+        snapshot = load_json_gz(self._path(board_id))
+        if snapshot is None or snapshot.get('key') != key:
+            return None
+        return snapshot['entries']
+
+    def put(self, board_id, key, entries):
+        """ Store a board's snapshot
+
+        :param str board_id: The board identifier
+        :param str key: The board's snapshot key at the time entries were
+        fetched
+        :param list entries: The snapshot entries
+        """
+        dump_json_gz(self._path(board_id), dict(
+            key=key,
+            entries=entries,
+        ))
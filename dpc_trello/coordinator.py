@@ -0,0 +1,644 @@
+"""Coordination of the crawl of many accounts across a fleet of nodes
+
+The tasks generated by `TrelloCrawler.iter_crawl_tasks` for every account
+are put in a durable queue, a SQLite database shared by the nodes:
+
+    from dpc_trello.coordinator import TaskQueue, run_node, submit_crawl
+
+    queue = TaskQueue('/shared/crawls.db')
+    for token_id, token in tokens:
+        submit_crawl(queue, crawler, create_index, token_id, token, config,
+                     logger, max_leases=4)
+
+and every node pulls sequences of tasks from it, whatever the account:
+
+    run_node(queue, create_index, get_token, 'node-1', logger)
+
+The queue only holds JSON: tasks are stored as descriptions of partials of
+the functions of `TASK_MODULES`, see `encode_task`, and the OAuth token of
+an account is resolved by every node from its identifier.
+
+A node leases a sequence of tasks, the board tasks of an account, and
+extends its lease with heartbeats while running it. The sequences of a node
+which stops sending heartbeats are leased again by other nodes. The number
+of sequences leased at a time for an account is capped, and accounts with
+the fewest leased sequences are served first, so that idle nodes share the
+work of the biggest accounts.
+
+The epilogue of an account is run by the node completing its last
+sequence, with the results of all sequences of the account, failed
+sequences giving an exception as with the docido SDK.
+"""
+
+from contextlib import contextmanager
+import functools
+import importlib
+import inspect
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from docido_sdk.toolbox.collections_ext import nameddict
+
+import dpc_trello.crawler
+from dpc_trello.runner import (
+    WORKER,
+    RateLimiter,
+    TaskError,
+    run_sequence,
+    task_name,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    token_id TEXT PRIMARY KEY,
+    config TEXT NOT NULL,
+    epilogue TEXT,
+    max_leases INTEGER,
+    state TEXT NOT NULL,
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    submitted REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sequences (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    tasks TEXT NOT NULL,
+    state TEXT NOT NULL,
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS sequences_state
+    ON sequences (state, token_id);
+"""
+
+# states of an account
+CRAWLING = 'crawling'
+EPILOGUE = 'epilogue'
+DONE = 'done'
+
+# states of a sequence, FAILED is also the state of an account whose
+# epilogue failed
+PENDING = 'pending'
+LEASED = 'leased'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+# modules whose functions can be run by nodes
+TASK_MODULES = ('dpc_trello.crawler', 'dpc_trello.profiling')
+
+SCALARS = (str, type(u''), int, float, bool, type(None))
+
+
+def encode_task(value):
+    """ Describe a task, or one of its arguments, as JSON serializable data
+
+    :param value: A function of `TASK_MODULES`, a functools.partial of such
+    a function, or JSON serializable data
+
+    :raise ValueError: if the value cannot be described
+    """
+    if isinstance(value, functools.partial):
+        return dict(partial=[
+            encode_task(value.func),
+            [encode_task(arg) for arg in value.args],
+            encode_task(value.keywords or {}),
+        ])
+    if inspect.isfunction(value):
+        if value.__module__ not in TASK_MODULES:
+            raise ValueError('not a task function: {}.{}'.format(
+                value.__module__, value.__name__))
+        return dict(function=[value.__module__, value.__name__])
+    if isinstance(value, dict):
+        return dict(dict={k: encode_task(v) for k, v in value.iteritems()})
+    if isinstance(value, (list, tuple)):
+        return [encode_task(item) for item in value]
+    if isinstance(value, SCALARS):
+        return value
+    raise ValueError('cannot describe task argument: {!r}'.format(value))
+
+
+def decode_task(value):
+    """ Build a task, or one of its arguments, from its description given
+    by `encode_task`
+
+    :raise ValueError: if the description refers to a function outside of
+    `TASK_MODULES`
+    """
+    if isinstance(value, list):
+        return [decode_task(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if 'partial' in value:
+        func, args, keywords = value['partial']
+        return functools.partial(decode_task(func), *decode_task(args),
+                                 **decode_task(keywords))
+    if 'function' in value:
+        module, name = value['function']
+        func = getattr(importlib.import_module(module), name, None) \
+            if module in TASK_MODULES else None
+        if not inspect.isfunction(func) or name.startswith('_'):
+            raise ValueError('not a task function: {}.{}'.format(
+                module, name))
+        return func
+    return {
+        str(k): decode_task(v) for k, v in value['dict'].iteritems()
+    }
+
+
+def dumps(obj):
+    return json.dumps(obj)
+
+
+def loads(text):
+    return json.loads(text)
+
+
+def check_config(config):
+    """ Ensure a crawl configuration can be run across nodes
+
+    :param nameddict config: crawl configuration
+
+    :raise ValueError: if boards indexes are stored in a directory which is
+    not shared by the nodes, the epilogue of an account is not run by the
+    nodes which wrote them
+    """
+    if config.get('state_dir') and not config.get('state_dir_shared'):
+        raise ValueError(
+            "'state_dir' must be reachable by every node, "
+            "set 'state_dir_shared' once it is")
+
+
+class Lease(object):
+    """ Work leased by a node: either a sequence of tasks of an account, or
+    the epilogue of an account
+    """
+
+    def __init__(self, kind, lease_id, token_id, config, payload):
+        """
+        :param str kind: `sequence` or `epilogue`
+        :param int lease_id: The sequence identifier, None for an epilogue
+        :param str token_id: The account identifier
+        :param nameddict config: The account's crawl configuration
+        :param payload: The tasks of the sequence, or a tuple made of the
+        epilogue and the results of the account's sequences, failed
+        sequences giving a `dpc_trello.runner.TaskError`
+        """
+        self.kind = kind
+        self.id = lease_id
+        self.token_id = token_id
+        self.config = config
+        self.payload = payload
+
+    def __repr__(self):
+        if self.kind == 'epilogue':
+            return 'epilogue of {}'.format(self.token_id)
+        return 'sequence {} of {}'.format(self.id, self.token_id)
+
+
+class TaskQueue(object):
+    """ A durable queue of crawl tasks, backed by a SQLite database
+    """
+
+    def __init__(self, path, lease_duration=300, max_attempts=3,
+                 clock=time.time):
+        """ Open a queue, creating its database if needed
+
+        :param str path: The SQLite database, reachable by every node
+        :param float lease_duration: Number of seconds a lease lasts
+        without heartbeat
+        :param int max_attempts: Number of leases of a sequence whose lease
+        expired, or of an epilogue which failed, before it is considered as
+        failed
+        :param clock: A callable giving the current time, in seconds
+        """
+        self.path = path
+        self.lease_duration = lease_duration
+        self.max_attempts = max_attempts
+        self.clock = clock
+        conn = sqlite3.connect(path, timeout=60)
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        # a connection per transaction, so that heartbeats can be sent
+        # from another thread
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except:
+                conn.execute('ROLLBACK')
+                raise
+            else:
+                conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def submit(self, token_id, config, crawl_tasks, max_leases=None):
+        """ Put the crawl tasks of an account in the queue
+
+        :param str token_id: The account identifier
+        :param nameddict config: crawl configuration
+        :param dict crawl_tasks: The tasks returned by
+        `TrelloCrawler.iter_crawl_tasks`
+        :param int max_leases: Maximum number of sequences of the account
+        leased at a time, unlimited if None
+
+        :raise ValueError: if the previous crawl of the account is not
+        over, if the configuration cannot be run across nodes, see
+        `check_config`, or if a task cannot be described, see `encode_task`
+        """
+        check_config(config)
+        epilogue = crawl_tasks.get('epilogue')
+        sequences = [
+            (token_id, ', '.join(task_name(t) for t in tasks),
+             dumps(encode_task(list(tasks))), PENDING)
+            for tasks in crawl_tasks['tasks']
+        ]
+        with self._transaction() as conn:
+            row = conn.execute(
+                'SELECT state FROM accounts WHERE token_id = ?', (token_id,)
+            ).fetchone()
+            if row is not None and row[0] not in (DONE, FAILED):
+                raise ValueError(
+                    'crawl of account {} is not done'.format(token_id))
+            conn.execute('DELETE FROM sequences WHERE token_id = ?',
+                         (token_id,))
+            conn.execute(
+                'INSERT OR REPLACE INTO accounts (token_id, config, '
+                'epilogue, max_leases, state, submitted) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (token_id, dumps(config),
+                 dumps(encode_task(epilogue)) if epilogue else None,
+                 max_leases, CRAWLING, self.clock())
+            )
+            conn.executemany(
+                'INSERT INTO sequences (token_id, name, tasks, state) '
+                'VALUES (?, ?, ?, ?)', sequences)
+            self._complete_account(conn, token_id)
+
+    def _expire_leases(self, conn, now):
+        expired = conn.execute(
+            'SELECT id, token_id, attempts FROM sequences '
+            'WHERE state = ? AND lease_expires < ?', (LEASED, now)
+        ).fetchall()
+        for seq_id, token_id, attempts in expired:
+            if attempts < self.max_attempts:
+                conn.execute(
+                    'UPDATE sequences SET state = ?, owner = NULL, '
+                    'lease_expires = NULL WHERE id = ?', (PENDING, seq_id))
+            else:
+                conn.execute(
+                    'UPDATE sequences SET state = ?, error = ? WHERE id = ?',
+                    (FAILED, 'lease expired {} times'.format(attempts),
+                     seq_id))
+                self._complete_account(conn, token_id)
+        conn.execute(
+            'UPDATE accounts SET state = ?, owner = NULL, '
+            'lease_expires = NULL, error = COALESCE(error, ?) '
+            'WHERE state = ? AND (owner IS NULL OR lease_expires < ?) '
+            'AND attempts >= ?',
+            (FAILED, 'lease expired', EPILOGUE, now, self.max_attempts))
+
+    def _complete_account(self, conn, token_id):
+        """ Move an account whose sequences are all done to its epilogue,
+        or to the `done` state when there is nothing to run
+
+        :return: True if the account's epilogue must be run
+        """
+        remaining, = conn.execute(
+            'SELECT SUM(state IN (?, ?)) FROM sequences '
+            'WHERE token_id = ?', (PENDING, LEASED, token_id)
+        ).fetchone()
+        if remaining:
+            return False
+        state, epilogue = conn.execute(
+            'SELECT state, epilogue FROM accounts WHERE token_id = ?',
+            (token_id,)
+        ).fetchone()
+        if state != CRAWLING:
+            return False
+        if epilogue is None:
+            conn.execute('UPDATE accounts SET state = ? WHERE token_id = ?',
+                         (DONE, token_id))
+            return False
+        conn.execute('UPDATE accounts SET state = ?, owner = NULL, '
+                     'lease_expires = NULL, attempts = 0 '
+                     'WHERE token_id = ?', (EPILOGUE, token_id))
+        return True
+
+    def _lease_epilogue(self, conn, token_id, node, now):
+        conn.execute(
+            'UPDATE accounts SET owner = ?, lease_expires = ?, '
+            'attempts = attempts + 1 WHERE token_id = ?',
+            (node, now + self.lease_duration, token_id))
+        config, epilogue = conn.execute(
+            'SELECT config, epilogue FROM accounts WHERE token_id = ?',
+            (token_id,)
+        ).fetchone()
+        results = [
+            loads(result) if state == SUCCEEDED else TaskError(name, error)
+            for name, state, result, error in conn.execute(
+                'SELECT name, state, result, error FROM sequences '
+                'WHERE token_id = ? ORDER BY id', (token_id,)
+            )
+        ]
+        return Lease('epilogue', None, token_id, nameddict(loads(config)),
+                     (decode_task(loads(epilogue)), results))
+
+    def lease(self, node):
+        """ Lease the next work to do
+
+        Epilogues which failed or whose node stopped sending heartbeats
+        come first, then the sequences of the accounts having the fewest
+        leased sequences, within their `max_leases` cap.
+
+        :param str node: The node identifier
+
+        :return: The leased work, None if there is nothing to do for now
+        :rtype: Lease
+        """
+        now = self.clock()
+        with self._transaction() as conn:
+            self._expire_leases(conn, now)
+            row = conn.execute(
+                'SELECT token_id FROM accounts WHERE state = ? '
+                'AND (owner IS NULL OR lease_expires < ?) LIMIT 1',
+                (EPILOGUE, now)
+            ).fetchone()
+            if row is not None:
+                return self._lease_epilogue(conn, row[0], node, now)
+            row = conn.execute(
+                'SELECT s.id, s.token_id, s.tasks, a.config '
+                'FROM sequences s JOIN accounts a USING (token_id) '
+                'LEFT JOIN (SELECT token_id, COUNT(*) AS leased '
+                '           FROM sequences WHERE state = ? '
+                '           GROUP BY token_id) l USING (token_id) '
+                'WHERE s.state = ? AND (a.max_leases IS NULL '
+                '      OR COALESCE(l.leased, 0) < a.max_leases) '
+                'ORDER BY COALESCE(l.leased, 0), a.submitted, s.id LIMIT 1',
+                (LEASED, PENDING)
+            ).fetchone()
+            if row is None:
+                return None
+            seq_id, token_id, tasks, config = row
+            conn.execute(
+                'UPDATE sequences SET state = ?, owner = ?, '
+                'lease_expires = ?, attempts = attempts + 1 WHERE id = ?',
+                (LEASED, node, now + self.lease_duration, seq_id)
+            )
+        return Lease('sequence', seq_id, token_id, nameddict(loads(config)),
+                     decode_task(loads(tasks)))
+
+    def heartbeat(self, lease, node):
+        """ Extend a lease
+
+        :param Lease lease: The lease to extend
+        :param str node: The node identifier
+
+        :return: False if the lease was lost, and the work given to another
+        node
+        :rtype: bool
+        """
+        expires = self.clock() + self.lease_duration
+        with self._transaction() as conn:
+            if lease.kind == 'epilogue':
+                cursor = conn.execute(
+                    'UPDATE accounts SET lease_expires = ? WHERE token_id = ? '
+                    'AND state = ? AND owner = ?',
+                    (expires, lease.token_id, EPILOGUE, node))
+            else:
+                cursor = conn.execute(
+                    'UPDATE sequences SET lease_expires = ? WHERE id = ? '
+                    'AND state = ? AND owner = ?',
+                    (expires, lease.id, LEASED, node))
+            return cursor.rowcount == 1
+
+    def complete(self, lease, node, outcomes=None):
+        """ Record the completion of leased work
+
+        :param Lease lease: The completed lease
+        :param str node: The node identifier
+        :param list outcomes: The outcomes of the sequence's tasks, see
+        `dpc_trello.runner.run_sequence`
+
+        :return: The lease of the account's epilogue when the sequence was
+        the account's last one, for the node to run it, None otherwise
+        :rtype: Lease
+        """
+        with self._transaction() as conn:
+            if lease.kind == 'epilogue':
+                conn.execute(
+                    'UPDATE accounts SET state = ?, owner = NULL, '
+                    'lease_expires = NULL WHERE token_id = ? AND owner = ?',
+                    (DONE, lease.token_id, node))
+                return None
+            errors = [o for o in outcomes if 'error' in o]
+            if errors:
+                error = errors[-1]['error']
+                update = (FAILED, None, getattr(error, 'error', str(error)))
+            else:
+                result = outcomes[-1]['result'] if outcomes else None
+                update = (SUCCEEDED, dumps(result), None)
+            cursor = conn.execute(
+                'UPDATE sequences SET state = ?, result = ?, error = ?, '
+                'lease_expires = NULL WHERE id = ? AND state = ? '
+                'AND owner = ?', update + (lease.id, LEASED, node))
+            if cursor.rowcount != 1:
+                # lease lost, the sequence is run by another node
+                return None
+            if self._complete_account(conn, lease.token_id):
+                return self._lease_epilogue(conn, lease.token_id, node,
+                                            self.clock())
+        return None
+
+    def release(self, lease, node, error):
+        """ Give up leased work which could not be run, so that it is leased
+        again, or considered as failed after `max_attempts` attempts
+
+        :param Lease lease: The lease
+        :param str node: The node identifier
+        :param str error: The error raised while running the work
+        """
+        with self._transaction() as conn:
+            if lease.kind == 'epilogue':
+                conn.execute(
+                    'UPDATE accounts SET owner = NULL, lease_expires = NULL, '
+                    'error = ? WHERE token_id = ? AND state = ? '
+                    'AND owner = ?',
+                    (error, lease.token_id, EPILOGUE, node))
+                return
+            cursor = conn.execute(
+                'UPDATE sequences SET state = CASE WHEN attempts < ? '
+                'THEN ? ELSE ? END, owner = NULL, lease_expires = NULL, '
+                'error = ? WHERE id = ? AND state = ? AND owner = ?',
+                (self.max_attempts, PENDING, FAILED, error, lease.id, LEASED,
+                 node))
+            if cursor.rowcount == 1:
+                # the epilogue is leased by the next node asking for work
+                self._complete_account(conn, lease.token_id)
+
+    def status(self):
+        """ Get the number of sequences by state, and of accounts by state
+
+        :rtype: dict
+        """
+        with self._transaction() as conn:
+            return dict(
+                sequences=dict(conn.execute(
+                    'SELECT state, COUNT(*) FROM sequences GROUP BY state')),
+                accounts=dict(conn.execute(
+                    'SELECT state, COUNT(*) FROM accounts GROUP BY state')),
+            )
+
+    def drained(self):
+        """ Whether every submitted crawl is over
+        """
+        return set(self.status()['accounts']) <= {DONE, FAILED}
+
+
+def submit_crawl(queue, crawler, index_factory, token_id, token, config,
+                 logger, max_leases=None):
+    """ Generate the crawl tasks of an account and put them in a queue
+
+    The token is only used to generate the tasks, nodes resolve it from the
+    account identifier, see `run_node`.
+
+    :param TaskQueue queue: The queue
+    :param crawler: The crawler generating the tasks
+    :param index_factory: A callable creating the IndexAPI of an account
+    from its identifier
+    :param str token_id: The account identifier
+    :param token: an OauthToken object
+    :param dict config: crawl configuration
+    :param logger: A logging.logger instance
+    :param int max_leases: Maximum number of sequences of the account run
+    at a time, unlimited if None
+    """
+    config = nameddict(config)
+    config.setdefault('full', False)
+    check_config(config)
+    crawl_tasks = crawler.iter_crawl_tasks(index_factory(token_id), token,
+                                           config, logger)
+    queue.submit(token_id, config, crawl_tasks, max_leases)
+    logger.info('{} sequences of account {} submitted'.format(
+        len(crawl_tasks['tasks']), token_id))
+
+
+class Heartbeat(threading.Thread):
+    """ A thread extending a lease until stopped
+    """
+
+    def __init__(self, queue, lease, node, interval):
+        super(Heartbeat, self).__init__()
+        self.daemon = True
+        self.__queue = queue
+        self.__lease = lease
+        self.__node = node
+        self.__interval = interval
+        self.__stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.__stopped.wait(self.__interval):
+            if not self.__queue.heartbeat(self.__lease, self.__node):
+                self.lost = True
+                return
+
+    def stop(self):
+        self.__stopped.set()
+        self.join()
+
+
+def run_lease(queue, lease, index_factory, token_factory, node, logger,
+              heartbeat):
+    """ Run leased work while sending heartbeats. The remaining tasks of a
+    sequence are not run once its lease is lost. Work which cannot be run,
+    for instance because the account's token cannot be resolved, is
+    released, see `TaskQueue.release`.
+
+    :return: The lease of the account's epilogue if it must be run next
+    :rtype: Lease
+    """
+    beat = Heartbeat(queue, lease, node, heartbeat)
+    beat.start()
+    try:
+        WORKER.update(
+            index=index_factory(lease.token_id),
+            token=token_factory(lease.token_id),
+            config=lease.config,
+            logger=logging.getLogger('dpc_trello.coordinator.worker'),
+        )
+        if lease.kind == 'epilogue':
+            epilogue, results = lease.payload
+            epilogue(WORKER['index'], WORKER['token'], results, lease.config,
+                     WORKER['logger'])
+            outcomes = None
+        else:
+            outcomes = run_sequence(lease.payload, lambda: beat.lost)
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.exception('{} failed'.format(lease))
+        queue.release(lease, node, repr(exc))
+        return None
+    finally:
+        beat.stop()
+    if beat.lost:
+        # the work is given to another node
+        logger.warning('lease of {} was lost'.format(lease))
+        return None
+    return queue.complete(lease, node, outcomes)
+
+
+def run_node(queue, index_factory, token_factory, node, logger, heartbeat=30,
+             poll=5, rate_limit=None, until_drained=True):
+    """ Run the work of a queue until it is drained
+
+    :param TaskQueue queue: The queue
+    :param index_factory: A callable creating the IndexAPI of an account
+    from its identifier
+    :param token_factory: A callable giving the OauthToken object of an
+    account from its identifier
+    :param str node: A unique identifier of the node
+    :param logger: A logging.logger instance
+    :param float heartbeat: Number of seconds between heartbeats, must be
+    lower than the queue's lease duration
+    :param float poll: Number of seconds to wait when there is no work
+    available
+    :param float rate_limit: Maximum number of trello requests per second
+    of the node
+    :param bool until_drained: Whether to return once every submitted crawl
+    is done, instead of waiting for new crawls
+
+    :return: The number of leases run
+    :rtype: int
+    """
+    if rate_limit:
+        dpc_trello.crawler.RATE_LIMITER = RateLimiter(rate_limit)
+    count = 0
+    while True:
+        lease = queue.lease(node)
+        if lease is None:
+            if until_drained and queue.drained():
+                break
+            time.sleep(poll)
+            continue
+        while lease is not None:
+            logger.info('node {} runs {}'.format(node, lease))
+            count += 1
+            lease = run_lease(queue, lease, index_factory, token_factory,
+                              node, logger, heartbeat)
+    logger.info('node {} ran {} leases'.format(node, count))
+    return count
@@ -3,7 +3,10 @@
 import codecs
 from contextlib import closing
 import functools
-import mimetypes
+import hashlib
+import heapq
+import json
+import logging
 import os.path as osp
 try:
     from cStringIO import StringIO
@@ -11,34 +14,153 @@ except ImportError:
     from StringIO import StringIO
 import time
 
-import markdown
-
 from docido_sdk.core import Component, implements
 from docido_sdk.crawler import ICrawler
-from docido_sdk.toolbox.rate_limits import teb_retry
-from docido_sdk.toolbox.date_ext import timestamp_ms
-from docido_sdk.toolbox.text import to_unicode
-from dateutil import parser
 
-from dpc_trello.trello import TrelloClient, TrelloClientException
+from dpc_trello.attachments import (
+    AttachmentFetcher,
+    DEFAULT_MAX_CACHE_SIZE,
+    DEFAULT_MAX_SIZE,
+    attach_contents,
+    content_opener,
+    delete_card_contents,
+)
+from dpc_trello.cache import BoardSnapshotCache
+from dpc_trello.fingerprints import (
+    FingerprintStore,
+    encode_id,
+    fingerprint,
+    merge_removed,
+)
+from dpc_trello.models import Card, Member
+from dpc_trello.output import compact_card, keeps_embed, payload_size
+from dpc_trello.planner import plan_crawl
+from dpc_trello.profiling import profiled, should_profile
+from dpc_trello.refresh import record_crawl, schedule
+from dpc_trello.scope import (
+    board_in_scope,
+    boards_filter,
+    cards_filter,
+    cards_scope_key,
+    list_in_scope,
+)
+from dpc_trello.snapshot import RawSnapshotStore
+from dpc_trello.trello import (
+    DEFAULT_TIMEOUT,
+    TrelloClient,
+    TrelloClientException,
+)
+
+# markdown, dateutil, mimetypes and most of the docido SDK toolbox are
+# expensive to import, they are imported on first use so that processes
+# only planning tasks or running a single one start faster.
 
 UTF8_CODEC = codecs.lookup("utf8")
 CREATE_CARD_ACTION = 'createCard'
 COMMENT_CARD_ACTION = 'commentCard'
+BOARD_ACTIONS = 'createCard,commentCard,copyCard,convertToCardFromCheckItem'
+BOARD_ACTIONS_LIMIT = 1000
+BOARD_ACTION_FIELDS = 'data,date,idMemberCreator,type'
+INDEX_KINDS = ('cards', 'members')
+BOARD_CARD_FIELDS = ','.join([
+    'closed', 'dateLastActivity', 'desc', 'idLabels', 'idList', 'idMembers',
+    'name', 'shortUrl', 'subscribed',
+])
+
+# rate limiter shared by the trello clients of the process, installed by
+# the workers of dpc_trello.runner
+RATE_LIMITER = None
+
 
-def create_trello_client(token):
+def lazy_teb_retry(**kwargs):
+    """ Same decorator as docido SDK's `teb_retry`, but the SDK is only
+    imported when the decorated function is first called
+
+    :param kwargs: `teb_retry` parameters
+    """
+    def wrap(func):
+        retried = []
+
+        @functools.wraps(func)
+        def wrapped_func(*args, **func_kwargs):
+            if not retried:
+                from docido_sdk.toolbox.rate_limits import teb_retry
+                retried.append(teb_retry(**kwargs)(func))
+            return retried[0](*args, **func_kwargs)
+        return wrapped_func
+    return wrap
+
+def create_trello_client(token, config=None):
     """ Create and return a trello client from a provided oauth token
 
+    The following optional crawl configuration keys are honored:
+
+    - `request_timeout`: (connect, read) timeouts of requests, in seconds
+    - `hedge_percentile`: latency percentile after which GET requests are
+      hedged
+    - `hedge_min_samples`: number of observed latencies before requests
+      are hedged
+
     :param token: a docido_sdk specified OauthToken
+    :param nameddict config: crawl configuration
 
     :return: a trello client instance
     """
+    config = config or {}
     return TrelloClient(
         consumer_key=token.consumer_key,
-        token=token.access_token
+        token=token.access_token,
+        timeout=tuple(config.get('request_timeout', DEFAULT_TIMEOUT)),
+        hedge_percentile=config.get('hedge_percentile'),
+        hedge_min_samples=config.get('hedge_min_samples', 20),
+        rate_limiter=RATE_LIMITER,
     )
 
 
+def token_key(token):
+    """ Compute a stable and anonymous identifier of an oauth token, usable
+    in file names
+
+    :param token: a docido_sdk specified OauthToken
+
+    :return: the token identifier
+    :rtype: str
+    """
+    return hashlib.sha1(token.access_token).hexdigest()
+
+
+def fingerprint_store(token, config):
+    """ Get the store of the boards documents indexes of an account, as
+    configured by the `state_dir` crawl configuration
+
+    :param token: a docido_sdk specified OauthToken
+    :param nameddict config: crawl configuration
+
+    :return: The account's store, None if not configured
+    :rtype: FingerprintStore
+    """
+    if not config.get('state_dir'):
+        return None
+    # boards are shared by accounts, each pushing to its own index
+    return FingerprintStore(osp.join(config.state_dir, token_key(token)))
+
+
+def raw_snapshots(token, config):
+    """ Get the store of the raw trello responses of an account, as
+    configured by the `raw_snapshot_dir` crawl configuration
+
+    :param token: a docido_sdk specified OauthToken
+    :param nameddict config: crawl configuration
+
+    :return: the account's store, or None if raw responses are not persisted
+    :rtype: RawSnapshotStore
+    """
+    if not config.get('raw_snapshot_dir'):
+        return None
+    return RawSnapshotStore(osp.join(config.raw_snapshot_dir,
+                                     token_key(token)))
+
+
 def date_to_timestamp(str_date):
     """ Convert an str formatted date to an UNIX timestamp
 
@@ -50,6 +172,7 @@ def date_to_timestamp(str_date):
     # As pylint cannot infer parser.parse return type because multiple return
     # types are possible the specific induced error is disabled
     # pylint: disable=no-member
+    from dateutil import parser
     date = parser.parse(str_date)
     return int(
         time.mktime(date.utctimetuple()) * 1e3 + date.microsecond / 1e3
@@ -209,15 +332,16 @@ class file_type(object):
 
 
 def pick_mime_type(attachment):
-    mime_type = attachment.get('mimeType')
+    mime_type = attachment.mime_type
     if mime_type is not None:
         return mime_type
-    mime_type, _ = mimetypes.guess_type(attachment['name'])
+    import mimetypes
+    mime_type, _ = mimetypes.guess_type(attachment.name)
     return mime_type
 
 
 def pick_filetype(attachment):
-    return file_type.guess_filetype(attachment['name'])
+    return file_type.guess_filetype(attachment.name)
 
 
 def thumbnail_from_avatar_hash(avatar_hash):
@@ -235,38 +359,86 @@ def thumbnail_from_avatar_hash(avatar_hash):
     )
 
 
-def get_last_gen(push_api):
-    """ Retrieve last stored generation from kv store
+class MemberTable(object):
+    """ Authors representations of a board's members, built once per member
+    and shared by every card and comment referring to it
+    """
 
-    :param push_api: The IndexAPI to use to query and retrieve last generation
+    UNKNOWN_AUTHOR = dict(name=None, username=None, thumbnail=u'')
 
-    :return: Last stored generation for trello cards
-    :rtype: int
-    """
-    last_gen = push_api.get_kv('last_gen')
-    if last_gen is not None:
-        return int(last_gen)
-    return 0
+    def __init__(self, members, fetch=None):
+        """ Create a table from the members of a board
 
+        :param list members: The board's members, as returned by trello's API
+        :param fetch: An optional callable returning a member which is not
+        part of the board anymore from its identifier, or None
+        """
+        self.__members = {m['id']: Member(m) for m in members}
+        self.__authors = {}
+        self.__fetch = fetch
+        self.fetched = []
 
-def set_last_gen(push_api, last_gen):
-    """ Set last kv stored generation to the supplied value
+    def author(self, member_id):
+        """ Get the author representation of a member
 
+        :param str member_id: The member identifier
 
-    :param push_api: The IndexAPI to use to set last generation
-    :param int last_gen: The last generation to store in kv store
+        :return: The member's name, username and thumbnail, or
+        `UNKNOWN_AUTHOR` if the member cannot be found
+        :rtype: dict
+        """
+        if member_id is None:
+            return self.UNKNOWN_AUTHOR
+        author = self.__authors.get(member_id)
+        if author is not None:
+            return author
+        member = self.__members.get(member_id)
+        if member is None and self.__fetch is not None:
+            member = self.__fetch(member_id)
+            if member is not None:
+                self.fetched.append(member)
+                member = Member(member)
+        if member is None:
+            author = self.UNKNOWN_AUTHOR
+        else:
+            author = dict(
+                name=member.full_name,
+                username=member.username,
+                thumbnail=thumbnail_from_avatar_hash(member.avatar_hash),
+            )
+        self.__authors[member_id] = author
+        return author
+
+
+# kv store key of the account wide generation of crawls run before boards
+# had their own state
+LEGACY_GEN_KEY = 'last_gen'
+
+
+def get_legacy_gen(push_api):
+    """ Retrieve the account wide generation stored by crawls run before
+    boards had their own state
+
+    :param push_api: The IndexAPI to use to retrieve the generation
+
+    :return: The generation, None once the account was migrated, see
+    `remove_old_gen`
+    :rtype: int
     """
-    push_api.set_kv('last_gen', str(last_gen))
+    last_gen = push_api.get_kv(LEGACY_GEN_KEY)
+    if last_gen is not None:
+        return int(last_gen)
+    return None
 
 
-def generate_last_gen_query(last_gen):
-    """ Generate an elasticsearch query to select all document from a previous
-    generation
+def generate_legacy_gen_query(last_gen):
+    """ Generate an elasticsearch query to select all documents left stale
+    by the crawls run before boards had their own state
 
-    :param int last_gen: The generation to select
+    :param int last_gen: The account wide generation, see `get_legacy_gen`
 
-    :return: A query to select all document with a generation <= to provided
-    last_gen_value
+    :return: A query to select all documents with a generation lower than
+    the provided one
     """
     return {
         'query': {
@@ -279,26 +451,543 @@ def generate_last_gen_query(last_gen):
     }
 
 
-def remove_old_gen(push_api, token, prev_results, config, logger):
+def board_state_key(board_id):
+    """ Build the kv store key holding the state of a board
+
+    :param str board_id: A trello board identifier
+
+    :return: The kv store key of the board's state
+    :rtype: str
+    """
+    return 'board:{}'.format(board_id)
+
+
+def get_board_state(push_api, board_id):
+    """ Retrieve a board's state (generation and pushed document ids) from kv
+    store
+
+    :param push_api: The IndexAPI to use to retrieve the board's state
+    :param str board_id: A trello board identifier
+
+    :return: A dict with the board's last generation (`gen`) and the ids of
+    the cards and members pushed by the board's last successful tasks. The
+    generation of boards without state starts from the account wide one,
+    if any, see `get_legacy_gen`
+    :rtype: dict
+    """
+    state = dict(gen=0, cards=[], members=[])
+    raw_state = push_api.get_kv(board_state_key(board_id))
+    if raw_state is not None:
+        state.update(json.loads(raw_state))
+    else:
+        # documents pushed by the board are not mistaken for documents
+        # left stale by crawls run before migration
+        state['gen'] = get_legacy_gen(push_api) or 0
+    return state
+
+
+def set_board_state(push_api, board_id, state):
+    """ Store a board's state in kv store
+
+    :param push_api: The IndexAPI to use to set the board's state
+    :param str board_id: A trello board identifier
+    :param dict state: The board's state, as returned by `get_board_state`
+    """
+    push_api.set_kv(board_state_key(board_id), json.dumps(state))
+
+
+def get_last_gen(push_api, board_id):
+    """ Retrieve last stored generation of a board from kv store
+
+    :param push_api: The IndexAPI to use to query and retrieve last generation
+    :param str board_id: A trello board identifier
+
+    :return: Last stored generation for the board's documents
+    :rtype: int
+    """
+    return int(get_board_state(push_api, board_id)['gen'])
+
+
+def refresh_state_key(board_id):
+    """ Build the kv store key holding the refresh state of a board
+
+    :param str board_id: A trello board identifier
+
+    :return: The kv store key of the board's refresh state
+    :rtype: str
+    """
+    return 'refresh:{}'.format(board_id)
+
+
+def get_refresh_state(push_api, board_id):
+    """ Retrieve a board's refresh state from kv store, see
+    `dpc_trello.refresh`
+
+    :param push_api: The IndexAPI to use to retrieve the board's state
+    :param str board_id: A trello board identifier
+
+    :return: A dict with the board's history of `dateLastActivity`
+    timestamps (`activity`), when it was last crawled (`crawled`) and the
+    number of runs since then (`skipped`)
+    :rtype: dict
+    """
+    raw_state = push_api.get_kv(refresh_state_key(board_id))
+    if raw_state is None:
+        return {}
+    return json.loads(raw_state)
+
+
+def set_refresh_state(push_api, board_id, state):
+    """ Store a board's refresh state in kv store
+
+    :param push_api: The IndexAPI to use to set the board's state
+    :param str board_id: A trello board identifier
+    :param dict state: The board's refresh state
+    """
+    push_api.set_kv(refresh_state_key(board_id), json.dumps(state))
+
+
+def stats_key(board_id):
+    """ Build the kv store key holding the crawl statistics of a board
+
+    :param str board_id: A trello board identifier
+
+    :return: The kv store key of the board's statistics
+    :rtype: str
+    """
+    return 'stats:{}'.format(board_id)
+
+
+def get_board_stats(push_api, board_id):
+    """ Retrieve the statistics of a board's last crawl from kv store
+
+    :param push_api: The IndexAPI to use to retrieve the board's statistics
+    :param str board_id: A trello board identifier
+
+    :return: A dict with the `requests`, `bytes` and `duration` of the
+    board's tasks, by task kind, and the number of consecutive runs the board
+    was deferred by (`deferred`)
+    :rtype: dict
+    """
+    raw_stats = push_api.get_kv(stats_key(board_id))
+    if raw_stats is None:
+        return {}
+    return json.loads(raw_stats)
+
+
+def set_board_stats(push_api, board_id, stats):
+    """ Store the statistics of a board in kv store
+
+    :param push_api: The IndexAPI to use to set the board's statistics
+    :param str board_id: A trello board identifier
+    :param dict stats: The board's statistics, see `get_board_stats`
+    """
+    push_api.set_kv(stats_key(board_id), json.dumps(stats))
+
+
+def record_task_stats(push_api, board_id, kind, trello, start,
+                      cached=False):
+    """ Record the cost of a board's task, to plan the next runs
+
+    :param push_api: The IndexAPI to use to set the board's statistics
+    :param str board_id: A trello board identifier
+    :param str kind: The kind of task (`cards`, `members`)
+    :param TrelloClient trello: The client used by the task
+    :param float start: When the task started, as a UNIX timestamp
+    :param bool cached: Whether the task used a shared snapshot of the
+    board, in which case the cost of a crawl without snapshot, recorded by
+    a previous run, is kept
+    """
+    stats = get_board_stats(push_api, board_id)
+    if cached and kind in stats:
+        return
+    stats[kind] = dict(
+        requests=trello.requests,
+        bytes=trello.received_bytes,
+        duration=time.time() - start,
+    )
+    set_board_stats(push_api, board_id, stats)
+
+
+def get_known_boards(push_api):
+    """ Retrieve the identifiers of the boards crawled by the last run
+
+    :param push_api: The IndexAPI to use to retrieve the boards
+
+    :return: The boards identifiers
+    :rtype: list
+    """
+    boards = push_api.get_kv('boards')
+    if boards is not None:
+        return json.loads(boards)
+    return []
+
+
+def set_known_boards(push_api, board_ids):
+    """ Store the identifiers of the boards crawled by the current run
+
+    :param push_api: The IndexAPI to use to store the boards
+    :param list board_ids: The boards identifiers
+    """
+    push_api.set_kv('boards', json.dumps(sorted(board_ids)))
+
+
+def generate_board_query(board_id):
+    """ Generate an elasticsearch query to select all cards of a board
+
+    :param str board_id: The board to select cards from
+
+    :return: A query to select all documents whose `private.board_id` is the
+    provided board_id
+    """
+    return {
+        'query': {
+            'term': {
+                'private.board_id': board_id,
+            },
+        },
+    }
+
+
+def push_documents(push_api, token, board_id, kind, docs, state,
+                   current_gen, config, logger):
+    """ Push the documents of a board's task
+
+    When the `state_dir` crawl configuration is set, only the documents whose
+    content changed since the board's last crawl are pushed, and a new
+    version of the board's index is written, see `dpc_trello.fingerprints`.
+    Full crawls push every document, the index may have been cleared.
+
+    :param push_api: The IndexAPI to use
+    :param token: an OauthToken object
+    :param str board_id: A trello board identifier
+    :param str kind: The kind of documents (`cards`, `members`)
+    :param list docs: The documents
+    :param dict state: The board's state, see `get_board_state`
+    :param int current_gen: The generation of the current crawl
+    :param nameddict config: crawl configuration
+    :param logger: A logging.logger instance
+    """
+    store = fingerprint_store(token, config)
+    if store is None:
+        push_api.push_cards(docs)
+        return
+    records = []
+    changed = []
+    # full crawls rebuild the index, previous fingerprints are ignored
+    version = None if config.get('full') else state.get('index')
+    with store.open(board_id, kind, version) as previous:
+        for doc in docs:
+            # the generation is part of every pushed document
+            private = dict(doc.get('private', {}))
+            private.pop('sync_id', None)
+            digest = fingerprint(dict(doc, private=private))
+            known = previous.get(doc['id'])
+            if known is None or known[0] != digest:
+                changed.append(doc)
+            records.append((doc['id'], digest, current_gen))
+    logger.info('{} {} out of {} changed on board: {}'.format(
+        len(changed), kind, len(docs), board_id))
+    if changed:
+        push_api.push_cards(changed)
+    store.write(board_id, kind, current_gen, records)
+
+
+def indexed_stale_ids(store, states, succeeded, kept, vanished):
+    """ Compute the documents to delete from the boards indexes
+
+    The previous and current indexes of every succeeded board are merged to
+    find the documents it does not push anymore. These documents, and those
+    of vanished boards, are deleted unless another board retains them: the
+    sorted identifiers of the retaining indexes are merged once with the
+    candidates. Boards whose state was written before indexes were enabled
+    use the documents ids recorded in their state.
+
+    :param FingerprintStore store: The boards indexes
+    :param dict states: The boards states, by board identifier
+    :param list succeeded: The boards whose tasks succeeded
+    :param list kept: The boards whose documents are kept
+    :param list vanished: The boards the user cannot access anymore
+
+    :return: The identifiers of the stale documents
+    :rtype: set
+    """
+    def open_indexes(board_id, version):
+        return [store.open(board_id, kind, version) for kind in INDEX_KINDS]
+
+    def legacy_ids(board_id):
+        state = states[board_id]
+        if 'index' in state:
+            return []
+        return [d for kind in INDEX_KINDS for d in state.get(kind, [])]
+    old = {
+        board_id: open_indexes(board_id, states[board_id].get('index'))
+        for board_id in set(succeeded) | set(kept) | set(vanished)
+    }
+    new = {
+        board_id: open_indexes(board_id, states[board_id]['gen'] + 1)
+        for board_id in succeeded
+    }
+    try:
+        candidates = {}
+        for board_id in succeeded:
+            for previous, current in zip(old[board_id], new[board_id]):
+                for key in merge_removed(previous.keys(), current.keys()):
+                    candidates[key] = previous.decode(key)
+        for board_id in vanished:
+            for previous in old[board_id]:
+                for key in previous.keys():
+                    candidates[key] = previous.decode(key)
+        for board_id in set(succeeded) | set(vanished):
+            for doc_id in legacy_ids(board_id):
+                candidates[encode_id(doc_id)] = doc_id
+        retained = [sorted(encode_id(d) for b in kept for d in legacy_ids(b))]
+        retained += [i.keys() for b in kept for i in old[b]]
+        retained += [i.keys() for b in succeeded for i in new[b]]
+        return set(
+            candidates[key] for key in
+            merge_removed(sorted(candidates), heapq.merge(*retained))
+        )
+    finally:
+        for indexes in old.values() + new.values():
+            for index in indexes:
+                index.close()
+
+
+def board_task_result(prev_result, board_id, **ids):
+    """ Merge the document ids pushed by a board task with the result of the
+    previous task of the same board
+
+    :param prev_result: Result of the previous task of the board, if any
+    :param str board_id: The board identifier
+    :param ids: lists of pushed documents ids, by kind (`cards`, `members`)
+
+    :return: The merged result, or the previous one if it is an exception so
+    that the board is considered failed by `remove_old_gen`
+    """
+    if isinstance(prev_result, Exception):
+        return prev_result
+    result = dict(prev_result or {}, board_id=board_id)
+    result.update(ids)
+    return result
+
+
+def checkpoint_key(run_id, board_id):
+    """ Build the kv store key holding the checkpoint of a board for a run
+
+    :param str run_id: The crawl run identifier
+    :param str board_id: A trello board identifier
+
+    :return: The kv store key of the checkpoint
+    :rtype: str
+    """
+    return 'checkpoint:{}:{}'.format(run_id, board_id)
+
+
+def get_checkpoint(push_api, run_id, board_id):
+    """ Retrieve the checkpoint of a board completed by a run, if it is
+    still valid, i.e. the board's generation did not change since.
+
+    :param push_api: The IndexAPI to use to retrieve the checkpoint
+    :param str run_id: The crawl run identifier
+    :param str board_id: A trello board identifier
+
+    :return: The board's result recorded by `checkpoint_board`, or None
+    :rtype: dict
+    """
+    checkpoint = push_api.get_kv(checkpoint_key(run_id, board_id))
+    if checkpoint is None:
+        return None
+    checkpoint = json.loads(checkpoint)
+    if checkpoint['gen'] != get_last_gen(push_api, board_id) + 1:
+        return None
+    return checkpoint
+
+
+def checkpoint_board(board_id, push_api, token, prev_result, config,
+                     logger):
+    """ Function template of the last task of a board, recording in kv
+    store that the board's tasks completed for the `run_id` of the crawl
+    configuration, along with the pushed generation.
+
+    :param str board_id: The board identifier
+    :param push_api: The IndexAPI to use
+    :param token: an OauthToken object
+    :param prev_result: Result of the board's members task
+    :param nameddict config: crawl configuration
+    :param logger: A logging.logger instance
+
+    :return: The board's result, untouched
+    """
+    # token is not used but needed to work with docido SDK
+    # pylint: disable=unused-argument
+    if not isinstance(prev_result, Exception):
+        logger.info('board {} completed for run {}'.format(
+            board_id, config.run_id))
+        push_api.set_kv(
+            checkpoint_key(config.run_id, board_id),
+            json.dumps(dict(prev_result,
+                            gen=get_last_gen(push_api, board_id) + 1))
+        )
+    return prev_result
+
+
+def clear_checkpoints(board_ids, push_api, token, results, config, logger):
+    """ Create a docido_sdk compliant task to remove the checkpoints of a
+    run once all its tasks were executed
+
+    :param list board_ids: The boards crawled by the run
+    :param push_api: The IndexAPI to use
+    :param token: an OauthToken object
+    :param results: Previous tasks results
+    :param nameddict config: Crawl configuration
+    :param logger: A logging.logger instance
+    """
+    # token and results are not used but needed to work with docido SDK
+    # pylint: disable=unused-argument
+    logger.info('clearing checkpoints of run {}'.format(config.run_id))
+    for board_id in board_ids:
+        push_api.delete_kv(checkpoint_key(config.run_id, board_id))
+
+
+def remove_old_gen(board_ids, push_api, token, results, config, logger,
+                   skipped=()):
     """ Create a docido_sdk compliant task to remove old documents from index
     (this function should be called for incremental crawls)
 
+    Documents are only removed for boards whose tasks succeeded, or for boards
+    the user cannot access anymore. Documents still pushed by another board,
+    or recorded by a board whose tasks failed, are kept.
+
+    When the crawl configuration has a `run_id`, boards completed by a
+    previous attempt of the run are considered succeeded, and the run's
+    checkpoints are cleared.
+
+    Documents of boards skipped by the current run, see
+    `dpc_trello.refresh`, are kept. When the `refresh` crawl configuration
+    is set, succeeded boards are recorded as crawled.
+
+    Documents left stale by crawls run before boards had their own state
+    are deleted by the first run crawling every board successfully, which
+    then drops the account wide generation, see `get_legacy_gen`.
+
+    When the `state_dir` crawl configuration is set, documents ids are read
+    from the boards indexes instead of the kv store, see
+    `indexed_stale_ids`. Succeeded boards whose new indexes are not found
+    are considered failed.
+
+    :param list board_ids: The boards crawled by the current run
     :param push_api: The IndexAPI to use to set last generation
     :param token: an OauthToken object
-    :param prev_results: Previous tasks results
+    :param results: Previous tasks results
     :param nameddict config: Crawl configuration
     :param logger: A logging.logger instance
+    :param list skipped: The boards not crawled by the current run because
+    they were not due for a refresh
     """
-    # prev result and token are not used but needed to work with docido SDK
+    # token is not used but needed to work with docido SDK
     # pylint: disable=unused-argument
     logger.info('removing last generation items')
-    last_gen = get_last_gen(push_api)
-    last_gen_query = generate_last_gen_query(last_gen)
-    push_api.delete_cards(last_gen_query)
-    set_last_gen(push_api, last_gen + 1)
-
+    if not isinstance(results, list):
+        results = [results]
+    succeeded = {
+        result['board_id']: result for result in results
+        if isinstance(result, dict) and 'board_id' in result
+    }
+    current = set(board_ids)
+    if config.get('run_id'):
+        for board_id in current - set(succeeded):
+            checkpoint = get_checkpoint(push_api, config.run_id, board_id)
+            if checkpoint is not None:
+                succeeded[board_id] = checkpoint
+    skipped = set(skipped) - set(succeeded)
+    failed = current - set(succeeded) - skipped
+    vanished = set(get_known_boards(push_api)) - current
+    states = {
+        board_id: get_board_state(push_api, board_id)
+        for board_id in current | vanished | skipped
+    }
 
-@teb_retry(
+    store = fingerprint_store(token, config)
+    if store is not None:
+        # the boards indexes may have been written where this node cannot
+        # read them, their previous documents must not be deleted
+        missing = set(
+            board_id for board_id in succeeded
+            if not all(
+                store.exists(board_id, kind, states[board_id]['gen'] + 1)
+                for kind in INDEX_KINDS
+            )
+        )
+        if missing:
+            logger.warning('indexes of {} boards not found: {}'.format(
+                len(missing), ', '.join(sorted(missing))))
+        for board_id in missing:
+            del succeeded[board_id]
+        failed |= missing
+
+    def document_ids(board):
+        return set(board.get('cards', [])) | set(board.get('members', []))
+
+    if store is not None:
+        stale = indexed_stale_ids(store, states, list(succeeded),
+                                  list(failed | skipped), list(vanished))
+    else:
+        retained = set()
+        for board_id in failed | skipped:
+            retained |= document_ids(states[board_id])
+        for result in succeeded.itervalues():
+            retained |= document_ids(result)
+        stale = set()
+        for board_id in set(succeeded) | vanished:
+            stale |= document_ids(states[board_id])
+        stale -= retained
+
+    if failed:
+        logger.warning('keeping documents of {} failed boards: {}'.format(
+            len(failed), ', '.join(sorted(failed))))
+    if stale:
+        logger.info('deleting {} documents'.format(len(stale)))
+        push_api.delete_cards_by_id(sorted(stale))
+        if config.get('attachments'):
+            delete_card_contents(push_api, sorted(stale), logger)
+    for board_id in vanished:
+        logger.info('deleting cards of vanished board: {}'.format(board_id))
+        push_api.delete_cards(generate_board_query(board_id))
+        push_api.delete_kv(board_state_key(board_id))
+        push_api.delete_kv(refresh_state_key(board_id))
+        push_api.delete_kv(stats_key(board_id))
+        if store is not None:
+            store.purge(board_id)
+    for board_id, result in succeeded.iteritems():
+        gen = states[board_id]['gen'] + 1
+        if store is not None:
+            # documents ids are in the board's index
+            set_board_state(push_api, board_id, dict(gen=gen, index=gen))
+            store.purge(board_id, keep=gen)
+            continue
+        set_board_state(push_api, board_id, dict(
+            gen=gen,
+            cards=result.get('cards', []),
+            members=result.get('members', []),
+        ))
+    if config.get('refresh') and not config.get('reprocess'):
+        now = time.time()
+        for board_id in succeeded:
+            set_refresh_state(push_api, board_id, record_crawl(
+                get_refresh_state(push_api, board_id), now))
+    legacy_gen = get_legacy_gen(push_api)
+    if legacy_gen is not None and not failed and not skipped:
+        logger.info('deleting documents of generations before {}'.format(
+            legacy_gen))
+        push_api.delete_cards(generate_legacy_gen_query(legacy_gen))
+        push_api.delete_kv(LEGACY_GEN_KEY)
+    set_known_boards(push_api, current)
+    if config.get('run_id'):
+        clear_checkpoints(board_ids, push_api, token, results, config, logger)
+
+
+@lazy_teb_retry(
     exc=TrelloClientException,
     when=dict(response__status_code=429),
     delay='response__headers__Retry-After'
@@ -312,18 +1001,30 @@ def handle_board_members(board_id, push_api, token, prev_result,
     :param str board_id: the boards' to fetch members IDs
     :param push_api: The IndexAPI to use
     :param token: an OauthToken object
-    :param prev_results: Previous tasks results
-    :param nameddict prev_result: crawl configuration
+    :param prev_result: Result of the board's cards task
+    :param nameddict config: crawl configuration
     :param logger: A logging.logger instance
+
+    :return: The board's result, see `board_task_result`
     """
-    # prev result is not used but needed to work with docido SDK
-    # pylint: disable=unused-argument
+    import markdown
     logger.info('fetching members for board: {}'.format(board_id))
-    current_gen = get_last_gen(push_api) + 1
-    trello = create_trello_client(token)
+    start = time.time()
+    state = get_board_state(push_api, board_id)
+    current_gen = state['gen'] + 1
+    snapshots = raw_snapshots(token, config)
+    trello = None
+    if config.get('reprocess'):
+        trello_members = snapshots.load_board(board_id, 'members')['members']
+    else:
+        trello = create_trello_client(token, config)
+        trello_members = trello.list_board_members(board_id, fields='all')
+        if snapshots is not None:
+            snapshots.save_board(board_id, 'members',
+                                 dict(members=trello_members))
     members = []
 
-    for member in trello.list_board_members(board_id, fields='all'):
+    for member in trello_members:
         try:
             embed = markdown.markdown(member['bio'])
         except:
@@ -352,198 +1053,590 @@ def handle_board_members(board_id, push_api, token, prev_result,
         })
     logger.info('indexing {} members for board: {}'.format(
         len(members), board_id))
-    push_api.push_cards(members)
+    push_documents(push_api, token, board_id, 'members', members, state,
+                   current_gen, config, logger)
+    if trello is not None and config.get('budget') is not None:
+        record_task_stats(push_api, board_id, 'members', trello, start)
+    return board_task_result(prev_result, board_id,
+                             members=[m['id'] for m in members])
 
 
-@teb_retry(
-    exc=TrelloClientException,
-    when=dict(response__status_code=429),
-    delay='response__headers__Retry-After'
-)
-def handle_board_cards(me, board_id, push_api, token, prev_result,
-                       config, logger):
-    """ Function template to generate a trello board's cards fetch from its
-    ID. The docido_sdk compliant task should be created with functools.partial
-    with a trello obtained board id.
+def fetch_board(trello, board_id, scope=None):
+    """ Fetch in a single request a board with its lists, cards,
+    checklists, members, labels and cards actions as separate arrays, so
+    that members and checklists are sent once instead of once per card.
+    Actions only refer to their creator by id, see `MemberTable`.
 
-    :param str board_id: the boards' to fetch members IDs
-    :param push_api: The IndexAPI to use
-    :param token: an OauthToken object
-    :param prev_results: Previous tasks results
-    :param nameddict config: crawl configuration
-    :param logger: A logging.logger instance
+    Board actions are paginated by trello, the remaining pages are fetched
+    when the first one is full. Cards moved from another board have their
+    creation action on the source board, it is fetched card by card.
+
+    Archived cards are not fetched if excluded by the crawl scope. When the
+    scope excludes some lists, cards are fetched list by list instead.
+
+    :param trello: The trello client to use
+    :param str board_id: The board identifier
+    :param dict scope: The `scope` crawl configuration
+
+    :return: The board, as returned by trello's API
+    :rtype: dict
     """
-    # prev result is not used but needed to work with docido SDK
-    # pylint: disable=unused-argument
-    logger.info('fetching cards for board: {}'.format(board_id))
-    current_gen = get_last_gen(push_api) + 1
-    trello = create_trello_client(token)
-    docido_cards = []
-    params = dict(
-        actions='createCard,commentCard,copyCard,convertToCardFromCheckItem',
-        attachments='true',
-        attachment_fields='all',
-        members='true',
-        member_fields='all',
+    scope = scope or {}
+    by_list = any(scope.get('exclude_lists', []))
+    board = trello.get_board(
+        board_id,
+        fields='name',
+        lists='all',
+        list_fields='name',
+        cards='none' if by_list else cards_filter(scope),
+        card_fields=BOARD_CARD_FIELDS,
+        card_attachments='true',
+        card_attachment_fields='all',
         checklists='all',
+        members='all',
+        member_fields='fullName,username,avatarHash',
+        labels='all',
+        label_fields='name',
+        actions=BOARD_ACTIONS,
+        actions_limit=BOARD_ACTIONS_LIMIT,
+        action_fields=BOARD_ACTION_FIELDS,
+        action_member='false',
+        action_memberCreator='false',
     )
-    url_attachment_label = u'View {kind} {name} on Trello'
+    actions = board.setdefault('actions', [])
+    page = actions
+    while len(page) == BOARD_ACTIONS_LIMIT:
+        page = trello.list_board_actions(
+            board_id,
+            filter=BOARD_ACTIONS,
+            limit=BOARD_ACTIONS_LIMIT,
+            before=page[-1]['id'],
+            fields=BOARD_ACTION_FIELDS,
+            member='false',
+            memberCreator='false',
+        )
+        actions.extend(page)
+    if by_list:
+        board_lists = board.get('lists', [])
+        kept = [l for l in board_lists if list_in_scope(l, scope)]
+        card_params = dict(
+            filter=cards_filter(scope),
+            fields=BOARD_CARD_FIELDS,
+            attachments='true',
+            attachment_fields='all',
+        )
+        if len(kept) == len(board_lists):
+            board['cards'] = trello.list_board_cards(board_id, **card_params)
+        else:
+            board['cards'] = []
+            for trello_list in kept:
+                board['cards'].extend(
+                    trello.list_list_cards(trello_list['id'], **card_params)
+                )
+    created = set(
+        a['data']['card']['id'] for a in actions
+        if a['type'] == CREATE_CARD_ACTION and
+        'card' in (a.get('data') or {})
+    )
+    for trello_card in board.get('cards', []):
+        if trello_card['id'] not in created:
+            actions.extend(trello.list_card_actions(
+                trello_card['id'],
+                filter=CREATE_CARD_ACTION,
+                fields=BOARD_ACTION_FIELDS,
+                member='false',
+                memberCreator='false',
+            ))
+    return board
 
-    board_lists = {
-        l['id']: l['name']
-        for l in trello.list_board_lists(board_id, fields='name')
-    }
 
-    trello_cards = trello.list_board_cards(board_id, **params)
+def fetch_member(trello, member_id):
+    """ Fetch a member which is not part of a board anymore
+
+    :param trello: The trello client to use
+    :param str member_id: The member identifier
+
+    :return: The member, or None if trello does not know it anymore
+    :rtype: dict
+    """
+    try:
+        return trello.get_member(member_id,
+                                 fields='fullName,username,avatarHash')
+    except TrelloClientException as exc:
+        if exc.response.status_code == 429:
+            raise
+        return None
+
+
+def join_board(board, release=False):
+    """ Join the arrays of a board fetched by `fetch_board` by id, to
+    give every card its actions, checklists and labels. Members are
+    resolved from `idMembers` with a `MemberTable`.
+
+    :param dict board: The board returned by `fetch_board`
+    :param bool release: Whether to remove the joined arrays from `board`,
+    so that the decoded responses are freed while cards are transformed.
+    Must be False when `board` is persisted afterwards.
+
+    :return: tuple made of the board's lists and the board's cards, as
+    `dpc_trello.models.Card` instances
+    :rtype: tuple
+    """
+    labels = {l['id']: l for l in board.get('labels', [])}
+    checklists = {}
+    for checklist in board.get('checklists', []):
+        checklists.setdefault(checklist['idCard'], []).append(checklist)
+    actions = {}
+    for action in board.get('actions', []):
+        action_card = action.get('data', {}).get('card')
+        if action_card is not None:
+            actions.setdefault(action_card['id'], []).append(action)
+    cards = [
+        Card(
+            card,
+            actions=actions.get(card['id'], []),
+            checklists=checklists.get(card['id'], []),
+            labels=[
+                labels[l] for l in card.get('idLabels', []) if l in labels
+            ],
+        )
+        for card in board.get('cards', [])
+    ]
+    if release:
+        for field in ('cards', 'actions', 'checklists', 'labels'):
+            board.pop(field, None)
+    return board.get('lists', []), cards
+
+
+# version of the documents built by `transform_board_cards`, to increment
+# whenever they change so that shared boards snapshots are rebuilt
+TRANSFORM_VERSION = 1
+
+
+def board_snapshot_key(last_activity, scope, embed=None):
+    """ Build the key of a board's shared snapshot, see
+    `dpc_trello.cache.BoardSnapshotCache`
+
+    :param str last_activity: The board's `dateLastActivity`
+    :param dict scope: The `scope` crawl configuration
+    :param str embed: The embed policy of the `output` crawl configuration,
+    see `dpc_trello.output`
+
+    :rtype: str
+    """
+    # snapshots of a board depend on the cards in scope, and on the
+    # rendered texts
+    return '{}-{}-{}-v{}'.format(last_activity, cards_scope_key(scope),
+                                 embed or 'eager', TRANSFORM_VERSION)
+
+
+def transform_board_cards(board_lists, trello_cards, members, embed=None):
+    """ Transform trello cards into user independent docido cards
+
+    The returned entries can be shared between all users having access to the
+    board, `apply_user_overlay` must be used to get the actual documents to
+    push on behalf of a user.
+
+    :param dict board_lists: The board's lists names, by list identifier
+    :param list trello_cards: The board's cards, as returned by `join_board`
+    :param MemberTable members: The board's members
+    :param str embed: The embed policy of the `output` crawl configuration,
+    texts whose HTML rendering is not pushed are not rendered
+
+    :return: A list of dict with the user independent docido card (`card`),
+    the identifier of the card's creator (`creator`, None when unknown) and
+    the identifiers of the card's members (`members`)
+    :rtype: list
+    """
+    import markdown
+    from docido_sdk.toolbox.date_ext import timestamp_ms
+    from docido_sdk.toolbox.text import to_unicode
+    entries = []
+    url_attachment_label = u'View {kind} {name} on Trello'
     for card in trello_cards:
         actions = {}
-        for action in card['actions']:
-            actions.setdefault(action['type'], []).append(action)
-        if not any(actions.get(CREATE_CARD_ACTION, [])):
-            # no card creation event, author cannot get inferred
-            continue
-        create_card_a = actions[CREATE_CARD_ACTION][0]
+        for action in card.actions:
+            actions.setdefault(action.type, []).append(action)
+        create_card_a = next(iter(actions.get(CREATE_CARD_ACTION, [])), None)
         full_text = StringIO()
         with closing(full_text):
             writer = codecs.StreamReaderWriter(
                 full_text,
                 UTF8_CODEC.streamreader, UTF8_CODEC.streamwriter)
-            writer.write(card['desc'])
-            for checklist in card.get('checklists', []):
+            writer.write(card.desc)
+            for checklist in card.checklists:
                 writer.write('\n\n### ')
-                writer.write(checklist['name'])
+                writer.write(checklist.name)
                 writer.write('\n')
-                for checkItem in checklist.get('checkItems', []):
-                    if checkItem['state'] == 'complete':
+                for name, complete in checklist.items:
+                    if complete:
                         writer.write('\n* [x] ')
                     else:
                         writer.write('\n* [ ] ')
-                    writer.write(checkItem['name'])
+                    writer.write(name)
             description = to_unicode(full_text.getvalue())
 
-        author = create_card_a['memberCreator']
-        author_id = create_card_a['idMemberCreator']
-        author_thumbnail = thumbnail_from_avatar_hash(author.get('avatarHash'))
-        labels = [l['name'] for l in card['labels']]
-        labels = filter(lambda l: any(l), labels)
-        try:
-            embed = markdown.markdown(
-                description,
-                extensions=['markdown_checklist.extension']
+        if create_card_a is not None:
+            author_id = create_card_a.id_member_creator
+            created_at = create_card_a.date
+            links = create_card_a.links
+        else:
+            # the creation event is not readable anymore, e.g. removed
+            # with its board: the card is pushed without author and its
+            # earliest known activity stands for its creation
+            author_id = None
+            created_at = min(
+                [a.date for a in card.actions] + [card.date_last_activity]
             )
-        except:
-            embed = None
+            links = ()
+        labels = card.labels
+        html_description = None
+        if keeps_embed(description, embed):
+            try:
+                html_description = markdown.markdown(
+                    description,
+                    extensions=['markdown_checklist.extension']
+                )
+            except:
+                pass
         docido_card = {
             'attachments': [
                 {
                     'type': u'link',
-                    'url': card['shortUrl'],
+                    'url': card.short_url,
                     '_analysis': False,
                     'title': 'View card on Trello'
                 }
             ],
-            'id': card['id'],
-            'title': card['name'],
-            'private': dict(sync_id=current_gen),
+            'id': card.id,
+            'title': card.name,
             'description': description,
-            'embed': embed,
-            'date': date_to_timestamp(card['dateLastActivity']),
-            'favorited': card['subscribed'],
-            'created_at': date_to_timestamp(create_card_a['date']),
-            'author': {
-                'name': author['fullName'],
-                'username': author['username'],
-                'thumbnail': author_thumbnail,
-            },
+            'embed': html_description,
+            'date': date_to_timestamp(card.date_last_activity),
+            'created_at': date_to_timestamp(created_at),
+            'author': members.author(author_id),
             'labels': labels,
-            'group_name': board_lists[card['idList']],
-            'flags': 'closed' if card.get('closed', False) else 'open',
+            'group_name': board_lists[card.id_list],
+            'flags': 'closed' if card.closed else 'open',
             'kind': u'note'
         }
-        if author_id == me['id']:
-            docido_card['private']['twitter_id'] = 1
-        else:
-            is_member = False
-            for member in card.get('members', []):
-                if member['id'] == me['id']:
-                    is_member = True
-                    break
-            if is_member:
-                docido_card['private']['twitter_id'] = 0
-
-        for kind, link in create_card_a.get('data', {}).iteritems():
-            if kind != 'card' and 'shortLink' in link:
+
+        for kind, short_link, name in links:
+            docido_card['attachments'].append(dict(
+                type=u'link',
+                _analysis=False,
+                url='https://trello.com/{kind}/{url}'.format(
+                    kind=kind,
+                    url=short_link
+                ),
+                title=url_attachment_label.format(kind=kind, name=name)
+            ))
+            if kind == 'board':
                 docido_card['attachments'].append(dict(
-                    type=u'link',
-                    _analysis=False,
-                    url='https://trello.com/{kind}/{url}'.format(
-                        kind=kind,
-                        url=link['shortLink']
-                    ),
-                    title=url_attachment_label.format(kind=kind,
-                                                      name=link['name'])
+                    type=u'notebook',
+                    name=name
                 ))
-                if kind == 'board':
-                    docido_card['attachments'].append(dict(
-                        type=u'notebook',
-                        name=link['name']
-                    ))
 
         docido_card['attachments'].extend([
             {
                 'type': u'file',
-                'origin_id': a['id'],
-                'title': a['name'],
-                'url': a['url'],
-                'date': date_to_timestamp(a['date']),
-                'size': a['bytes'],
-                'preview': pick_preview(a['previews']),
+                'origin_id': a.id,
+                'title': a.name,
+                'url': a.url,
+                'date': date_to_timestamp(a.date),
+                'size': a.bytes,
+                'preview': pick_preview(a.previews),
                 'mime_type': pick_mime_type(a),
                 'filetype': pick_filetype(a),
             }
-            for a in card['attachments']
+            for a in card.attachments
         ])
         docido_card['attachments'].extend([
             dict(type=u'tag', name=label)
             for label in labels
         ])
         docido_card['to'] = [
-            {
-                'name': m['fullName'],
-                'username': m['username'],
-                'thumbnail': thumbnail_from_avatar_hash(m['avatarHash'])
-            }
-            for m in card['members']
+            members.author(m) for m in card.id_members
         ]
         for comment in reversed(actions.get(COMMENT_CARD_ACTION, [])):
-            creator = comment.get('memberCreator', {})
-            thumbnail = thumbnail_from_avatar_hash(creator.get('avatarHash'))
-            text = comment.get('data', {}).get('text')
-            if text is not None:
+            text = comment.text
+            html_text = None
+            if text is not None and keeps_embed(text, embed):
                 try:
                     html_text = markdown.markdown(
                         text,
                         extensions=['markdown_checklist.extension']
                     )
                 except:
-                    html_text = None
-            else:
-                html_text = text
+                    pass
             docido_card.setdefault('comments', []).append(dict(
                     text=text,
                     embed=html_text,
-                    date=timestamp_ms.feeling_lucky(comment['date']),
-                    author=dict(
-                        name=creator.get('fullName'),
-                        username=creator.get('username'),
-                        thumbnail=thumbnail
-                    )
+                    date=timestamp_ms.feeling_lucky(comment.date),
+                    author=members.author(comment.id_member_creator)
             ))
         docido_card['comments_count'] = len(docido_card.get('comments', []))
-        docido_cards.append(docido_card)
+        entries.append(dict(
+            card=docido_card,
+            creator=author_id,
+            members=card.id_members,
+        ))
+    return entries
+
+
+def apply_user_overlay(entry, me, subscribed, private):
+    """ Build the docido card to push on behalf of a user from a user
+    independent entry
+
+    :param dict entry: An entry returned by `transform_board_cards`
+    :param dict me: The trello member crawling the board
+    :param bool subscribed: Whether the member is subscribed to the card
+    :param dict private: The `private` field to set on the docido card
+
+    :return: The docido card
+    :rtype: dict
+    """
+    docido_card = dict(entry['card'])
+    docido_card['favorited'] = subscribed
+    docido_card['private'] = dict(private)
+    if entry['creator'] == me['id']:
+        docido_card['private']['twitter_id'] = 1
+    elif me['id'] in entry['members']:
+        docido_card['private']['twitter_id'] = 0
+    return docido_card
+
+
+@lazy_teb_retry(
+    exc=TrelloClientException,
+    when=dict(response__status_code=429),
+    delay='response__headers__Retry-After'
+)
+def handle_board_cards(me, board_id, push_api, token, prev_result,
+                       config, logger, last_activity=None):
+    """ Function template to generate a trello board's cards fetch from its
+    ID. The docido_sdk compliant task should be created with functools.partial
+    with a trello obtained board id.
+
+    When the `board_cache_dir` crawl configuration is set and the board did
+    not change since its cached snapshot was made, possibly by the crawl of
+    another account, only the user specific fields are fetched. The cached
+    snapshot is not used when `raw_snapshot_dir` is set, for the raw
+    responses of every crawl to be persisted.
+
+    When the `reprocess` crawl configuration is set, cards are transformed
+    from the responses persisted in `raw_snapshot_dir` by a previous crawl
+    instead of being fetched.
+
+    When the `attachments` crawl configuration is set, the content of
+    trello hosted files is fetched and uploaded too, see
+    `dpc_trello.attachments`.
+
+    When the `output` crawl configuration is set, the compact version of the
+    cards is pushed, see `dpc_trello.output`, and the size saved is logged
+    at debug level.
+
+    :param dict me: The trello member crawling the board
+    :param str board_id: the boards' to fetch members IDs
+    :param push_api: The IndexAPI to use
+    :param token: an OauthToken object
+    :param prev_result: Previous task result, if any
+    :param nameddict config: crawl configuration
+    :param logger: A logging.logger instance
+    :param str last_activity: The board's `dateLastActivity`, if known
+
+    :return: The board's result, see `board_task_result`
+    """
+    logger.info('fetching cards for board: {}'.format(board_id))
+    start = time.time()
+    state = get_board_state(push_api, board_id)
+    current_gen = state['gen'] + 1
+    snapshots = raw_snapshots(token, config)
+    scope = config.get('scope') or {}
+    output = config.get('output')
+    embed = (output or {}).get('embed')
+    cache = None
+    entries = None
+    trello = None
+    cached = False
+    if config.get('board_cache_dir') and last_activity is not None:
+        cache = BoardSnapshotCache(config.board_cache_dir)
+        snapshot_key = board_snapshot_key(last_activity, scope, embed)
+        # a cache hit would not give the raw responses to persist
+        if snapshots is None:
+            entries = cache.get(board_id, snapshot_key)
+    if config.get('reprocess'):
+        raw = snapshots.load_board(board_id, 'cards')
+        board = raw['board']
+        trello_lists, trello_cards = join_board(board, release=True)
+        entries = transform_board_cards(
+            {l['id']: l['name'] for l in trello_lists},
+            trello_cards,
+            MemberTable(board.get('members', []) + raw.get('members', [])),
+            embed
+        )
+        subscriptions = {card.id: card.subscribed for card in trello_cards}
+        # refresh shared snapshots with the new transformation
+        if cache is not None:
+            cache.put(board_id, snapshot_key, entries)
+    elif entries is None:
+        trello = create_trello_client(token, config)
+        board = fetch_board(trello, board_id, scope)
+        members = MemberTable(
+            board.get('members', []),
+            functools.partial(fetch_member, trello)
+        )
+        # raw responses are only kept to be persisted
+        trello_lists, trello_cards = join_board(
+            board, release=snapshots is None)
+        entries = transform_board_cards(
+            {l['id']: l['name'] for l in trello_lists},
+            trello_cards,
+            members,
+            embed
+        )
+        subscriptions = {card.id: card.subscribed for card in trello_cards}
+        if snapshots is not None:
+            snapshots.save_board(board_id, 'cards', dict(
+                board=board,
+                members=members.fetched,
+            ))
+        if cache is not None:
+            cache.put(board_id, snapshot_key, entries)
+    else:
+        logger.info('using cached snapshot of board: {}'.format(board_id))
+        cached = True
+        trello = create_trello_client(token, config)
+        trello_cards = trello.list_board_cards(
+            board_id, fields='subscribed', filter=cards_filter(scope))
+        subscriptions = {
+            card['id']: card.get('subscribed', False) for card in trello_cards
+        }
+    private = dict(sync_id=current_gen, board_id=board_id)
+    docido_cards = [
+        apply_user_overlay(
+            entry, me,
+            subscriptions.get(entry['card']['id'], False),
+            private
+        )
+        for entry in entries
+    ]
+    settings = config.get('attachments')
+    if settings:
+        per_host = settings.get('per_host', 2)
+        fetcher = AttachmentFetcher(
+            settings['cache_dir'],
+            # when reprocessing, only cached contents are used
+            content_opener(
+                trello,
+                tuple(config.get('request_timeout', DEFAULT_TIMEOUT)),
+                per_host
+            ) if trello is not None else None,
+            max_size=settings.get('max_size', DEFAULT_MAX_SIZE),
+            max_cache_size=settings.get('max_cache_size',
+                                        DEFAULT_MAX_CACHE_SIZE),
+            concurrency=settings.get('concurrency', 8),
+            per_host=per_host,
+        )
+        docido_cards = attach_contents(docido_cards, fetcher, push_api,
+                                       logger)
+    if output:
+        # serializing the whole board is only worth it for debugging
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            original_size = payload_size(docido_cards)
+        docido_cards = [compact_card(card, output) for card in docido_cards]
+        if debug:
+            size = payload_size(docido_cards)
+            logger.debug(
+                'payload of board {}: {} bytes instead of {} ({:.0%} saved)'
+                .format(board_id, size, original_size,
+                        1 - float(size) / original_size
+                        if original_size else 0)
+            )
     logger.info('indexing {} cards for board: {}'.format(
         len(docido_cards), board_id))
-    push_api.push_cards(docido_cards)
+    push_documents(push_api, token, board_id, 'cards', docido_cards,
+                   state, current_gen, config, logger)
+    if trello is not None and config.get('budget') is not None:
+        record_task_stats(push_api, board_id, 'cards', trello, start,
+                          cached)
+    return board_task_result(prev_result, board_id,
+                             cards=[c['id'] for c in docido_cards])
+
+
+def plan_boards(push_api, boards, budget, refresh_states, logger):
+    """ Plan the crawl of boards within a budget, see `dpc_trello.planner`
+
+    Deferred boards get a higher priority for the next runs, and are kept
+    due for a refresh.
+
+    :param push_api: The IndexAPI to use to retrieve the boards statistics
+    :param list boards: The boards to crawl, as returned by trello's API
+    :param dict budget: The `budget` crawl configuration
+    :param dict refresh_states: The previous and next refresh states of
+    the boards, by board identifier, updated in place
+    :param logger: A logging.logger instance
+
+    :return: tuple made of the crawl plan and the identifiers of the
+    deferred boards
+    :rtype: tuple
+    """
+    stats = {b['id']: get_board_stats(push_api, b['id']) for b in boards}
+    plan = plan_crawl(boards, stats, budget)
+    deferred = sorted(
+        e['board_id'] for e in plan['boards'] if not e['planned'])
+    for board in boards:
+        board_stats = stats[board['id']]
+        count = board_stats.get('deferred', 0)
+        if board['id'] in deferred:
+            board_stats['deferred'] = count + 1
+        elif count:
+            board_stats['deferred'] = 0
+        else:
+            continue
+        set_board_stats(push_api, board['id'], board_stats)
+    for board_id in deferred:
+        if board_id in refresh_states:
+            previous, state = refresh_states[board_id]
+            state.update(skipped=previous.get('skipped', 0) + 1, due=False)
+    if deferred:
+        logger.info('{} boards deferred by the crawl budget'.format(
+            len(deferred)))
+    return plan, deferred
+
+
+def board_tasks(me, board, token, config):
+    """ Generate the sequence of tasks crawling a board
+
+    :param dict me: The trello member crawling the board
+    :param dict board: The board, as returned by trello's API
+    :param token: an OauthToken object
+    :param nameddict config: crawl configuration
+
+    :return: The cards task followed by the members task, profiled if
+    requested by the `profiling` crawl configuration, and followed by a
+    checkpoint task if the crawl configuration has a `run_id`
+    :rtype: list
+    """
+    tasks = [
+        ('cards', functools.partial(
+            handle_board_cards, me, board['id'],
+            last_activity=board.get('dateLastActivity')
+        )),
+        ('members', functools.partial(handle_board_members, board['id'])),
+    ]
+    profiling = config.get('profiling')
+    if profiling and should_profile(profiling, board['id']):
+        tasks = [
+            (kind, profiled(task, '{}-{}-{}'.format(
+                token_key(token), board['id'], kind), profiling))
+            for kind, task in tasks
+        ]
+    if config.get('run_id'):
+        tasks.append(
+            ('checkpoint', functools.partial(checkpoint_board, board['id']))
+        )
+    return [task for _, task in tasks]
 
 
 class TrelloCrawler(Component):
@@ -570,37 +1663,85 @@ class TrelloCrawler(Component):
         :param logger: A logging.logger instance
 
         :return: A dictionnary containing a "tasks" and an optionnal "epilogue"
-        fields (see docido_sdk)
+        fields (see docido_sdk). Tasks are grouped by board so that the
+        members task of a board is given the result of its cards task.
+        When the crawl configuration has a `run_id`, boards completed by a
+        previous attempt of the same run are skipped. When it has a `refresh`
+        setting, boards not due for a refresh are skipped too. When it has a
+        `budget` setting, the crawl plan is returned in a "plan" field, and
+        boards not fitting in the budget are deferred.
         :rtype: dict
         """
-        # index is not used but needed to work with docido SDK
-        # pylint: disable=unused-argument
         # pylint: disable=no-self-use
         logger.info('generating crawl tasks')
-        trello = create_trello_client(token)
-        me = trello.me()
-        boards = trello.list_boards()
+        snapshots = raw_snapshots(token, config)
+        if config.get('reprocess'):
+            if snapshots is None:
+                raise ValueError(
+                    "'reprocess' requires 'raw_snapshot_dir' to be set")
+            logger.info('reprocessing raw snapshots, trello is not queried')
+            me, boards = snapshots.load_account()
+        else:
+            trello = create_trello_client(token, config)
+            me = trello.me()
+            boards = trello.list_boards(
+                filter=boards_filter(config.get('scope') or {}))
+            if snapshots is not None:
+                snapshots.save_account(me, boards)
+        if config.get('scope'):
+            in_scope = [b for b in boards if board_in_scope(b, config.scope)]
+            logger.info('{} boards out of {} are in scope'.format(
+                len(in_scope), len(boards)))
+            boards = in_scope
+        run_id = config.get('run_id')
+        refresh = config.get('refresh')
+        if config.full or config.get('reprocess'):
+            refresh = None
+        now = time.time()
+        skipped = []
+        refresh_states = {}
+        candidates = []
         crawl_tasks = {
             'tasks': []
         }
-        fetch_cards_tasks = [
-            functools.partial(
-                handle_board_cards,
-                me,
-                board['id']
+        for board in boards:
+            if run_id and get_checkpoint(index, run_id, board['id']):
+                logger.info('skipping board {} completed by run {}'.format(
+                    board['id'], run_id))
+                continue
+            if refresh:
+                previous = get_refresh_state(index, board['id'])
+                due, state = schedule(previous, board.get('dateLastActivity'),
+                                      refresh, now, run_id)
+                refresh_states[board['id']] = (previous, state)
+                if not due:
+                    skipped.append(board['id'])
+                    continue
+            candidates.append(board)
+        if skipped:
+            logger.info('{} boards are not due for a refresh'.format(
+                len(skipped)))
+        if config.get('budget') is not None:
+            plan, deferred = plan_boards(index, candidates, config.budget,
+                                         refresh_states, logger)
+            crawl_tasks['plan'] = plan
+            skipped.extend(deferred)
+            candidates = [b for b in candidates if b['id'] not in deferred]
+        for board_id, (_, state) in refresh_states.iteritems():
+            set_refresh_state(index, board_id, state)
+        for board in candidates:
+            crawl_tasks['tasks'].append(board_tasks(me, board, token, config))
+        logger.info('{} tasks generated'.format(
+            sum(len(seq) for seq in crawl_tasks['tasks'])))
+        if not config.full:
+            crawl_tasks['epilogue'] = functools.partial(
+                remove_old_gen,
+                [board['id'] for board in boards],
+                skipped=skipped
             )
-            for board in boards
-        ]
-        fetch_board_members = [
-            functools.partial(
-                handle_board_members,
-                board['id']
+        elif run_id:
+            crawl_tasks['epilogue'] = functools.partial(
+                clear_checkpoints,
+                [board['id'] for board in boards]
             )
-            for board in boards
-        ]
-        crawl_tasks['tasks'].extend(fetch_cards_tasks)
-        crawl_tasks['tasks'].extend(fetch_board_members)
-        logger.info('{} tasks generated'.format(len(crawl_tasks['tasks'])))
-        if not config.full:
-            crawl_tasks['epilogue'] = remove_old_gen
         return crawl_tasks
@@ -0,0 +1,317 @@
+"""Compact on-disk index of the documents pushed by boards
+
+Every crawl of a board writes, per kind of document (`cards`, `members`),
+a file made of a header, a Bloom filter of the documents identifiers and a
+sorted array of fixed-width records:
+
+- the trello identifier of the document, 12 bytes
+- a fingerprint of the document's content, 8 bytes
+- the generation of the board's crawl which last saw the document, 4 bytes
+
+Identifiers which are not trello identifiers are hashed, and listed in a
+JSON trailer following the records so that they can be restored.
+
+Files are memory-mapped when read, and looked up by binary search behind
+the Bloom filter fast path. Their version is the board's generation, the
+kv store only holds a pointer to the current one.
+"""
+
+import binascii
+import errno
+import glob
+import hashlib
+import json
+import mmap
+import os
+import os.path as osp
+import struct
+import tempfile
+
+MAGIC = b'DPCF'
+FORMAT = 1
+HEADER = struct.Struct('>4sBIII')
+RECORD = struct.Struct('>12s8sI')
+ID_SIZE = 12
+BLOOM_BITS_PER_ID = 10
+BLOOM_HASHES = 7
+
+
+def is_trello_id(doc_id):
+    """ Tell whether an identifier is made of 24 hexadecimal characters
+    """
+    try:
+        return len(binascii.unhexlify(doc_id)) == ID_SIZE
+    except (TypeError, ValueError, binascii.Error):
+        return False
+
+
+def encode_id(doc_id):
+    """ Encode a document identifier in its fixed-width binary form
+
+    :param str doc_id: The identifier, trello identifiers are stored as is,
+    other identifiers are hashed
+
+    :rtype: bytes
+    """
+    if is_trello_id(doc_id):
+        return binascii.unhexlify(doc_id)
+    if not isinstance(doc_id, bytes):
+        doc_id = doc_id.encode('utf-8')
+    return hashlib.sha1(doc_id).digest()[:ID_SIZE]
+
+
+def decode_id(encoded):
+    return binascii.hexlify(encoded).decode('ascii')
+
+
+def fingerprint(doc):
+    """ Compute the fingerprint of a document's content
+
+    :param dict doc: The document
+
+    :return: 8 bytes digest
+    :rtype: bytes
+    """
+    return hashlib.sha1(json.dumps(doc, sort_keys=True)).digest()[:8]
+
+
+def bloom_positions(encoded, bits):
+    digest = hashlib.md5(encoded).digest()
+    first, second = struct.unpack('>QQ', digest)
+    return [(first + i * second) % bits for i in range(BLOOM_HASHES)]
+
+
+class IdIndex(object):
+    """ A read-only, memory-mapped index file
+    """
+
+    def __init__(self, path=None):
+        """ Open an index file
+
+        :param str path: The index file, a missing or None path gives an
+        empty index
+        """
+        self.__mmap = None
+        self.__count = 0
+        self.__bloom_bits = 0
+        self.__hashed = {}
+        if path is None or not osp.exists(path):
+            return
+        with open(path, 'rb') as istr:
+            if os.fstat(istr.fileno()).st_size == 0:
+                return
+            self.__mmap = mmap.mmap(istr.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+        magic, version, count, bloom_bits, _ = \
+            HEADER.unpack_from(self.__mmap, 0)
+        if magic != MAGIC or version != FORMAT:
+            self.close()
+            raise ValueError('not an index file: {}'.format(path))
+        self.__count = count
+        self.__bloom_bits = bloom_bits
+        self.__records = HEADER.size + (bloom_bits + 7) // 8
+        trailer = self.__mmap[self.__records + count * RECORD.size:]
+        if trailer:
+            self.__hashed = {encode_id(i): i for i in json.loads(trailer)}
+
+    def close(self):
+        if self.__mmap is not None:
+            self.__mmap.close()
+            self.__mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.__count
+
+    def _record(self, position):
+        return RECORD.unpack_from(
+            self.__mmap, self.__records + position * RECORD.size)
+
+    def _might_contain(self, encoded):
+        for position in bloom_positions(encoded, self.__bloom_bits):
+            offset = HEADER.size + position // 8
+            byte = ord(self.__mmap[offset:offset + 1])
+            if not byte & (1 << (position % 8)):
+                return False
+        return True
+
+    def _find(self, encoded):
+        low, high = 0, self.__count
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(middle)[0] < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.__count and self._record(low)[0] == encoded:
+            return self._record(low)
+        return None
+
+    def get(self, doc_id):
+        """ Get the record of a document
+
+        :param str doc_id: The document identifier
+
+        :return: tuple made of the fingerprint and the generation, None if
+        the document is not in the index
+        """
+        if not self.__count:
+            return None
+        encoded = encode_id(doc_id)
+        if not self._might_contain(encoded):
+            return None
+        record = self._find(encoded)
+        return record[1:] if record is not None else None
+
+    def __contains__(self, doc_id):
+        return self.get(doc_id) is not None
+
+    def __iter__(self):
+        """ Iterate over the records, sorted by encoded identifier
+
+        :return: tuples made of the identifier, fingerprint and generation
+        """
+        for position in range(self.__count):
+            encoded, digest, gen = self._record(position)
+            yield self.decode(encoded), digest, gen
+
+    def decode(self, encoded):
+        """ Get the identifier of an encoded identifier of the index
+        """
+        doc_id = self.__hashed.get(encoded)
+        return doc_id if doc_id is not None else decode_id(encoded)
+
+    def keys(self):
+        """ Iterate over the encoded identifiers, sorted, see `encode_id`
+        """
+        for position in range(self.__count):
+            yield self._record(position)[0]
+
+    def ids(self):
+        """ Iterate over the documents identifiers, sorted by encoded
+        identifier
+        """
+        for doc_id, _, _ in self:
+            yield doc_id
+
+
+def write_index(path, records):
+    """ Write an index file atomically
+
+    :param str path: The index file
+    :param records: tuples made of an identifier, a fingerprint and a
+    generation
+    """
+    records = list(records)
+    encoded = sorted(set(
+        (encode_id(doc_id), digest, gen) for doc_id, digest, gen in records
+    ))
+    hashed = sorted(set(
+        doc_id for doc_id, _, _ in records if not is_trello_id(doc_id)
+    ))
+    bloom_bits = max(len(encoded) * BLOOM_BITS_PER_ID, 8)
+    bloom = bytearray((bloom_bits + 7) // 8)
+    for record in encoded:
+        for position in bloom_positions(record[0], bloom_bits):
+            bloom[position // 8] |= 1 << (position % 8)
+    directory = osp.dirname(path)
+    try:
+        os.makedirs(directory)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as ostr:
+            ostr.write(HEADER.pack(MAGIC, FORMAT, len(encoded), bloom_bits,
+                                   BLOOM_HASHES))
+            ostr.write(bytes(bloom))
+            for record in encoded:
+                ostr.write(RECORD.pack(*record))
+            if hashed:
+                ostr.write(json.dumps(hashed).encode('utf-8'))
+        os.rename(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def merge_removed(old_ids, new_ids):
+    """ Merge two sorted sequences of identifiers in a single pass
+
+    :param old_ids: sorted identifiers
+    :param new_ids: sorted identifiers
+
+    :return: the identifiers of `old_ids` missing in `new_ids`
+    """
+    new_ids = iter(new_ids)
+    current = next(new_ids, None)
+    for doc_id in old_ids:
+        while current is not None and current < doc_id:
+            current = next(new_ids, None)
+        if current != doc_id:
+            yield doc_id
+
+
+class FingerprintStore(object):
+    """ A directory of versioned index files, per board and kind of
+    documents
+    """
+
+    def __init__(self, directory):
+        """ Create a store backed by a local directory
+
+        :param str directory: The directory where index files are stored, it
+        is created on first write
+        """
+        self.__directory = directory
+
+    def path(self, board_id, kind, version):
+        return osp.join(self.__directory, '{}-{}-{}.idx'.format(
+            board_id, kind, version))
+
+    def exists(self, board_id, kind, version):
+        """ Whether a version of an index was written
+        """
+        return osp.exists(self.path(board_id, kind, version))
+
+    def open(self, board_id, kind, version):
+        """ Open an index file
+
+        :param str board_id: The board identifier
+        :param str kind: The kind of documents (`cards`, `members`)
+        :param int version: The index version, None for an empty index
+
+        :rtype: IdIndex
+        """
+        if version is None:
+            return IdIndex()
+        return IdIndex(self.path(board_id, kind, version))
+
+    def write(self, board_id, kind, version, records):
+        """ Write a version of an index
+
+        :param str board_id: The board identifier
+        :param str kind: The kind of documents (`cards`, `members`)
+        :param int version: The index version
+        :param records: tuples made of an identifier, a fingerprint and a
+        generation
+        """
+        write_index(self.path(board_id, kind, version), records)
+
+    def purge(self, board_id, keep=None):
+        """ Remove the index files of a board
+
+        :param str board_id: The board identifier
+        :param int keep: A version to keep, if any
+        """
+        pattern = osp.join(self.__directory, '{}-*.idx'.format(board_id))
+        for path in glob.glob(pattern):
+            version = path[:-len('.idx')].rsplit('-', 1)[-1]
+            if keep is None or version != str(keep):
+                os.remove(path)
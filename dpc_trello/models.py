@@ -0,0 +1,116 @@
+"""Slotted models of the trello objects transformed by the crawler
+
+Models are built from the decoded JSON responses and only keep the fields
+the crawler reads, they do not reference the decoded responses.
+"""
+
+
+class Member(object):
+    """ A trello member
+    """
+    __slots__ = ('id', 'full_name', 'username', 'avatar_hash')
+
+    def __init__(self, obj):
+        """ Build a member
+
+        :param dict obj: The member, as returned by trello's API
+        """
+        self.id = obj['id']
+        self.full_name = obj['fullName']
+        self.username = obj['username']
+        self.avatar_hash = obj.get('avatarHash')
+
+
+class Action(object):
+    """ A trello action of a card (creation, comment...)
+    """
+    __slots__ = ('type', 'date', 'id_member_creator', 'text', 'links')
+
+    def __init__(self, obj):
+        """ Build an action
+
+        :param dict obj: The action, as returned by trello's API
+        """
+        data = obj.get('data') or {}
+        self.type = obj['type']
+        self.date = obj['date']
+        self.id_member_creator = obj.get('idMemberCreator')
+        self.text = data.get('text')
+        # the list and board a card was created in, as
+        # (kind, shortLink, name) tuples
+        self.links = tuple(
+            (kind, link['shortLink'], link.get('name'))
+            for kind, link in data.iteritems()
+            if kind != 'card' and isinstance(link, dict) and
+            'shortLink' in link
+        )
+
+
+class Attachment(object):
+    """ A file attached to a trello card
+    """
+    __slots__ = ('id', 'name', 'url', 'date', 'bytes', 'mime_type',
+                 'previews')
+
+    def __init__(self, obj):
+        """ Build an attachment
+
+        :param dict obj: The attachment, as returned by trello's API
+        """
+        self.id = obj['id']
+        self.name = obj['name']
+        self.url = obj['url']
+        self.date = obj['date']
+        self.bytes = obj['bytes']
+        self.mime_type = obj.get('mimeType')
+        self.previews = obj.get('previews', [])
+
+
+class Checklist(object):
+    """ A checklist of a trello card
+    """
+    __slots__ = ('name', 'items')
+
+    def __init__(self, obj):
+        """ Build a checklist
+
+        :param dict obj: The checklist, as returned by trello's API
+        """
+        self.name = obj['name']
+        self.items = tuple(
+            (item['name'], item['state'] == 'complete')
+            for item in obj.get('checkItems', [])
+        )
+
+
+class Card(object):
+    """ A trello card joined with its actions, checklists and labels
+    """
+    __slots__ = ('id', 'name', 'desc', 'closed', 'date_last_activity',
+                 'short_url', 'id_list', 'id_members', 'subscribed', 'labels',
+                 'actions', 'attachments', 'checklists')
+
+    def __init__(self, obj, actions=(), checklists=(), labels=()):
+        """ Build a card
+
+        :param dict obj: The card, as returned by trello's API, fields not
+        requested are None
+        :param list actions: The card's actions, as returned by trello's API
+        :param list checklists: The card's checklists, as returned by
+        trello's API
+        :param list labels: The card's labels, as returned by trello's API
+        """
+        self.id = obj['id']
+        self.name = obj.get('name')
+        self.desc = obj.get('desc')
+        self.closed = obj.get('closed', False)
+        self.date_last_activity = obj.get('dateLastActivity')
+        self.short_url = obj.get('shortUrl')
+        self.id_list = obj.get('idList')
+        self.id_members = obj.get('idMembers', [])
+        self.subscribed = obj.get('subscribed', False)
+        self.labels = [l['name'] for l in labels if l.get('name')]
+        self.actions = [Action(a) for a in actions]
+        # every transformed card reads its attachments and checklists
+        self.attachments = [Attachment(a) for a in obj.get('attachments', [])]
+        self.checklists = [Checklist(c) for c in checklists]
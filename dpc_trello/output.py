@@ -0,0 +1,142 @@
+"""Compact output profile of the pushed cards
+
+The profile is described by the `output` crawl configuration, a dict
+accepting the following keys:
+
+- `embed`: `eager` to push the HTML rendering of every description and
+  comment (default), `lazy` to only push it when the text has markdown
+  formatting, `none` to never push it
+- `max_description`: maximum length of a card's description, in characters
+- `max_comment`: maximum length of a comment's text, in characters
+- `dedup_tags`: whether to drop the `tag` attachments duplicating the
+  card's `labels` (default `False`)
+- `author_thumbnails`: whether to push the thumbnails of the card's members
+  and comments authors, the card's author always has one (default `True`)
+"""
+
+import json
+import re
+
+EMBED_POLICIES = ('eager', 'lazy', 'none')
+ELLIPSIS = u'\u2026'
+
+# characters and line prefixes having a meaning in markdown
+MARKDOWN_SYNTAX = re.compile(
+    r'[*_`#\[\]<>!|~\\]|\n\s*\n|^\s*([-+]|\d+\.)\s', re.MULTILINE)
+
+
+def has_markup(text):
+    """ Tell whether a text may be rendered differently than plain text
+
+    :param str text: A markdown text
+
+    :rtype: bool
+    """
+    return MARKDOWN_SYNTAX.search(text or u'') is not None
+
+
+def render(text):
+    """ Render a markdown text the same way cards are
+
+    :param str text: A markdown text
+
+    :return: The HTML rendering, None if it failed
+    """
+    import markdown
+    try:
+        return markdown.markdown(
+            text, extensions=['markdown_checklist.extension'])
+    except:  # pylint: disable=bare-except
+        return None
+
+
+def keeps_embed(text, policy):
+    """ Tell whether the HTML rendering of a text is pushed, so that texts
+    whose rendering is dropped are not rendered at all
+
+    :param str text: A markdown text
+    :param str policy: The `embed` policy of the `output` crawl
+    configuration, `eager` if None
+
+    :rtype: bool
+    """
+    policy = policy or 'eager'
+    if policy not in EMBED_POLICIES:
+        raise ValueError('unknown embed policy: {}'.format(policy))
+    return policy == 'eager' or (policy == 'lazy' and has_markup(text))
+
+
+def truncate(text, max_length):
+    """ Truncate a text to a maximum length, ellipsis included
+
+    :param str text: The text to truncate
+    :param int max_length: Maximum length, None for no limit
+
+    :return: tuple made of the text and whether it was truncated
+    :rtype: tuple
+    """
+    if text is None or max_length is None or len(text) <= max_length:
+        return text, False
+    return text[:max(max_length - 1, 0)] + ELLIPSIS, True
+
+
+def compact_text(doc, text_field, settings, max_length):
+    """ Apply the embed policy and length cap to a text and its embed
+
+    :param dict doc: The card or comment, modified in place
+    :param str text_field: The name of the text field
+    :param dict settings: The `output` crawl configuration
+    :param int max_length: Maximum length of the text, None for no limit
+    """
+    text, truncated = truncate(doc.get(text_field), max_length)
+    doc[text_field] = text
+    if not keeps_embed(text, settings.get('embed')):
+        doc.pop('embed', None)
+    elif truncated:
+        doc['embed'] = render(text)
+
+
+def without_thumbnail(author):
+    return {k: v for k, v in author.iteritems() if k != 'thumbnail'}
+
+
+def compact_card(card, settings):
+    """ Build the compact version of a docido card
+
+    :param dict card: The docido card, it is not modified
+    :param dict settings: The `output` crawl configuration
+
+    :return: The compact card
+    :rtype: dict
+    """
+    card = dict(card)
+    compact_text(card, 'description', settings,
+                 settings.get('max_description'))
+    if 'comments' in card:
+        card['comments'] = [dict(c) for c in card['comments']]
+        for comment in card['comments']:
+            compact_text(comment, 'text', settings,
+                         settings.get('max_comment'))
+    if settings.get('dedup_tags', False):
+        labels = set(card.get('labels', []))
+        card['attachments'] = [
+            a for a in card.get('attachments', [])
+            if a.get('type') != u'tag' or a.get('name') not in labels
+        ]
+    if not settings.get('author_thumbnails', True):
+        card['to'] = [without_thumbnail(a) for a in card.get('to', [])]
+        for comment in card.get('comments', []):
+            comment['author'] = without_thumbnail(comment['author'])
+    return card
+
+
+def payload_size(docs):
+    """ Compute the size of documents once serialized, this serializes the
+    whole documents so it is meant for debugging
+
+    :param list docs: The documents to push
+
+    :return: The size in bytes of their JSON serialization
+    :rtype: int
+    """
+    return len(json.dumps(docs))
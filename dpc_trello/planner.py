@@ -0,0 +1,91 @@
+"""Crawl plan and budget of an account
+
+Planning is enabled with the `budget` crawl configuration, a dict accepting
+the following keys:
+
+- `requests`: maximum number of trello requests of a run
+- `bytes`: maximum number of bytes received from trello by a run
+- `duration`: maximum cumulated duration of the boards tasks of a run, in
+  seconds
+- `default_estimate`: estimate of the boards never crawled before, a dict
+  with `requests`, `bytes` and `duration` keys
+
+Every limit is optional. Boards are estimated from the statistics recorded
+by their previous crawl, and planned by decreasing priority: boards deferred
+by previous runs first, then the most recently active ones. Boards which do
+not fit in the budget are deferred to a later run, but the first board is
+always planned so that every run makes progress.
+"""
+
+DEFAULT_ESTIMATE = dict(requests=2, bytes=256 * 1024, duration=2.0)
+ESTIMATE_KEYS = ('requests', 'bytes', 'duration')
+
+
+def estimate_board(stats, settings):
+    """ Estimate the cost of crawling a board
+
+    :param dict stats: The statistics recorded by the previous crawl of the
+    board, by task kind
+    :param dict settings: The `budget` crawl configuration
+
+    :return: The estimated `requests`, `bytes` and `duration`
+    :rtype: dict
+    """
+    tasks = [v for v in stats.values() if isinstance(v, dict)]
+    if not tasks:
+        return dict(DEFAULT_ESTIMATE, **settings.get('default_estimate', {}))
+    return {
+        key: sum(task.get(key, 0) for task in tasks)
+        for key in ESTIMATE_KEYS
+    }
+
+
+def board_priority(board, stats):
+    """ Compute the sort key of a board, highest priority first
+
+    :param dict board: The board, as returned by trello's API
+    :param dict stats: The statistics recorded by the previous crawls of the
+    board
+
+    :rtype: tuple
+    """
+    return (stats.get('deferred', 0), board.get('dateLastActivity') or '')
+
+
+def plan_crawl(boards, stats, settings):
+    """ Build the crawl plan of an account
+
+    :param list boards: The boards to crawl, as returned by trello's API
+    :param dict stats: The statistics of the previous crawls, by board
+    identifier
+    :param dict settings: The `budget` crawl configuration
+
+    :return: The plan, a dict with the estimated cost and the decision of
+    every board by decreasing priority (`boards`), the `planned` and
+    `deferred` totals, and the `budget`
+    :rtype: dict
+    """
+    boards = sorted(
+        boards,
+        key=lambda b: board_priority(b, stats.get(b['id'], {})),
+        reverse=True
+    )
+    budget = {k: settings[k] for k in ESTIMATE_KEYS if k in settings}
+    planned = dict.fromkeys(ESTIMATE_KEYS, 0)
+    deferred = dict.fromkeys(ESTIMATE_KEYS, 0)
+    entries = []
+    for board in boards:
+        estimate = estimate_board(stats.get(board['id'], {}), settings)
+        fits = not entries or all(
+            planned[k] + estimate[k] <= v for k, v in budget.iteritems()
+        )
+        totals = planned if fits else deferred
+        for key in ESTIMATE_KEYS:
+            totals[key] += estimate[key]
+        entries.append(dict(estimate, board_id=board['id'], planned=fits))
+    return dict(
+        boards=entries,
+        planned=planned,
+        deferred=deferred,
+        budget=budget,
+    )
@@ -0,0 +1,109 @@
+"""On-demand profiling of crawl tasks
+
+Profiling is enabled with the `profiling` crawl configuration, a dict
+accepting the following keys:
+
+- `output_dir` (mandatory): local directory where profiles are written
+- `boards`: identifiers of the boards to always profile
+- `sample_rate`: ratio of the other boards to profile, between 0 and 1
+- `cprofile`: whether to dump cProfile statistics (default `True`)
+- `tracemalloc`: whether to dump top allocation sites (default `False`)
+- `top`: number of allocation sites to dump (default 25)
+"""
+
+import errno
+import functools
+import os
+import os.path as osp
+import random
+import time
+
+
+def should_profile(settings, board_id):
+    """ Tell whether the tasks of a board must be profiled
+
+    :param dict settings: The `profiling` crawl configuration
+    :param str board_id: The board identifier
+
+    :rtype: bool
+    """
+    if board_id in settings.get('boards', []):
+        return True
+    return random.random() < settings.get('sample_rate', 0)
+
+
+def profiled(task, name, settings):
+    """ Wrap a docido_sdk compliant task so that it is profiled
+
+    :param task: The task to profile
+    :param str name: Prefix of the profile files, should identify the token
+    and the board
+    :param dict settings: The `profiling` crawl configuration
+
+    :return: a docido_sdk compliant task
+    :rtype: functools.partial
+    """
+    return functools.partial(profile_task, task, name, settings)
+
+
+def profile_task(task, name, settings, push_api, token, prev_result,
+                 config, logger):
+    """ Run a task with cProfile and/or tracemalloc enabled and write the
+    results in the `output_dir` directory, named after the task name and
+    start time.
+
+    :param task: The task to profile
+    :param str name: Prefix of the profile files
+    :param dict settings: The `profiling` crawl configuration
+    :param push_api: The IndexAPI to use
+    :param token: an OauthToken object
+    :param prev_result: Previous task result, if any
+    :param nameddict config: crawl configuration
+    :param logger: A logging.logger instance
+
+    :return: The task result
+    """
+    directory = settings['output_dir']
+    try:
+        os.makedirs(directory)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+    prefix = osp.join(directory, '{}-{}'.format(
+        name, time.strftime('%Y%m%dT%H%M%S')))
+    profiler = None
+    if settings.get('cprofile', True):
+        import cProfile
+        profiler = cProfile.Profile()
+    tracemalloc = None
+    if settings.get('tracemalloc', False):
+        try:
+            import tracemalloc
+        except ImportError:
+            logger.warning('tracemalloc is not available, '
+                           'allocations are not traced')
+        else:
+            if tracemalloc.is_tracing():
+                # already traced by an enclosing task or by the process
+                tracemalloc = None
+            else:
+                tracemalloc.start()
+    logger.info('profiling task {} in {}'.format(name, prefix))
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            return task(push_api, token, prev_result, config, logger)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+    finally:
+        if profiler is not None:
+            profiler.dump_stats(prefix + '.prof')
+        if tracemalloc is not None:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            stats = snapshot.statistics('lineno')[:settings.get('top', 25)]
+            with open(prefix + '.malloc.txt', 'w') as ostr:
+                for stat in stats:
+                    ostr.write('{}\n'.format(stat))
@@ -0,0 +1,128 @@
+"""Adaptive refresh of boards based on their observed change rate
+
+Adaptive refresh is enabled with the `refresh` crawl configuration, a dict
+accepting the following keys:
+
+- `hot_interval`: boards changing on average at least once per this
+  duration, in seconds, are crawled on every run (default 1 day)
+- `cold_every`: other boards are crawled every Nth run (default 10)
+- `max_staleness`: boards not crawled for this duration, in seconds, are
+  crawled whatever their change rate (default 7 days)
+- `history`: number of distinct `dateLastActivity` values kept per board
+  to estimate its change rate (default 10)
+
+Boards are always crawled by full crawls. A board is only considered
+crawled once its tasks succeeded, see `record_crawl`.
+"""
+
+import calendar
+import time
+
+DEFAULT_HOT_INTERVAL = 24 * 3600
+DEFAULT_COLD_EVERY = 10
+DEFAULT_MAX_STALENESS = 7 * 24 * 3600
+DEFAULT_HISTORY = 10
+
+
+def activity_timestamp(date):
+    """ Convert a trello date to a UNIX timestamp
+
+    :param str date: An ISO 8601 UTC date, as returned by trello's API
+
+    :rtype: int
+    """
+    return calendar.timegm(time.strptime(date[:19], '%Y-%m-%dT%H:%M:%S'))
+
+
+def record_activity(state, last_activity, settings):
+    """ Add the current `dateLastActivity` of a board to its history
+
+    :param dict state: The board's refresh state
+    :param str last_activity: The board's `dateLastActivity`, if any
+    :param dict settings: The `refresh` crawl configuration
+
+    :return: The updated refresh state
+    :rtype: dict
+    """
+    activity = list(state.get('activity', []))
+    if last_activity:
+        timestamp = activity_timestamp(last_activity)
+        if not activity or timestamp > activity[-1]:
+            activity.append(timestamp)
+    history = settings.get('history', DEFAULT_HISTORY)
+    return dict(state, activity=activity[-history:])
+
+
+def change_interval(state, now):
+    """ Estimate the average duration between two changes of a board,
+    including the time elapsed since its last change so that boards
+    becoming quiet cool down
+
+    :param dict state: The board's refresh state
+    :param float now: The current UNIX timestamp
+
+    :return: The duration in seconds, None if the board never changed
+    :rtype: float
+    """
+    activity = state.get('activity')
+    if not activity:
+        return None
+    return float(now - activity[0]) / len(activity)
+
+
+def is_due(state, settings, now):
+    """ Tell whether a board must be crawled by the current run
+
+    :param dict state: The board's refresh state
+    :param dict settings: The `refresh` crawl configuration
+    :param float now: The current UNIX timestamp
+
+    :rtype: bool
+    """
+    crawled = state.get('crawled')
+    if crawled is None:
+        return True
+    if now - crawled >= settings.get('max_staleness', DEFAULT_MAX_STALENESS):
+        return True
+    interval = change_interval(state, now)
+    if interval is not None and \
+            interval <= settings.get('hot_interval', DEFAULT_HOT_INTERVAL):
+        return True
+    cold_every = settings.get('cold_every', DEFAULT_COLD_EVERY)
+    return state.get('skipped', 0) + 1 >= cold_every
+
+
+def schedule(state, last_activity, settings, now, run_id=None):
+    """ Decide whether a board must be crawled by the current run
+
+    :param dict state: The board's refresh state
+    :param str last_activity: The board's `dateLastActivity`, if any
+    :param dict settings: The `refresh` crawl configuration
+    :param float now: The current UNIX timestamp
+    :param str run_id: The crawl run identifier, if any. A restarted run
+    keeps the decisions of its previous attempts.
+
+    :return: tuple made of the decision and the updated refresh state
+    :rtype: tuple
+    """
+    if run_id and state.get('run') == run_id:
+        return state['due'], state
+    state = record_activity(state, last_activity, settings)
+    due = is_due(state, settings, now)
+    if not due:
+        state['skipped'] = state.get('skipped', 0) + 1
+    state.update(run=run_id, due=due)
+    return due, state
+
+
+def record_crawl(state, now):
+    """ Record the successful crawl of a board, so that a board whose tasks
+    failed stays due for a refresh
+
+    :param dict state: The board's refresh state
+    :param float now: The current UNIX timestamp
+
+    :return: The updated refresh state
+    :rtype: dict
+    """
+    return dict(state, crawled=now, skipped=0)
@@ -0,0 +1,195 @@
+"""Standalone execution of crawl tasks across a pool of processes
+
+The tasks generated by `TrelloCrawler.iter_crawl_tasks` are run by
+sequence, one board per worker at a time, for instance:
+
+    from dpc_trello.crawler import TrelloCrawler
+    from dpc_trello.runner import run_crawl
+
+    report = run_crawl(crawler, create_index, token, config, logger,
+                       processes=16, rate_limit=50)
+
+Every worker creates its own index API with the given factory and its own
+trello clients. Trello requests of all workers are throttled by a single
+rate limiter.
+"""
+
+import logging
+import multiprocessing
+import time
+import traceback
+
+from docido_sdk.toolbox.collections_ext import nameddict
+
+import dpc_trello.crawler
+
+# state of the current worker process, see `init_worker`
+WORKER = {}
+
+
+class TaskError(Exception):
+    """ An exception raised by a task in a worker, carrying the formatted
+    traceback since the original exception may not be picklable
+    """
+    def __init__(self, task, error):
+        self.task = task
+        self.error = error
+        super(TaskError, self).__init__(task, error)
+
+    def __str__(self):
+        return 'task {} failed: {}'.format(self.task, self.error)
+
+
+class RateLimiter(object):
+    """ A process-safe rate limiter, spacing calls evenly
+    """
+
+    def __init__(self, rate):
+        """ Create a new limiter, to be shared with worker processes at
+        their creation
+
+        :param float rate: The maximum number of calls per second
+        """
+        self.__interval = 1.0 / rate
+        self.__lock = multiprocessing.Lock()
+        self.__next_call = multiprocessing.Value('d', 0.0, lock=False)
+
+    def __call__(self):
+        """ Wait until a call is allowed
+        """
+        with self.__lock:
+            now = time.time()
+            call = max(now, self.__next_call.value)
+            self.__next_call.value = call + self.__interval
+        if call > now:
+            time.sleep(call - now)
+
+
+def task_name(task):
+    """ Build a readable name of a task
+
+    :param task: a docido_sdk compliant task
+
+    :rtype: str
+    """
+    func = getattr(task, 'func', task)
+    args = [
+        a for a in getattr(task, 'args', ())
+        if isinstance(a, (str, type(u'')))
+    ]
+    return '{}({})'.format(getattr(func, '__name__', repr(func)),
+                           ', '.join(args))
+
+
+def init_worker(index_factory, token, config, rate_limiter):
+    """ Initialize a worker process
+
+    :param index_factory: A picklable callable creating an IndexAPI
+    :param token: an OauthToken object
+    :param nameddict config: crawl configuration
+    :param rate_limiter: The limiter shared by all workers, if any
+    """
+    dpc_trello.crawler.RATE_LIMITER = rate_limiter
+    WORKER.update(
+        index=index_factory(),
+        token=token,
+        config=config,
+        logger=logging.getLogger('dpc_trello.runner.worker'),
+    )
+
+
+def run_sequence(tasks, aborted=None):
+    """ Run a sequence of tasks in a worker process, each task being given
+    the result of the previous one. An exception raised by a task becomes its
+    result, as with the docido SDK.
+
+    :param list tasks: docido_sdk compliant tasks
+    :param aborted: A callable checked before every task, the remaining
+    tasks are not run once it returns True
+
+    :return: The outcome of every task, as a list of dicts with `task`,
+    `duration` and either `result` or `error` keys
+    :rtype: list
+    """
+    outcomes = []
+    prev_result = None
+    for task in tasks:
+        if aborted is not None and aborted():
+            break
+        name = task_name(task)
+        start = time.time()
+        try:
+            prev_result = task(WORKER['index'], WORKER['token'], prev_result,
+                               WORKER['config'], WORKER['logger'])
+        except Exception:  # pylint: disable=broad-except
+            WORKER['logger'].exception('task {} failed'.format(name))
+            prev_result = TaskError(name, traceback.format_exc())
+        else:
+            if isinstance(prev_result, Exception) and \
+                    not isinstance(prev_result, TaskError):
+                prev_result = TaskError(name, repr(prev_result))
+        outcome = dict(task=name, duration=time.time() - start)
+        if isinstance(prev_result, Exception):
+            outcome['error'] = prev_result
+        else:
+            outcome['result'] = prev_result
+        outcomes.append(outcome)
+    return outcomes
+
+
+def run_crawl(crawler, index_factory, token, config, logger,
+              processes=None, rate_limit=None):
+    """ Generate the crawl tasks of an account and run them across a pool
+    of processes. The epilogue is only run when every task succeeded.
+
+    :param crawler: The crawler generating the tasks
+    :param index_factory: A picklable callable creating an IndexAPI
+    :param token: an OauthToken object
+    :param dict config: crawl configuration
+    :param logger: A logging.logger instance
+    :param int processes: Number of worker processes, defaults to the
+    number of CPUs
+    :param float rate_limit: Maximum number of trello requests per second,
+    across all workers
+
+    :return: The run report, a dict with the `outcomes` of every task, the
+    `errors` among them, whether the `epilogue` was run, and the `duration`
+    of the run
+    :rtype: dict
+    """
+    start = time.time()
+    config = nameddict(config)
+    config.setdefault('full', False)
+    index = index_factory()
+    crawl_tasks = crawler.iter_crawl_tasks(index, token, config, logger)
+    rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+    pool = multiprocessing.Pool(
+        processes,
+        initializer=init_worker,
+        initargs=(index_factory, token, config, rate_limiter),
+    )
+    try:
+        sequences = list(pool.imap_unordered(
+            run_sequence, crawl_tasks['tasks'], chunksize=1))
+    finally:
+        pool.close()
+        pool.join()
+    outcomes = [outcome for seq in sequences for outcome in seq]
+    errors = [outcome for outcome in outcomes if 'error' in outcome]
+    epilogue = crawl_tasks.get('epilogue')
+    if epilogue is not None and errors:
+        logger.warning('{} tasks failed, epilogue is not run'.format(
+            len(errors)))
+        epilogue = None
+    if epilogue is not None:
+        results = [seq[-1]['result'] for seq in sequences if seq]
+        epilogue(index, token, results, config, logger)
+    duration = time.time() - start
+    logger.info('{} tasks run by {} processes in {:.1f}s'.format(
+        len(outcomes), processes or multiprocessing.cpu_count(), duration))
+    return dict(
+        outcomes=outcomes,
+        errors=errors,
+        epilogue=epilogue is not None,
+        duration=duration,
+    )
@@ -0,0 +1,115 @@
+"""Crawl scope filters
+
+The scope is described by the `scope` crawl configuration, a dict accepting
+the following keys:
+
+- `include_boards`: only crawl boards whose id or name match one of these
+  patterns
+- `exclude_boards`: do not crawl boards whose id or name match one of these
+  patterns
+- `organizations`: only crawl the organizations boards of these
+  organizations identifiers. Personal boards are not filtered by this
+  setting but by `personal_boards`, set it to `False` to only crawl the
+  boards of the given organizations.
+- `personal_boards`: whether to crawl boards not belonging to an
+  organization (default `True`)
+- `closed_boards`: whether to crawl closed boards (default `True`)
+- `closed_cards`: whether to crawl archived cards (default `False`)
+- `exclude_lists`: do not crawl cards of lists whose name match one of these
+  patterns
+
+Patterns are case insensitive shell-style wildcards, see `fnmatch`.
+"""
+
+import fnmatch
+import hashlib
+import json
+
+
+def matches(value, patterns):
+    """ Tell whether a value matches one of the given patterns
+
+    :param str value: The value to match
+    :param list patterns: Shell-style wildcards
+
+    :rtype: bool
+    """
+    value = (value or u'').lower()
+    return any(fnmatch.fnmatchcase(value, p.lower()) for p in patterns)
+
+
+def board_in_scope(board, scope):
+    """ Tell whether a board must be crawled, from its metadata only
+
+    :param dict board: The board, as returned by trello's API
+    :param dict scope: The `scope` crawl configuration
+
+    :rtype: bool
+    """
+    if board.get('closed') and not scope.get('closed_boards', True):
+        return False
+    organization = board.get('idOrganization')
+    if not organization and not scope.get('personal_boards', True):
+        return False
+    # personal boards are only filtered by `personal_boards`
+    organizations = scope.get('organizations')
+    if organization and organizations is not None \
+            and organization not in organizations:
+        return False
+    include = scope.get('include_boards')
+    if include and not (matches(board['id'], include) or
+                        matches(board.get('name'), include)):
+        return False
+    exclude = scope.get('exclude_boards', [])
+    if matches(board['id'], exclude) or matches(board.get('name'), exclude):
+        return False
+    return True
+
+
+def list_in_scope(trello_list, scope):
+    """ Tell whether the cards of a list must be crawled
+
+    :param dict trello_list: The list, as returned by trello's API
+    :param dict scope: The `scope` crawl configuration
+
+    :rtype: bool
+    """
+    return not matches(trello_list.get('name'), scope.get('exclude_lists', []))
+
+
+def boards_filter(scope):
+    """ Get the `filter` parameter to use when listing boards
+
+    :param dict scope: The `scope` crawl configuration
+
+    :return: The filter to push down to trello's API
+    :rtype: str
+    """
+    return 'all' if scope.get('closed_boards', True) else 'open'
+
+
+def cards_filter(scope):
+    """ Get the `filter` parameter to use when listing cards
+
+    :param dict scope: The `scope` crawl configuration
+
+    :return: The filter to push down to trello's API
+    :rtype: str
+    """
+    return 'all' if scope.get('closed_cards', False) else 'open'
+
+
+def cards_scope_key(scope):
+    """ Compute a digest of the scope settings affecting which cards of a
+    board are crawled, so that boards snapshots of different scopes are not
+    mixed up
+
+    :param dict scope: The `scope` crawl configuration
+
+    :rtype: str
+    """
+    settings = dict(
+        closed_cards=scope.get('closed_cards', False),
+        exclude_lists=sorted(scope.get('exclude_lists', [])),
+    )
+    return hashlib.sha1(json.dumps(settings, sort_keys=True)).hexdigest()[:8]
@@ -0,0 +1,81 @@
+"""Raw trello responses persisted on disk, to reprocess boards offline"""
+
+import os.path as osp
+
+from dpc_trello.cache import dump_json_gz, load_json_gz
+
+
+class SnapshotNotFound(Exception):
+    """An exception to throw when a raw snapshot is missing"""
+    def __init__(self, path):
+        self.path = path
+        msg = 'No raw snapshot found at {}'.format(path)
+        super(SnapshotNotFound, self).__init__(msg)
+
+
+class RawSnapshotStore(object):
+    """ A directory of gzip compressed trello responses of a single account:
+    the account's member and boards, and the responses of every board's
+    tasks.
+    """
+
+    def __init__(self, directory):
+        """ Create a store backed by a local directory
+
+        :param str directory: The directory where responses are stored, it
+        is created on first write
+        """
+        self.__directory = directory
+
+    def _path(self, name):
+        return osp.join(self.__directory, '{}.json.gz'.format(name))
+
+    def _load(self, name):
+        path = self._path(name)
+        snapshot = load_json_gz(path)
+        if snapshot is None:
+            raise SnapshotNotFound(path)
+        return snapshot
+
+    def save_account(self, me, boards):
+        """ Store the responses used to generate crawl tasks
+
+        :param dict me: The trello member of the account
+        :param list boards: The boards the member has access to
+        """
+        dump_json_gz(self._path('account'), dict(me=me, boards=boards))
+
+    def load_account(self):
+        """ Load the responses used to generate crawl tasks
+
+        :return: tuple made of the trello member and the boards it has
+        access to
+        :rtype: tuple
+
+        :raise SnapshotNotFound: if the account was never saved
+        """
+        snapshot = self._load('account')
+        return snapshot['me'], snapshot['boards']
+
+    def save_board(self, board_id, kind, responses):
+        """ Store the responses fetched by a board task
+
+        :param str board_id: The board identifier
+        :param str kind: The kind of task (`cards`, `members`)
+        :param dict responses: The trello responses, by name
+        """
+        dump_json_gz(self._path('{}-{}'.format(board_id, kind)), responses)
+
+    def load_board(self, board_id, kind):
+        """ Load the responses fetched by a board task
+
+        :param str board_id: The board identifier
+        :param str kind: The kind of task (`cards`, `members`)
+
+        :return: The trello responses, by name
+        :rtype: dict
+
+        :raise SnapshotNotFound: if the board's task responses were never
+        saved
+        """
+        return self._load('{}-{}'.format(board_id, kind))
@@ -1,6 +1,15 @@
 """Basic trello client"""
 
-import requests
+from collections import deque
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import threading
+import time
+
+# (connect, read) timeouts in seconds, see requests documentation
+DEFAULT_TIMEOUT = (10, 60)
 
 
 class TrelloClientException(Exception):
@@ -11,19 +20,218 @@ class TrelloClientException(Exception):
         super(TrelloClientException, self).__init__(msg)
 
 
+class LatencyTracker(object):
+    """ A thread-safe window of the latest observed requests latencies
+    """
+
+    def __init__(self, window=200):
+        """ Create a new tracker
+
+        :param int window: The number of latencies to keep
+        """
+        self.__latencies = deque(maxlen=window)
+        self.__lock = threading.Lock()
+
+    def add(self, latency):
+        """ Record a request latency
+
+        :param float latency: The latency, in seconds
+        """
+        with self.__lock:
+            self.__latencies.append(latency)
+
+    def percentile(self, percentile, min_samples=1):
+        """ Compute a percentile of the recorded latencies
+
+        :param float percentile: The percentile to compute, between 0 and 100
+        :param int min_samples: The minimum number of recorded latencies
+
+        :return: The latency, in seconds, or None if not enough latencies
+        were recorded
+        :rtype: float
+        """
+        with self.__lock:
+            latencies = sorted(self.__latencies)
+        if not latencies or len(latencies) < min_samples:
+            return None
+        index = int(round(percentile / 100.0 * (len(latencies) - 1)))
+        return latencies[index]
+
+
+class EndpointLatencies(object):
+    """ Latency trackers by API endpoint, so that requests of very
+    different costs are not compared with each other
+    """
+
+    def __init__(self, window=200):
+        """ Create a new set of trackers
+
+        :param int window: The number of latencies to keep per endpoint
+        """
+        self.__window = window
+        self.__trackers = {}
+        self.__lock = threading.Lock()
+
+    def tracker(self, endpoint):
+        """ Get the tracker of an endpoint, created on first use
+
+        :param str endpoint: The endpoint, see `endpoint`
+
+        :rtype: LatencyTracker
+        """
+        with self.__lock:
+            tracker = self.__trackers.get(endpoint)
+            if tracker is None:
+                tracker = LatencyTracker(self.__window)
+                self.__trackers[endpoint] = tracker
+            return tracker
+
+
+def endpoint(path):
+    """ Get the endpoint of an API path, by dropping the identifiers
+    alternating with the resources names, e.g. `/boards/{id}/cards` gives
+    `boards/cards`
+
+    :param str path: The REST path of a resource
+
+    :rtype: str
+    """
+    return '/'.join(path.strip('/').split('/')[::2])
+
+
+# latencies observed by all clients of the process
+LATENCIES = EndpointLatencies()
+
+
 class TrelloClient(object):
     """ A basic client for trello REST API based on requests
     """
 
-    def __init__(self, consumer_key, token):
+    def __init__(self, consumer_key, token, timeout=DEFAULT_TIMEOUT,
+                 hedge_percentile=None, hedge_min_samples=20,
+                 latencies=None, rate_limiter=None):
         """ Create a new trello client with given credentials
 
         :param consumer_key: The trello API consumer key to use
         :param token: A docido SDK defined token
+        :param timeout: The (connect, read) timeouts of requests, in seconds
+        :param float hedge_percentile: When set, a duplicate of a GET request
+        is sent once it lasts longer than this percentile of the latencies
+        observed on the same endpoint, and the first response is used
+        :param int hedge_min_samples: The minimum number of observed
+        latencies before requests are hedged
+        :param EndpointLatencies latencies: Where latencies are recorded,
+        defaults to the trackers shared by the process
+        :param rate_limiter: An optional callable, called before every HTTP
+        request (hedged ones included)
         """
         self.__consumer_key = consumer_key
         self.__token = token
         self.__api_url = 'https://api.trello.com/1'
+        self.__timeout = timeout
+        self.__hedge_percentile = hedge_percentile
+        self.__hedge_min_samples = hedge_min_samples
+        self.__latencies = latencies if latencies is not None else LATENCIES
+        self.__rate_limiter = rate_limiter
+        self.hedged_requests = 0
+        self.requests = 0
+        self.received_bytes = 0
+        # guards the counters and the hedged attempts still running
+        self.__lock = threading.Lock()
+        self.__attempts = set()
+
+    def _request(self, latencies, **kwargs):
+        """ Send an HTTP request, record its latency and count it
+
+        :param LatencyTracker latencies: Where the latency is recorded
+        :param kwargs: `requests.request` parameters
+        """
+        # requests is expensive to import, see dpc_trello.crawler
+        import requests
+        if self.__rate_limiter is not None:
+            self.__rate_limiter()
+        start = time.time()
+        response = requests.request(timeout=self.__timeout, **kwargs)
+        latencies.add(time.time() - start)
+        size = 0 if kwargs.get('stream') else len(response.content)
+        with self.__lock:
+            self.requests += 1
+            self.received_bytes += size
+        return response
+
+    def _hedged_request(self, latencies, delay, **kwargs):
+        """ Send an HTTP request, and a duplicate if no response is received
+        after `delay` seconds. The first successful response is returned,
+        the other one is closed as soon as it is received.
+
+        :param LatencyTracker latencies: Where latencies are recorded
+        :param float delay: The delay before sending the duplicate, in
+        seconds
+        :param kwargs: `requests.request` parameters
+        """
+        results = queue.Queue()
+        lock = threading.Lock()
+        # whether a response was returned, guarded by `lock`
+        answered = []
+
+        def attempt():
+            try:
+                result = (True, self._request(latencies, **kwargs))
+            except Exception as exc:  # pylint: disable=broad-except
+                result = (False, exc)
+            with lock:
+                late = bool(answered)
+                if not late:
+                    results.put(result)
+            if late and result[0]:
+                # release the connection of the losing attempt
+                result[1].close()
+            with self.__lock:
+                self.__attempts.discard(threading.current_thread())
+
+        def start_attempt():
+            thread = threading.Thread(target=attempt)
+            # a late response must not prevent the process from exiting
+            thread.daemon = True
+            with self.__lock:
+                self.__attempts.add(thread)
+            thread.start()
+
+        start_attempt()
+        pending = 1
+        try:
+            succeeded, value = results.get(timeout=delay)
+            pending -= 1
+        except queue.Empty:
+            with self.__lock:
+                self.hedged_requests += 1
+            start_attempt()
+            pending += 1
+            succeeded, value = results.get()
+            pending -= 1
+        while not succeeded and pending:
+            succeeded, value = results.get()
+            pending -= 1
+        with lock:
+            answered.append(True)
+            while not results.empty():
+                late_succeeded, late = results.get()
+                if late_succeeded:
+                    late.close()
+        if not succeeded:
+            raise value
+        return value
+
+    def close(self, timeout=None):
+        """ Wait for the hedged attempts still running
+
+        :param float timeout: The maximum number of seconds to wait for
+        every attempt, None to wait until they complete
+        """
+        with self.__lock:
+            attempts = list(self.__attempts)
+        for thread in attempts:
+            thread.join(timeout)
 
     def _call_api(self, method, path, params=None, data=None):
         """ Perform an API call
@@ -38,20 +246,54 @@ class TrelloClient(object):
             'token': self.__token
         }
         request_params.update(params if params else {})
-        response = requests.request(
+        kwargs = dict(
             method=method,
             url=self.__api_url + path,
             params=request_params,
             data=data
         )
+        latencies = self.__latencies.tracker(endpoint(path))
+        delay = None
+        if method == 'get' and self.__hedge_percentile is not None:
+            delay = latencies.percentile(self.__hedge_percentile,
+                                         self.__hedge_min_samples)
+        if delay is None:
+            response = self._request(latencies, **kwargs)
+        else:
+            response = self._hedged_request(latencies, delay, **kwargs)
         if response.status_code is not 200:
             raise TrelloClientException(response)
         return response
 
-    def list_boards(self):
+    def download(self, url):
+        """ Start the download of an attachment's content, without reading
+        the response body
+
+        :param str url: The attachment's url
+
+        :return: The streamed response, to be closed by the caller
+        :rtype: requests.Response
+        """
+        headers = {}
+        if url.startswith('https://trello.com/'):
+            # uploads are only served to authenticated members
+            headers['Authorization'] = (
+                'OAuth oauth_consumer_key="{}", oauth_token="{}"'.format(
+                    self.__consumer_key, self.__token))
+        response = self._request(self.__latencies.tracker('download'),
+                                 method='get', url=url, headers=headers,
+                                 stream=True)
+        if response.status_code != 200:
+            response.close()
+            raise TrelloClientException(response)
+        return response
+
+    def list_boards(self, **params):
         """ List all boards the user have access to
+
+        :param params: Parameters as listed on the Trello API documentation
         """
-        resp = self._call_api('get', '/members/me/boards')
+        resp = self._call_api('get', '/members/me/boards', params=params)
         return resp.json()
 
     def list_board_members(self, board_id, **params):
@@ -80,6 +322,46 @@ class TrelloClient(object):
         )
         return resp.json()
 
+    def get_board(self, board_id, **params):
+        """ Get a board, possibly with nested resources
+
+        :param board_id: The board identifier
+        :param params: Parameters as listed on the Trello API documentation
+        """
+        resp = self._call_api(
+            'get',
+            '/boards/{}'.format(board_id),
+            params=params
+        )
+        return resp.json()
+
+    def list_board_actions(self, board_id, **params):
+        """ List actions of a given board
+
+        :param board_id: The board identifier
+        :param params: Parameters as listed on the Trello API documentation
+        """
+        resp = self._call_api(
+            'get',
+            '/boards/{}/actions'.format(board_id),
+            params=params
+        )
+        return resp.json()
+
+    def list_card_actions(self, card_id, **params):
+        """ List actions of a given card, whatever the board they were
+        made on
+
+        :param card_id: The card identifier
+        :param params: Parameters as listed on the Trello API documentation
+        """
+        resp = self._call_api(
+            'get',
+            '/cards/{}/actions'.format(card_id),
+            params=params
+        )
+        return resp.json()
+
     def list_board_lists(self, board_id, **params):
         """ List all lists of a given board
 
@@ -93,6 +375,32 @@ class TrelloClient(object):
         )
         return resp.json()
 
+    def list_list_cards(self, list_id, **params):
+        """ List cards of a given list
+
+        :param list_id: The list identifier
+        :param params: Parameters as listed on the Trello API documentation
+        """
+        resp = self._call_api(
+            'get',
+            '/lists/{}/cards'.format(list_id),
+            params=params
+        )
+        return resp.json()
+
+    def get_member(self, member_id, **params):
+        """ Get a member
+
+        :param member_id: The member identifier
+        :param params: Parameters as listed on the Trello API documentation
+        """
+        resp = self._call_api(
+            'get',
+            '/members/{}'.format(member_id),
+            params=params
+        )
+        return resp.json()
+
     def me(self):
         resp = self._call_api(
             'get',
@@ -0,0 +1,217 @@
+import base64
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+from dpc_trello.attachments import (
+    AttachmentFetcher,
+    attach_contents,
+    content_opener,
+    delete_card_contents,
+    encode_content,
+    is_trello_hosted,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+def hosted(origin_id, size=3, host='trello-attachments.s3.amazonaws.com'):
+    return dict(
+        type=u'file',
+        origin_id=origin_id,
+        url='https://{}/{}/file.txt'.format(host, origin_id),
+        size=size,
+    )
+
+
+class FakeResponse(object):
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class TestAttachments(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_is_trello_hosted(self):
+        self.assertTrue(is_trello_hosted(hosted('a')))
+        self.assertTrue(is_trello_hosted(hosted('a', host='trello.com')))
+        self.assertFalse(is_trello_hosted(hosted('a', host='example.com')))
+        self.assertFalse(is_trello_hosted(dict(type=u'tag', name='a')))
+
+    def test_fetch_and_cache(self):
+        urls = []
+
+        def open_stream(url):
+            urls.append(url)
+            return FakeResponse(['ab', 'c'])
+        fetcher = AttachmentFetcher(self.directory, open_stream)
+        paths = fetcher.fetch([hosted('a'), hosted('b')], LOGGER)
+        self.assertEqual(sorted(paths), ['a', 'b'])
+        with open(paths['a']) as istr:
+            self.assertEqual(istr.read(), 'abc')
+        self.assertEqual(len(urls), 2)
+        # contents are cached by identifier and size
+        self.assertEqual(
+            fetcher.fetch([hosted('a'), hosted('b')], LOGGER), paths)
+        self.assertEqual(len(urls), 2)
+        fetcher.fetch([hosted('a', size=4)], LOGGER)
+        self.assertEqual(len(urls), 3)
+
+    def test_size_cap(self):
+        responses = []
+
+        def open_stream(url):
+            responses.append(FakeResponse(['ab', 'cd']))
+            return responses[-1]
+        fetcher = AttachmentFetcher(self.directory, open_stream, max_size=3)
+        # declared size exceeds the cap, not downloaded
+        self.assertEqual(fetcher.fetch([hosted('a', size=4)], LOGGER), {})
+        self.assertEqual(responses, [])
+        # actual size exceeds the cap, download is aborted
+        self.assertEqual(fetcher.fetch([hosted('b', size=2)], LOGGER), {})
+        self.assertTrue(responses[0].closed)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_per_host_limit(self):
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def open_stream(url):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return FakeResponse(['a'])
+        fetcher = AttachmentFetcher(self.directory, open_stream,
+                                    concurrency=8, per_host=2)
+        paths = fetcher.fetch(
+            [hosted(str(i), size=1) for i in range(8)], LOGGER)
+        self.assertEqual(len(paths), 8)
+        self.assertEqual(peak[0], 2)
+
+    def test_evict(self):
+        fetcher = AttachmentFetcher(self.directory, max_cache_size=5)
+        for origin_id, mtime in [('old', 1000), ('recent', 2000)]:
+            path = fetcher.path(hosted(origin_id))
+            with open(path, 'w') as ostr:
+                ostr.write('abc')
+            os.utime(path, (mtime, mtime))
+        self.assertEqual(fetcher.evict(), 1)
+        self.assertEqual(os.listdir(self.directory), ['recent-3'])
+        self.assertEqual(fetcher.evict(), 0)
+
+    @mock.patch('requests.Session.get')
+    def test_content_opener(self, get):
+        trello = mock.Mock()
+        open_stream = content_opener(trello, (1, 2))
+        url = 'https://trello.com/1/cards/c/attachments/a/download/f.txt'
+        self.assertIs(open_stream(url), trello.download.return_value)
+        # S3 downloads do not go through the trello client
+        get.return_value.status_code = 200
+        s3_url = hosted('a')['url']
+        self.assertIs(open_stream(s3_url), get.return_value)
+        get.assert_called_once_with(s3_url, stream=True, timeout=(1, 2))
+        trello.download.assert_called_once_with(url)
+
+    def test_attach_contents(self):
+        cached = dict(hosted('a'), mime_type='text/plain')
+        fetcher = AttachmentFetcher(self.directory)
+        with open(fetcher.path(cached), 'w') as ostr:
+            ostr.write('abc')
+        card = dict(id='c', attachments=[
+            cached, hosted('b'), dict(type=u'tag', name='label')
+        ])
+        kv = {}
+        push_api = mock.Mock()
+        push_api.get_kv.side_effect = kv.get
+        push_api.set_kv.side_effect = kv.__setitem__
+        push_api.push_thumbnails.return_value = []
+        cards = attach_contents([card], fetcher, push_api, LOGGER)
+        self.assertEqual(cards[0]['attachments'][0]['_content_id'], 'a-3')
+        push_api.push_thumbnails.assert_called_once_with([
+            ('a-3', base64.b64encode(b'abc'), 'text/plain'),
+        ])
+        self.assertNotIn('_content_id', cards[0]['attachments'][1])
+        # given cards are not modified
+        self.assertNotIn('_content_id', cached)
+        # contents are uploaded once
+        cards = attach_contents([card], fetcher, push_api, LOGGER)
+        self.assertEqual(cards[0]['attachments'][0]['_content_id'], 'a-3')
+        self.assertEqual(push_api.push_thumbnails.call_count, 1)
+        self.assertEqual(kv['contents:c'], '["a-3"]')
+
+    def test_superseded_contents(self):
+        fetcher = AttachmentFetcher(self.directory)
+        for size in [3, 4]:
+            with open(fetcher.path(hosted('a', size)), 'w') as ostr:
+                ostr.write('a' * size)
+        kv = {}
+        push_api = mock.Mock()
+        push_api.get_kv.side_effect = kv.get
+        push_api.set_kv.side_effect = kv.__setitem__
+        push_api.delete_kv.side_effect = kv.pop
+        push_api.push_thumbnails.return_value = []
+        attach_contents([dict(id='c', attachments=[hosted('a', 3)])],
+                        fetcher, push_api, LOGGER)
+        self.assertFalse(push_api.delete_thumbnails_by_id.called)
+        # the attachment was replaced by a new version
+        attach_contents([dict(id='c', attachments=[hosted('a', 4)])],
+                        fetcher, push_api, LOGGER)
+        push_api.delete_thumbnails_by_id.assert_called_once_with(['a-3'])
+        self.assertEqual(sorted(kv), ['content:a-4', 'contents:c'])
+        # and removed
+        attach_contents([dict(id='c', attachments=[])], fetcher, push_api,
+                        LOGGER)
+        push_api.delete_thumbnails_by_id.assert_called_with(['a-4'])
+        self.assertEqual(kv, {})
+
+    def test_delete_card_contents(self):
+        kv = {'contents:c1': '["a-3", "b-4"]', 'content:a-3': '1',
+              'content:b-4': '1', 'contents:c2': '["c-5"]'}
+        push_api = mock.Mock()
+        push_api.get_kv.side_effect = kv.get
+        push_api.delete_kv.side_effect = kv.pop
+        delete_card_contents(push_api, ['c1', 'aMember'], LOGGER)
+        push_api.delete_thumbnails_by_id.assert_called_once_with(
+            ['a-3', 'b-4'])
+        self.assertEqual(kv, {'contents:c2': '["c-5"]'})
+
+    def test_encode_content(self):
+        path = os.path.join(self.directory, 'content')
+        data = os.urandom(200 * 1024)
+        with open(path, 'wb') as ostr:
+            ostr.write(data)
+        self.assertEqual(encode_content(path), base64.b64encode(data))
+
+    def test_failed_upload(self):
+        fetcher = AttachmentFetcher(self.directory)
+        with open(fetcher.path(hosted('a')), 'w') as ostr:
+            ostr.write('abc')
+        push_api = mock.Mock()
+        push_api.get_kv.return_value = None
+        push_api.push_thumbnails.return_value = [dict(status=500)]
+        cards = attach_contents([dict(id='c', attachments=[hosted('a')])],
+                                fetcher, push_api, LOGGER)
+        self.assertNotIn('_content_id', cards[0]['attachments'][0])
+        self.assertFalse(push_api.set_kv.called)
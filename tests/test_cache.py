@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from dpc_trello.cache import BoardSnapshotCache, dump_json_gz
+
+
+class TestBoardSnapshotCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_missing_board(self):
+        cache = BoardSnapshotCache(os.path.join(self.directory, 'cache'))
+        self.assertIsNone(cache.get('aBoard', 'aDate'))
+
+    def test_legacy_snapshot(self):
+        # snapshots stored by `dateLastActivity` are rebuilt
+        cache = BoardSnapshotCache(os.path.join(self.directory, 'cache'))
+        dump_json_gz(os.path.join(self.directory, 'cache', 'aBoard.json.gz'),
+                     dict(last_activity='aDate', entries=[]))
+        self.assertIsNone(cache.get('aBoard', 'aDate'))
+
+    def test_put_and_get(self):
+        cache = BoardSnapshotCache(os.path.join(self.directory, 'cache'))
+        entries = [{'card': {'id': 'aCard'}, 'creator': 'me', 'members': []}]
+        cache.put('aBoard', 'aDate', entries)
+        self.assertEqual(cache.get('aBoard', 'aDate'), entries)
+        # the board changed since its snapshot was made, or the snapshot
+        # was built with other settings
+        self.assertIsNone(cache.get('aBoard', 'anotherDate'))
+        # snapshots are shared between cache instances
+        other = BoardSnapshotCache(os.path.join(self.directory, 'cache'))
+        self.assertEqual(other.get('aBoard', 'aDate'), entries)
+        # no temporary file is left behind
+        self.assertEqual(
+            os.listdir(os.path.join(self.directory, 'cache')),
+            ['aBoard.json.gz']
+        )
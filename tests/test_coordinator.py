@@ -0,0 +1,278 @@
+import functools
+import logging
+import os
+import os.path as osp
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+
+from dpc_trello import coordinator
+from dpc_trello.coordinator import (
+    TaskQueue,
+    decode_task,
+    encode_task,
+    run_node,
+    submit_crawl,
+)
+from dpc_trello.runner import TaskError
+
+LOGGER = logging.getLogger(__name__)
+EPILOGUES = []
+# callables run by `hook_task`
+HOOKS = []
+
+
+def create_index(token_id):
+    return 'index-{}'.format(token_id)
+
+
+def get_token(token_id):
+    return 'token-{}'.format(token_id)
+
+
+def board_task(board_id, push_api, token, prev_result, config, logger):
+    if board_id == 'broken':
+        raise ValueError(board_id)
+    return dict(board_id=board_id, index=push_api, token=token)
+
+
+def hook_task(position, push_api, token, prev_result, config, logger):
+    HOOKS[position]()
+
+
+def epilogue(push_api, token, results, config, logger):
+    EPILOGUES.append((push_api, token, results))
+
+
+def broken_epilogue(push_api, token, results, config, logger):
+    raise ValueError('broken')
+
+
+def crawl_tasks(*board_ids):
+    return dict(
+        tasks=[[functools.partial(board_task, b)] for b in board_ids],
+        epilogue=epilogue,
+    )
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCoordinator(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.clock = FakeClock()
+        self.queue = TaskQueue(osp.join(directory, 'queue.db'),
+                               lease_duration=60, max_attempts=2,
+                               clock=self.clock)
+        patcher = mock.patch.object(
+            coordinator, 'TASK_MODULES',
+            coordinator.TASK_MODULES + (__name__,))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        del EPILOGUES[:]
+        del HOOKS[:]
+
+    def test_encode_task(self):
+        task = functools.partial(board_task, 'b1')
+        description = encode_task([task])
+        self.assertEqual(decode_task(description)[0].args, ('b1',))
+        task = functools.partial(epilogue, dict(me=dict(id='m1')),
+                                 board_ids=['b1'])
+        decoded = decode_task(encode_task(task))
+        self.assertEqual(decoded.args, (dict(me=dict(id='m1')),))
+        self.assertEqual(decoded.keywords, dict(board_ids=['b1']))
+        # only the functions of the task modules can be run
+        with self.assertRaises(ValueError):
+            encode_task(functools.partial(os.remove, 'aPath'))
+        with self.assertRaises(ValueError):
+            decode_task(dict(function=['os', 'remove']))
+        with self.assertRaises(ValueError):
+            encode_task(object())
+
+    def test_submit_crawl(self):
+        crawler = mock.Mock()
+        crawler.iter_crawl_tasks.return_value = crawl_tasks('b1', 'b2')
+        submit_crawl(self.queue, crawler, create_index, 't1', 'aToken', {},
+                     LOGGER)
+        index, token, config, _ = crawler.iter_crawl_tasks.call_args[0]
+        self.assertEqual((index, token), ('index-t1', 'aToken'))
+        self.assertFalse(config.full)
+        self.assertEqual(self.queue.status(), dict(
+            sequences=dict(pending=2),
+            accounts=dict(crawling=1),
+        ))
+        # an account is crawled once at a time
+        with self.assertRaises(ValueError):
+            self.queue.submit('t1', {}, crawl_tasks('b3'))
+        # tokens are not stored in the queue
+        with open(self.queue.path, 'rb') as istr:
+            self.assertNotIn(b'aToken', istr.read())
+
+    def test_node_local_state_dir(self):
+        crawler = mock.Mock()
+        crawler.iter_crawl_tasks.return_value = crawl_tasks('b1')
+        with self.assertRaises(ValueError):
+            submit_crawl(self.queue, crawler, create_index, 't1', 'aToken',
+                         dict(state_dir='/var/lib/dpc'), LOGGER)
+        self.assertFalse(crawler.iter_crawl_tasks.called)
+        submit_crawl(self.queue, crawler, create_index, 't1', 'aToken',
+                     dict(state_dir='/shared/dpc', state_dir_shared=True),
+                     LOGGER)
+
+    def test_max_leases(self):
+        self.queue.submit('big', {}, crawl_tasks('b1', 'b2', 'b3'),
+                          max_leases=2)
+        self.queue.submit('small', {}, crawl_tasks('b4'))
+        leases = [self.queue.lease('node-{}'.format(i)) for i in range(4)]
+        # accounts with the fewest leased sequences come first, within caps
+        self.assertEqual([l.token_id for l in leases[:3]],
+                         ['big', 'small', 'big'])
+        self.assertIsNone(leases[3])
+        self.assertEqual(leases[0].payload[0].args, ('b1',))
+        self.assertIsNone(self.queue.complete(leases[0], 'node-0', [
+            dict(task='board_task(b1)', result=dict(board_id='b1')),
+        ]))
+        self.assertEqual(self.queue.lease('node-0').payload[0].args,
+                         ('b3',))
+
+    def test_two_nodes(self):
+        self.queue.submit('t1', dict(scope=dict(closed_cards=True)),
+                          crawl_tasks('b1', 'broken'))
+        first = self.queue.lease('node-1')
+        second = self.queue.lease('node-2')
+        self.assertTrue(first.config.scope.closed_cards)
+        self.assertIsNone(self.queue.complete(first, 'node-1', [
+            dict(task='board_task(b1)', result=dict(board_id='b1')),
+        ]))
+        # the node completing the account's last sequence runs the
+        # epilogue, with the results of every sequence
+        lease = self.queue.complete(second, 'node-2', [
+            dict(task='board_task(broken)',
+                 error=TaskError('board_task(broken)', 'ValueError')),
+        ])
+        self.assertEqual(lease.kind, 'epilogue')
+        self.assertIsNone(self.queue.lease('node-1'))
+        func, results = lease.payload
+        self.assertIs(func, epilogue)
+        self.assertEqual(results[0], dict(board_id='b1'))
+        self.assertIsInstance(results[1], TaskError)
+        self.assertEqual(results[1].error, 'ValueError')
+        self.queue.complete(lease, 'node-2')
+        self.assertTrue(self.queue.drained())
+
+    def test_expired_lease(self):
+        self.queue.submit('t1', {}, crawl_tasks('b1'))
+        lease = self.queue.lease('node-1')
+        self.clock.now += 30
+        self.assertTrue(self.queue.heartbeat(lease, 'node-1'))
+        self.clock.now += 61
+        # node-1 stopped sending heartbeats
+        other = self.queue.lease('node-2')
+        self.assertEqual(other.id, lease.id)
+        self.assertFalse(self.queue.heartbeat(lease, 'node-1'))
+        self.assertIsNone(self.queue.complete(lease, 'node-1', []))
+        self.clock.now += 61
+        # too many attempts, the epilogue keeps the board's documents
+        lease = self.queue.lease('node-3')
+        self.assertEqual(lease.kind, 'epilogue')
+        self.assertIn('lease expired', lease.payload[1][0].error)
+        self.queue.complete(lease, 'node-3')
+        self.assertEqual(self.queue.status(), dict(
+            sequences=dict(failed=1),
+            accounts=dict(done=1),
+        ))
+        self.assertTrue(self.queue.drained())
+
+    def test_lost_lease(self):
+        self.queue.submit('t1', {}, dict(tasks=[[
+            functools.partial(hook_task, 0), functools.partial(hook_task, 1),
+        ]]))
+        leases = []
+
+        def steal():
+            self.clock.now += 61
+            leases.append(self.queue.lease('node-2'))
+            # wait for the heartbeat of node-1
+            time.sleep(0.2)
+        second = mock.Mock()
+        HOOKS.extend([steal, second])
+        lease = self.queue.lease('node-1')
+        with mock.patch.object(self.queue, 'complete') as complete:
+            self.assertIsNone(coordinator.run_lease(
+                self.queue, lease, create_index, get_token, 'node-1', LOGGER,
+                heartbeat=0.05))
+        # the remaining tasks are left to node-2
+        self.assertEqual(leases[0].id, lease.id)
+        self.assertFalse(second.called)
+        self.assertFalse(complete.called)
+
+    def test_failed_epilogue(self):
+        self.queue.submit('t1', {}, dict(tasks=[], epilogue=broken_epilogue))
+        # the epilogue is attempted `max_attempts` times
+        self.assertEqual(run_node(self.queue, create_index, get_token,
+                                  'node-1', LOGGER, heartbeat=10), 2)
+        self.assertEqual(self.queue.status(), dict(
+            sequences=dict(),
+            accounts=dict(failed=1),
+        ))
+        # failed accounts can be submitted again
+        self.queue.submit('t1', {}, crawl_tasks('b1'))
+
+    def test_unknown_token(self):
+        self.queue.submit('t1', {}, crawl_tasks('b1'))
+        self.queue.submit('revoked', {}, crawl_tasks('b2'))
+
+        def get_token_or_fail(token_id):
+            if token_id == 'revoked':
+                raise KeyError(token_id)
+            return get_token(token_id)
+        # the node keeps running the work of other accounts
+        self.assertEqual(run_node(self.queue, create_index,
+                                  get_token_or_fail, 'node-1', LOGGER,
+                                  heartbeat=10), 6)
+        self.assertEqual([e[1] for e in EPILOGUES], ['token-t1'])
+        self.assertEqual(self.queue.status(), dict(
+            sequences=dict(succeeded=1, failed=1),
+            accounts=dict(done=1, failed=1),
+        ))
+
+    def test_run_node(self):
+        self.queue.submit('t1', {}, crawl_tasks('b1', 'b2'), max_leases=1)
+        self.queue.submit('t2', {}, crawl_tasks('broken', 'b3'))
+        self.queue.submit('t3', {}, crawl_tasks())
+        self.assertEqual(run_node(self.queue, create_index, get_token,
+                                  'node-1', LOGGER, heartbeat=10), 7)
+        # epilogues fire once per account, even when a task failed
+        self.assertEqual(sorted((e[0], e[1]) for e in EPILOGUES), [
+            ('index-t1', 'token-t1'),
+            ('index-t2', 'token-t2'),
+            ('index-t3', 'token-t3'),
+        ])
+        results = [e[2] for e in EPILOGUES if e[1] == 'token-t1'][0]
+        self.assertEqual(results, [
+            dict(board_id='b1', index='index-t1', token='token-t1'),
+            dict(board_id='b2', index='index-t1', token='token-t1'),
+        ])
+        results = [e[2] for e in EPILOGUES if e[1] == 'token-t2'][0]
+        self.assertIsInstance(results[0], TaskError)
+        self.assertEqual(results[1]['board_id'], 'b3')
+        self.assertEqual(self.queue.status(), dict(
+            sequences=dict(succeeded=3, failed=1),
+            accounts=dict(done=3),
+        ))
+        # done accounts can be submitted again
+        self.queue.submit('t1', {}, crawl_tasks('b1'))
+        self.assertEqual(self.queue.status()['sequences'],
+                         dict(pending=1, succeeded=1, failed=1))
@@ -1,50 +1,88 @@
 
 from dpc_trello.crawler import (
+    BOARD_ACTIONS,
+    BOARD_ACTIONS_LIMIT,
     TrelloCrawler,
+    board_snapshot_key,
+    MemberTable,
     handle_board_members,
     handle_board_cards,
+    join_board,
     pick_preview,
+    get_board_state,
     get_last_gen,
-    set_last_gen,
-    remove_old_gen
+    set_board_state,
+    remove_old_gen,
+    checkpoint_board,
+    fingerprint_store,
+    get_checkpoint,
+    push_documents,
+    raw_snapshots,
+    record_task_stats,
+    token_key,
+    transform_board_cards,
 )
+from dpc_trello.cache import BoardSnapshotCache
+from dpc_trello.profiling import profile_task
+from dpc_trello.scope import cards_filter
 from dpc_trello.trello import TrelloClient as client
 from docido_sdk.core import ComponentManager
+from docido_sdk.toolbox.collections_ext import nameddict
 
+import base64
+import functools
+import json
+import os
+import os.path as osp
+import shutil
+import tempfile
 import unittest
 import mock
-import types
 import datetime
 
 
 class TestTrelloCrawler(unittest.TestCase):
 
     # mock trello client for this specific test case
+    @mock.patch.object(client, 'me')
     @mock.patch.object(client, 'list_boards')
-    def test_crawler_tasks_generation(self, list_boards):
+    def test_crawler_tasks_generation(self, list_boards, me):
         # We only use the id field in order to generate tasks
         list_boards.return_value = [{'id': 'test'}]
+        me.return_value = dict(id=42)
         logger = mock.Mock()
         token = mock.Mock()
         push_api = mock.Mock()
         crawler = TrelloCrawler(ComponentManager())
 
         # Full Crawl
-        tasks = crawler.iter_crawl_tasks(push_api, token, logger, full=True)
+        tasks = crawler.iter_crawl_tasks(push_api, token,
+                                         nameddict(full=True), logger)
         self.assertIn('tasks', tasks)
-        # A task to retrieve cards the other one members
-        self.assertEqual(2, len(tasks['tasks']))
+        self.assertNotIn('epilogue', tasks)
+        # One sequence per board: a task to retrieve cards the other one
+        # members
+        self.assertEqual(1, len(tasks['tasks']))
+        self.assertEqual(2, len(tasks['tasks'][0]))
 
         # Incremental Crawl
-        tasks_and_epilogue = crawler.iter_crawl_tasks(push_api, token, logger)
+        tasks_and_epilogue = crawler.iter_crawl_tasks(
+            push_api, token, nameddict(full=False), logger)
         self.assertIn('tasks', tasks_and_epilogue)
-        # A task to retrieve cards the other one members
-        self.assertEqual(2, len(tasks['tasks']))
+        self.assertEqual(1, len(tasks_and_epilogue['tasks']))
         self.assertIn('epilogue', tasks_and_epilogue)
         self.assertIsInstance(
             tasks_and_epilogue['epilogue'],
-            types.FunctionType
+            functools.partial
         )
+        self.assertEqual(tasks_and_epilogue['epilogue'].args, (['test'],))
+
+        # Profiled crawl
+        token.access_token = 'a_token'
+        tasks = crawler.iter_crawl_tasks(push_api, token, nameddict(
+            full=True, profiling=dict(boards=['test'], output_dir='/tmp')
+        ), logger)
+        self.assertEqual(tasks['tasks'][0][0].func, profile_task)
 
     def test_pick_preview(self):
         self.assertEqual(None, pick_preview([]))
@@ -77,40 +115,252 @@ class TestTrelloCrawler(unittest.TestCase):
     def test_get_last_gen(self):
         push_api = mock.Mock()
         # The get_kv method is the only one to get called
-        push_api.get_kv.return_value = 1
-        self.assertEqual(get_last_gen(push_api), 1)
-        push_api.get_kv.assert_called_once_with('last_gen')
+        push_api.get_kv.return_value = json.dumps(dict(gen=1))
+        self.assertEqual(get_last_gen(push_api, 'aBoard'), 1)
+        push_api.get_kv.assert_called_once_with('board:aBoard')
 
         push_api.reset_mock()
         push_api.get_kv.return_value = None
-        # If no last_gen is set then 0 should be returned
-        self.assertEqual(get_last_gen(push_api), 0)
-        push_api.get_kv.assert_called_once_with('last_gen')
+        # If no state is set then generation 0 should be returned
+        self.assertEqual(get_last_gen(push_api, 'aBoard'), 0)
+        self.assertEqual(get_board_state(push_api, 'aBoard')['cards'], [])
 
-    def test_set_last_gen(self):
+    def test_set_board_state(self):
         push_api = mock.Mock()
-        set_last_gen(push_api, 1)
-        push_api.set_kv.assert_called_once_with('last_gen', '1')
+        set_board_state(push_api, 'aBoard', dict(gen=1))
+        push_api.set_kv.assert_called_once_with('board:aBoard', '{"gen": 1}')
 
     def test_remove_old_gen(self):
         logger = mock.Mock()
         token = mock.Mock()
+        kv = {
+            'boards': json.dumps(['ok', 'failed', 'gone']),
+            'board:ok': json.dumps(dict(
+                gen=2, cards=['c1', 'c2', 'moved'], members=['m1', 'm2'])),
+            'board:failed': json.dumps(dict(
+                gen=5, cards=['c3'], members=['m2'])),
+            'board:gone': json.dumps(dict(
+                gen=1, cards=['c4'], members=['m1', 'm3'])),
+        }
         push_api = mock.Mock()
-        push_api.get_kv.return_value = 0
+        push_api.get_kv.side_effect = kv.get
+        push_api.set_kv.side_effect = kv.__setitem__
+        push_api.delete_kv.side_effect = lambda key: kv.pop(key, None)
+        results = [
+            dict(board_id='ok', cards=['c1', 'c5'], members=['m1']),
+            Exception('failed board'),
+            dict(board_id='new', cards=['moved'], members=[]),
+        ]
 
-        remove_old_gen(push_api, token, None, logger)
+        remove_old_gen(['ok', 'failed', 'new'], push_api, token, results,
+                       nameddict(), logger)
 
-        push_api.get_kv.assert_called_once_with('last_gen')
-        push_api.set_kv.assert_called_once_with('last_gen', '1')
+        # m2 is still recorded by a failed board, m1 is still a member of
+        # a succeeded one, "moved" card has been moved to a new board
+        push_api.delete_cards_by_id.assert_called_once_with(['c2', 'c4', 'm3'])
         push_api.delete_cards.assert_called_once_with({
+            'query': {
+                'term': {
+                    'private.board_id': 'gone'
+                }
+            }
+        })
+        self.assertNotIn('board:gone', kv)
+        push_api.delete_kv.assert_any_call('refresh:gone')
+        self.assertEqual(json.loads(kv['board:ok']), dict(
+            gen=3, cards=['c1', 'c5'], members=['m1']))
+        self.assertEqual(json.loads(kv['board:failed'])['gen'], 5)
+        self.assertEqual(json.loads(kv['board:new'])['gen'], 1)
+        self.assertEqual(json.loads(kv['boards']), ['failed', 'new', 'ok'])
+
+    def test_remove_old_gen_contents(self):
+        kv = {
+            'boards': json.dumps(['b1']),
+            'board:b1': json.dumps(dict(gen=1, cards=['c1', 'c2'])),
+            'contents:c2': json.dumps(['a-3']),
+            'content:a-3': '1',
+        }
+        push_api = mock.Mock()
+        push_api.get_kv.side_effect = kv.get
+        push_api.set_kv.side_effect = kv.__setitem__
+        push_api.delete_kv.side_effect = lambda key: kv.pop(key, None)
+        remove_old_gen(['b1'], push_api, mock.Mock(),
+                       [dict(board_id='b1', cards=['c1'], members=[])],
+                       nameddict(attachments=dict(cache_dir='aDir')),
+                       mock.Mock())
+        push_api.delete_cards_by_id.assert_called_once_with(['c2'])
+        # contents are deleted along with their card
+        push_api.delete_thumbnails_by_id.assert_called_once_with(['a-3'])
+        self.assertNotIn('contents:c2', kv)
+        self.assertNotIn('content:a-3', kv)
+
+    def test_remove_old_gen_legacy_gen(self):
+        logger = mock.Mock()
+        token = mock.Mock()
+        kv = {'last_gen': '7'}
+        push_api = mock.Mock()
+        push_api.get_kv.side_effect = kv.get
+        push_api.set_kv.side_effect = kv.__setitem__
+        push_api.delete_kv.side_effect = lambda key: kv.pop(key, None)
+        # boards pushed after the account wide generation
+        self.assertEqual(get_last_gen(push_api, 'b1'), 7)
+        results = [dict(board_id='b1', cards=['c1'], members=[])]
+        remove_old_gen(['b1', 'b2'], push_api, token,
+                       results + [Exception('failed board')], nameddict(),
+                       logger)
+        self.assertFalse(push_api.delete_cards.called)
+        self.assertEqual(kv['last_gen'], '7')
+        self.assertEqual(get_last_gen(push_api, 'b1'), 8)
+        # documents stale before migration are deleted once every board
+        # succeeded
+        remove_old_gen(['b1'], push_api, token, results, nameddict(), logger)
+        push_api.delete_cards.assert_any_call({
             'query': {
                 'range': {
-                    'private.twitter_id': {
-                        'lt': 0
+                    'private.sync_id': {
+                        'lt': 7
                     }
                 }
             }
         })
+        self.assertNotIn('last_gen', kv)
+        self.assertEqual(get_last_gen(push_api, 'new'), 0)
+
+    def test_remove_old_gen_indexed(self):
+        logger = mock.Mock()
+        token = mock.Mock(access_token='aToken')
+        kv = {}
+        push_api = mock.Mock()
+        push_api.get_kv.side_effect = kv.get
+        push_api.set_kv.side_effect = kv.__setitem__
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        config = nameddict(state_dir=state_dir)
+        c1, c2, c3 = ['{:024x}'.format(n) for n in range(1, 4)]
+
+        def crawl(cards_by_board):
+            push_api.reset_mock()
+            results = []
+            for board_id, cards in sorted(cards_by_board.items()):
+                state = get_board_state(push_api, board_id)
+                push_documents(push_api, token, board_id, 'cards', cards,
+                               state, state['gen'] + 1, config, logger)
+                push_documents(push_api, token, board_id, 'members', [],
+                               state, state['gen'] + 1, config, logger)
+                results.append(dict(board_id=board_id))
+            remove_old_gen(sorted(cards_by_board), push_api, token, results,
+                           config, logger)
+
+        crawl(dict(b1=[dict(id=c1, title='1'), dict(id=c2, title='2')],
+                   b2=[dict(id=c3, title='3'), dict(id='notHex')]))
+        self.assertEqual(len(push_api.push_cards.mock_calls), 2)
+        self.assertFalse(push_api.delete_cards_by_id.called)
+        # only a pointer to the index is stored in kv
+        self.assertEqual(json.loads(kv['board:b1']), dict(gen=1, index=1))
+
+        # c3 is moved to b1, c2 is removed
+        crawl(dict(b1=[dict(id=c1, title='1'), dict(id=c3, title='3')],
+                   b2=[]))
+        # unchanged cards are not pushed again
+        push_api.push_cards.assert_called_once_with(
+            [dict(id=c3, title='3')])
+        push_api.delete_cards_by_id.assert_called_once_with([c2, 'notHex'])
+        self.assertEqual(sorted(os.listdir(
+            osp.join(state_dir, token_key(token)))), [
+            'b1-cards-2.idx', 'b1-members-2.idx',
+            'b2-cards-2.idx', 'b2-members-2.idx',
+        ])
+
+        # c1 is moved to a failed board whose state predates indexes
+        kv['board:legacy'] = json.dumps(dict(gen=4, cards=[c1]))
+        push_api.reset_mock()
+        state = get_board_state(push_api, 'b1')
+        push_documents(push_api, token, 'b1', 'cards',
+                       [dict(id=c3, title='3')], state, 3, config, logger)
+        push_documents(push_api, token, 'b1', 'members', [], state, 3,
+                       config, logger)
+        remove_old_gen(['b1', 'b2', 'legacy'], push_api, token,
+                       [dict(board_id='b1')], config, logger)
+        self.assertFalse(push_api.delete_cards_by_id.called)
+        self.assertEqual(json.loads(kv['board:legacy'])['cards'], [c1])
+
+    def test_push_documents_full(self):
+        logger = mock.Mock()
+        token = mock.Mock(access_token='aToken')
+        push_api = mock.Mock()
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        card = dict(id='{:024x}'.format(1), title='1')
+        config = nameddict(state_dir=state_dir, full=False)
+        push_documents(push_api, token, 'b1', 'cards', [card], dict(gen=0),
+                       1, config, logger)
+        push_api.reset_mock()
+        push_documents(push_api, token, 'b1', 'cards', [card],
+                       dict(gen=1, index=1), 2, config, logger)
+        self.assertFalse(push_api.push_cards.called)
+        # a full crawl pushes the whole account, and still writes the index
+        config.full = True
+        push_documents(push_api, token, 'b1', 'cards', [card],
+                       dict(gen=2, index=2), 3, config, logger)
+        push_api.push_cards.assert_called_once_with([card])
+        store = fingerprint_store(token, config)
+        self.assertIn(card['id'], store.open('b1', 'cards', 3))
+
+    def test_remove_old_gen_index_on_other_node(self):
+        logger = mock.Mock()
+        token = mock.Mock(access_token='aToken')
+        kv = {}
+        push_api = mock.Mock()
+        push_api.get_kv.side_effect = kv.get
+        push_api.set_kv.side_effect = kv.__setitem__
+        nodes = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        for directory in nodes:
+            self.addCleanup(shutil.rmtree, directory)
+        card = dict(id='{:024x}'.format(1), title='1')
+        # the board was crawled by the first node
+        config = nameddict(state_dir=nodes[0])
+        for kind, docs in [('cards', [card]), ('members', [])]:
+            push_documents(push_api, token, 'b1', kind, docs,
+                           get_board_state(push_api, 'b1'), 1, config,
+                           logger)
+        remove_old_gen(['b1'], push_api, token, [dict(board_id='b1')],
+                       config, logger)
+        self.assertEqual(json.loads(kv['board:b1']), dict(gen=1, index=1))
+        for kind, docs in [('cards', [card]), ('members', [])]:
+            push_documents(push_api, token, 'b1', kind, docs,
+                           get_board_state(push_api, 'b1'), 2, config,
+                           logger)
+        # and its epilogue by the second one
+        remove_old_gen(['b1'], push_api, token, [dict(board_id='b1')],
+                       nameddict(state_dir=nodes[1]), logger)
+        self.assertFalse(push_api.delete_cards_by_id.called)
+        self.assertEqual(json.loads(kv['board:b1']), dict(gen=1, index=1))
+
+    def test_remove_old_gen_indexed_accounts(self):
+        logger = mock.Mock()
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        config = nameddict(state_dir=state_dir)
+        card = dict(id='{:024x}'.format(1), title='1')
+        accounts = []
+        for name in ['A', 'B']:
+            kv = {}
+            push_api = mock.Mock()
+            push_api.get_kv.side_effect = kv.get
+            push_api.set_kv.side_effect = kv.__setitem__
+            accounts.append((mock.Mock(access_token=name), push_api, kv))
+        # both accounts crawl the same board before any epilogue runs
+        for token, push_api, _ in accounts:
+            for kind, docs in [('cards', [card]), ('members', [])]:
+                push_documents(push_api, token, 'b1', kind, docs,
+                               get_board_state(push_api, 'b1'), 1, config,
+                               logger)
+        for token, push_api, kv in accounts:
+            remove_old_gen(['b1'], push_api, token, [dict(board_id='b1')],
+                           config, logger)
+            self.assertEqual(json.loads(kv['board:b1']),
+                             dict(gen=1, index=1))
+            self.assertFalse(logger.warning.called)
 
     @mock.patch.object(client, 'list_board_members')
     def test_crawler_fetch_board_members(self, list_board_members):
@@ -127,13 +377,15 @@ class TestTrelloCrawler(unittest.TestCase):
         logger = mock.Mock()
         token = mock.Mock()
         push_api = mock.Mock()
-        push_api.get_kv.return_value = 0
+        push_api.get_kv.return_value = None
         list_board_members.return_value = mocked_members
 
-        handle_board_members('aBoard', push_api, token, None, logger)
-        list_board_members.assert_called_once_with(
-            'aBoard', params={'fields': 'all'}
-        )
+        result = handle_board_members('aBoard', push_api, token,
+                                      dict(board_id='aBoard', cards=['c1']),
+                                      nameddict(), logger)
+        list_board_members.assert_called_once_with('aBoard', fields='all')
+        self.assertEqual(result, dict(
+            board_id='aBoard', cards=['c1'], members=['aMemberId']))
 
         calls = push_api.push_cards.mock_calls
         self.assertEqual(len(calls), 1)
@@ -147,76 +399,132 @@ class TestTrelloCrawler(unittest.TestCase):
         # last_gen + 1
         self.assertEqual(first_card['private']['sync_id'], 1)
 
-    @mock.patch.object(client, 'list_board_cards')
-    def test_crawler_fetch_board_cards(self, list_cards):
+    @mock.patch.object(client, 'get_member')
+    @mock.patch.object(client, 'list_card_actions')
+    @mock.patch.object(client, 'list_board_actions')
+    @mock.patch.object(client, 'get_board')
+    def test_crawler_fetch_board_cards(self, get_board, list_actions,
+                                       list_card_actions, get_member):
         date = str(datetime.datetime.now())
 
         logger = mock.Mock()
         token = mock.Mock()
         push_api = mock.Mock()
-        mocked_cards = [
+        member = {
+            'id': 'aMemberId',
+            'fullName': 'aFullName',
+            'username': 'aUserName',
+            'avatarHash': 'hsah'
+        }
+        creator = {
+            'id': 42,
+            'fullName': 'aCreator',
+            'username': 'aCreatorName',
+            'avatarHash': None
+        }
+        create_action = {
+            'id': 'anAction',
+            'type': 'createCard',
+            'date': date,
+            'idMemberCreator': 42,
+            'data': {'card': {'id': '1234'}},
+        }
+        comment_actions = [
             {
-                'shortUrl': 'aShortUrl',
-                'email': 'anEmail',
-                'id': '1234',
-                'name': 'aName',
-                'desc': 'aDesc',
-                'dateLastActivity': date,
-                'subscribed': True,
-                'actions': [
-                    {
-                        'date': date,
-                        'memberCreator': {
-                            'fullName': 'aFullName',
-                            'username': 'aUserName',
-                            'avatarHash': 'hsah'
-                        }
-                    }
-                ],
-                'fullName': 'aFullName',
-                'username': 'aUsername',
-                'labels': [{'name': 'foo'}, {'name': 'bar'}],
-                'attachments': [
-                    {
-                        'id': 'anId',
-                        'bytes': '\x13',
-                        'name': 'aName',
-                        'title': 'aTitle',
-                        'url': 'anUrl',
-                        'date': date,
-                        'size': 1345,
-                        'previews': []
-                    }
-                ],
-                'members': [
-                    {
-                        'fullName': 'aFullName',
-                        'username': 'aUserName',
-                        'avatarHash': 'hsah'
-                    }
-                ],
-            },
-            # This card should be skipped and thus do not requires to be
-            # complete
-            {'actions': []}
+                'id': 'aComment',
+                'type': 'commentCard',
+                'date': date,
+                'idMemberCreator': idMemberCreator,
+                'data': {'card': {'id': '1234'}, 'text': 'aText'},
+            }
+            for idMemberCreator in ['aMemberId', 'aFormerMember', 42]
         ]
+        mocked_board = {
+            'id': 'test_boards',
+            'lists': [{'id': 'aList', 'name': 'aListName'}],
+            'labels': [
+                {'id': 'l1', 'name': 'foo'},
+                {'id': 'l2', 'name': 'bar'},
+            ],
+            'members': [member, creator],
+            'checklists': [
+                {
+                    'idCard': '1234',
+                    'name': 'aChecklist',
+                    'checkItems': [{'state': 'complete', 'name': 'anItem'}],
+                },
+            ],
+            'cards': [
+                {
+                    'shortUrl': 'aShortUrl',
+                    'id': '1234',
+                    'idList': 'aList',
+                    'idLabels': ['l1', 'l2'],
+                    'idMembers': ['aMemberId'],
+                    'name': 'aName',
+                    'desc': 'aDesc',
+                    'dateLastActivity': date,
+                    'subscribed': True,
+                    'attachments': [
+                        {
+                            'id': 'anId',
+                            'bytes': 1345,
+                            'name': 'aName.pdf',
+                            'url': 'anUrl',
+                            'date': date,
+                            'previews': []
+                        }
+                    ],
+                },
+                # moved from another board, its creation event is not part
+                # of the board's actions
+                {'id': '5678', 'idList': 'aList', 'name': 'aMovedCard',
+                 'desc': '', 'dateLastActivity': date},
+                # its creation event cannot be found anymore
+                {'id': '9012', 'idList': 'aList', 'name': 'aCopiedCard',
+                 'desc': '', 'dateLastActivity': date},
+            ],
+            # a full first page of actions
+            'actions': comment_actions + [create_action] * (
+                BOARD_ACTIONS_LIMIT - len(comment_actions)),
+        }
 
-        push_api.get_kv.return_value = 0
-        list_cards.return_value = mocked_cards
-        def me(instance):
-            return dict(id=42)
-        client.me = me
-
+        push_api.get_kv.return_value = None
+        get_board.return_value = mocked_board
+        list_actions.return_value = [dict(create_action, id='older')]
+        list_card_actions.side_effect = lambda card_id, **kwargs: [
+            dict(create_action, id='moved', idMemberCreator='aFormerMember',
+                 data={'card': {'id': card_id}})
+        ] if card_id == '5678' else []
+        get_member.return_value = {
+            'id': 'aFormerMember',
+            'fullName': 'aFormerMemberName',
+            'username': 'aFormerMemberUserName',
+        }
 
-        handle_board_cards(me, 'test_boards', push_api, token, None, logger)
+        result = handle_board_cards(dict(id=42), 'test_boards', push_api,
+                                    token, None, nameddict(), logger)
 
-        list_cards.assert_called_once_with('test_boards', params={
-            'attachment_fields': 'all',
-            'members': 'true',
-            'attachments': 'true',
-            'actions': 'createCard,copyCard,convertToCardFromCheckItem',
-            'member_fields': 'all'
-        })
+        self.assertEqual(get_board.call_count, 1)
+        self.assertEqual(get_board.call_args[0], ('test_boards',))
+        # remaining pages of actions are fetched
+        list_actions.assert_called_once_with(
+            'test_boards',
+            filter=BOARD_ACTIONS,
+            limit=BOARD_ACTIONS_LIMIT,
+            before='anAction',
+            fields='data,date,idMemberCreator,type',
+            member='false',
+            memberCreator='false'
+        )
+        # creation events of cards moved from other boards are fetched
+        self.assertEqual(
+            [c[0] for c in list_card_actions.call_args_list],
+            [('5678',), ('9012',)])
+        self.assertEqual(list_card_actions.call_args[1]['filter'],
+                         'createCard')
+        self.assertEqual(result, dict(board_id='test_boards',
+                                      cards=['1234', '5678', '9012']))
         calls = push_api.push_cards.mock_calls
         self.assertEqual(len(calls), 1)
         # call[0] is the first and unique call, it is a tuple of the form:
@@ -224,9 +532,424 @@ class TestTrelloCrawler(unittest.TestCase):
         # we'll introspect the first and only argument supplied to push_cards
         # in order to do that we then retrieve calls[0][1][0]
         call_arg = calls[0][1][0]
-        first_card = call_arg[0]
+        self.assertEqual(len(call_arg), 3)
+        first_card, moved_card, copied_card = call_arg
+        self.assertEqual(moved_card['author']['username'],
+                         'aFormerMemberUserName')
+        self.assertEqual(copied_card['author'], MemberTable.UNKNOWN_AUTHOR)
+        self.assertEqual(copied_card['created_at'], copied_card['date'])
+        self.assertEqual(first_card['author']['name'], 'aCreator')
+        # authors are built once per member
+        comments = first_card['comments']
+        self.assertIs(first_card['author'], comments[0]['author'])
+        self.assertIs(first_card['to'][0], comments[2]['author'])
+        # former members of the board are fetched once
+        get_member.assert_called_once_with(
+            'aFormerMember', fields='fullName,username,avatarHash')
+        self.assertEqual(comments[1]['author']['username'],
+                         'aFormerMemberUserName')
+        # link + file + 2 tags
         self.assertEqual(len(first_card['attachments']), 4)
-        self.assertEqual(len(first_card['to']), 1)
+        self.assertEqual(first_card['to'][0]['username'], 'aUserName')
         self.assertEqual(first_card['labels'], ['foo', 'bar'])
+        self.assertEqual(first_card['group_name'], 'aListName')
+        self.assertIn('* [x] anItem', first_card['description'])
         # last_gen + 1
-        self.assertEqual(first_card['private']['sync_id'], 1)
+        self.assertEqual(first_card['private'], dict(
+            sync_id=1, board_id='test_boards', twitter_id=1))
+
+    @mock.patch.object(client, 'get_board')
+    @mock.patch.object(client, 'list_board_cards')
+    def test_crawler_fetch_cached_board_cards(self, list_cards, get_board):
+        logger = mock.Mock()
+        token = mock.Mock()
+        push_api = mock.Mock()
+        push_api.get_kv.return_value = None
+        list_cards.return_value = [{'id': '1234', 'subscribed': True}]
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        snapshot_key = board_snapshot_key('aDate', {})
+        BoardSnapshotCache(cache_dir).put('aBoard', snapshot_key, [
+            dict(card=dict(id='1234', title='aName'),
+                 creator='someone', members=[42]),
+        ])
+        config = nameddict(board_cache_dir=cache_dir)
+
+        result = handle_board_cards(dict(id=42), 'aBoard', push_api, token,
+                                    None, config, logger,
+                                    last_activity='aDate')
+
+        # only user specific fields are fetched
+        list_cards.assert_called_once_with('aBoard', fields='subscribed',
+                                           filter=cards_filter({}))
+        self.assertFalse(get_board.called)
+        self.assertEqual(result, dict(board_id='aBoard', cards=['1234']))
+        first_card = push_api.push_cards.mock_calls[0][1][0][0]
+        self.assertEqual(first_card['title'], 'aName')
+        self.assertTrue(first_card['favorited'])
+        self.assertEqual(first_card['private'], dict(
+            sync_id=1, board_id='aBoard', twitter_id=0))
+
+    @mock.patch.object(client, 'get_board')
+    def test_crawler_cached_board_raw_snapshot(self, get_board):
+        logger = mock.Mock()
+        token = mock.Mock()
+        token.access_token = 'a_token'
+        push_api = mock.Mock()
+        push_api.get_kv.return_value = None
+        get_board.return_value = dict(lists=[], cards=[], members=[])
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        config = nameddict(board_cache_dir=cache_dir + '/boards',
+                           raw_snapshot_dir=cache_dir + '/raw')
+        BoardSnapshotCache(config.board_cache_dir).put(
+            'aBoard', board_snapshot_key('aDate', {}), [])
+
+        handle_board_cards(dict(id=42), 'aBoard', push_api, token, None,
+                           config, logger, last_activity='aDate')
+
+        # the board is fetched for its raw responses to be persisted
+        self.assertTrue(get_board.called)
+        self.assertIsNotNone(
+            raw_snapshots(token, config).load_board('aBoard', 'cards'))
+
+    def test_transform_embed_policy(self):
+        date = '2016-01-01T00:00:00.000Z'
+        board = dict(
+            lists=[dict(id='aList', name='aListName')],
+            cards=[dict(id='c1', idList='aList', name='aName',
+                        desc='plain text', shortUrl='aShortUrl',
+                        dateLastActivity=date, attachments=[])],
+            actions=[
+                dict(type='createCard', date=date, idMemberCreator='m',
+                     data=dict(card=dict(id='c1'))),
+                dict(type='commentCard', date=date, idMemberCreator='m',
+                     data=dict(card=dict(id='c1'), text='**bold**')),
+            ],
+        )
+        _, cards = join_board(board, release=True)
+        # joined arrays are not referenced anymore
+        self.assertEqual(list(board), ['lists'])
+        with mock.patch('markdown.markdown') as markdown:
+            markdown.return_value = '<p>html</p>'
+            card = transform_board_cards(
+                dict(aList='aListName'), cards, MemberTable([]), 'lazy'
+            )[0]['card']
+        # plain texts are not rendered
+        markdown.assert_called_once_with(
+            '**bold**', extensions=['markdown_checklist.extension'])
+        self.assertIsNone(card['embed'])
+        self.assertEqual(card['comments'][0]['embed'], '<p>html</p>')
+
+    @mock.patch.object(client, 'download')
+    @mock.patch.object(client, 'list_board_cards')
+    def test_crawler_fetch_attachments(self, list_cards, download):
+        logger = mock.Mock()
+        token = mock.Mock()
+        push_api = mock.Mock()
+        push_api.get_kv.return_value = None
+        push_api.push_thumbnails.return_value = []
+        list_cards.return_value = [{'id': '1234'}]
+        download.return_value.iter_content.return_value = ['abc']
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        url = 'https://trello.com/1/cards/1234/attachments/a/download/f.txt'
+        snapshot_key = board_snapshot_key('aDate', {})
+        BoardSnapshotCache(cache_dir).put('aBoard', snapshot_key, [
+            dict(card=dict(id='1234', attachments=[
+                dict(type=u'file', origin_id='a', url=url, size=3),
+                dict(type=u'file', origin_id='b', size=3,
+                     url='https://example.com/f.txt'),
+            ]), creator='someone', members=[]),
+        ])
+        config = nameddict(
+            board_cache_dir=cache_dir,
+            attachments=dict(cache_dir=cache_dir + '/attachments'),
+        )
+
+        handle_board_cards(dict(id=42), 'aBoard', push_api, token, None,
+                           config, logger, last_activity='aDate')
+
+        # only trello hosted files are downloaded
+        download.assert_called_once_with(url)
+        attachments = push_api.push_cards.mock_calls[0][1][0][0][
+            'attachments']
+        self.assertEqual(attachments[0]['_content_id'], 'a-3')
+        push_api.push_thumbnails.assert_called_once_with([
+            ('a-3', base64.b64encode(b'abc'), 'application/octet-stream'),
+        ])
+        push_api.set_kv.assert_any_call('content:a-3', '1')
+        self.assertNotIn('_content_id', attachments[1])
+
+    @mock.patch.object(client, 'list_board_cards')
+    def test_crawler_compact_output(self, list_cards):
+        logger = mock.Mock()
+        token = mock.Mock()
+        push_api = mock.Mock()
+        push_api.get_kv.return_value = None
+        list_cards.return_value = [{'id': '1234'}]
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        snapshot_key = board_snapshot_key('aDate', {}, 'lazy')
+        BoardSnapshotCache(cache_dir).put('aBoard', snapshot_key, [
+            dict(card=dict(id='1234', description='text',
+                           embed='<p>text</p>', labels=['foo'],
+                           attachments=[dict(type='tag', name='foo')]),
+                 creator='someone', members=[]),
+        ])
+        config = nameddict(
+            board_cache_dir=cache_dir,
+            output=dict(embed='lazy', dedup_tags=True),
+        )
+
+        handle_board_cards(dict(id=42), 'aBoard', push_api, token, None,
+                           config, logger, last_activity='aDate')
+
+        first_card = push_api.push_cards.mock_calls[0][1][0][0]
+        self.assertNotIn('embed', first_card)
+        self.assertEqual(first_card['attachments'], [])
+        self.assertTrue(any(
+            'payload of board aBoard' in c[1][0]
+            for c in logger.debug.mock_calls
+        ))
+        # sizes are only computed for debugging
+        logger = mock.Mock()
+        logger.isEnabledFor.return_value = False
+        handle_board_cards(dict(id=42), 'aBoard', push_api, token, None,
+                           config, logger, last_activity='aDate')
+        self.assertFalse(logger.debug.called)
+
+    @mock.patch.object(client, 'get_board')
+    @mock.patch.object(client, 'list_boards')
+    @mock.patch.object(client, 'me')
+    def test_crawler_reprocess(self, me, list_boards, get_board):
+        date = str(datetime.datetime.now())
+        logger = mock.Mock()
+        token = mock.Mock()
+        token.access_token = 'a_token'
+        push_api = mock.Mock()
+        push_api.get_kv.return_value = None
+        me.return_value = dict(id=42)
+        list_boards.return_value = [{'id': 'aBoard'}]
+        get_board.return_value = {
+            'lists': [{'id': 'aList', 'name': 'aListName'}],
+            'cards': [{
+                'id': '1234', 'idList': 'aList', 'name': 'aName', 'desc': '',
+                'shortUrl': 'aShortUrl', 'dateLastActivity': date,
+                'subscribed': False, 'attachments': [],
+            }],
+            'members': [{'id': 42, 'fullName': 'aFullName',
+                         'username': 'aUserName'}],
+            'actions': [{
+                'type': 'createCard', 'date': date, 'idMemberCreator': 42,
+                'data': {'card': {'id': '1234'}},
+            }],
+        }
+        snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, snapshot_dir)
+        crawler = TrelloCrawler(ComponentManager())
+
+        # record raw responses
+        config = nameddict(full=False, raw_snapshot_dir=snapshot_dir)
+        crawler.iter_crawl_tasks(push_api, token, config, logger)
+        handle_board_cards(dict(id=42), 'aBoard', push_api, token, None,
+                           config, logger)
+
+        # reprocess them, trello is not queried anymore
+        for mocked in [me, list_boards, get_board]:
+            mocked.reset_mock()
+        push_api.reset_mock()
+        config = nameddict(full=False, raw_snapshot_dir=snapshot_dir,
+                           reprocess=True)
+        tasks = crawler.iter_crawl_tasks(push_api, token, config, logger)
+        self.assertEqual(tasks['epilogue'].args, (['aBoard'],))
+        result = handle_board_cards(dict(id=42), 'aBoard', push_api, token,
+                                    None, config, logger)
+        self.assertEqual(result, dict(board_id='aBoard', cards=['1234']))
+        for mocked in [me, list_boards, get_board]:
+            self.assertFalse(mocked.called)
+        first_card = push_api.push_cards.mock_calls[0][1][0][0]
+        self.assertEqual(first_card['group_name'], 'aListName')
+
+    @mock.patch.object(client, 'me')
+    @mock.patch.object(client, 'list_boards')
+    def test_crawler_resume_run(self, list_boards, me):
+        list_boards.return_value = [{'id': 'done'}, {'id': 'todo'}]
+        me.return_value = dict(id=42)
+        logger = mock.Mock()
+        token = mock.Mock()
+        kv = {}
+        push_api = mock.Mock()
+        push_api.get_kv.side_effect = kv.get
+        push_api.set_kv.side_effect = kv.__setitem__
+        push_api.delete_kv.side_effect = lambda key: kv.pop(key, None)
+        config = nameddict(full=False, run_id='aRun')
+        crawler = TrelloCrawler(ComponentManager())
+
+        # the first attempt of the run completed a board, and failed on
+        # the other one
+        checkpoint_board('done', push_api, token,
+                         dict(board_id='done', cards=['c1'], members=[]),
+                         config, logger)
+        checkpoint_board('todo', push_api, token, Exception('failed'),
+                         config, logger)
+        self.assertEqual(
+            json.loads(kv['checkpoint:aRun:done']),
+            dict(board_id='done', cards=['c1'], members=[], gen=1)
+        )
+        self.assertNotIn('checkpoint:aRun:todo', kv)
+
+        # the second attempt only crawls the failed board
+        tasks = crawler.iter_crawl_tasks(push_api, token, config, logger)
+        self.assertEqual(len(tasks['tasks']), 1)
+        self.assertEqual(tasks['tasks'][0][0].args[1], 'todo')
+        self.assertEqual(tasks['tasks'][0][-1].func, checkpoint_board)
+        self.assertEqual(tasks['epilogue'].args, (['done', 'todo'],))
+
+        tasks['epilogue'](push_api, token,
+                          [dict(board_id='todo', cards=[], members=[])],
+                          config, logger)
+        # both boards are considered succeeded
+        self.assertEqual(json.loads(kv['board:done'])['cards'], ['c1'])
+        self.assertEqual(json.loads(kv['board:todo'])['gen'], 1)
+        # checkpoints of the run are cleared
+        self.assertNotIn('checkpoint:aRun:done', kv)
+        # a new run of the same id would not skip the board anymore
+        self.assertIsNone(get_checkpoint(push_api, 'aRun', 'done'))
+
+    @mock.patch.object(client, 'me')
+    @mock.patch.object(client, 'list_boards')
+    def test_crawler_adaptive_refresh(self, list_boards, me):
+        now = datetime.datetime.utcnow()
+        list_boards.return_value = [
+            {'id': 'hot', 'dateLastActivity': now.isoformat()},
+            {'id': 'cold', 'dateLastActivity': '2010-01-01T00:00:00.000Z'},
+        ]
+        me.return_value = dict(id=42)
+        logger = mock.Mock()
+        token = mock.Mock()
+        kv = {
+            'board:cold': json.dumps(dict(gen=3, cards=['c1'], members=[])),
+        }
+        push_api = mock.Mock()
+        push_api.get_kv.side_effect = kv.get
+        push_api.set_kv.side_effect = kv.__setitem__
+        config = nameddict(full=False, refresh=dict(cold_every=2))
+        crawler = TrelloCrawler(ComponentManager())
+
+        # boards are crawled on their first run
+        tasks = crawler.iter_crawl_tasks(push_api, token, config, logger)
+        self.assertEqual(len(tasks['tasks']), 2)
+        # the cold board failed, it stays due
+        tasks['epilogue'](push_api, token,
+                          [dict(board_id='hot', cards=[], members=[]),
+                           Exception('failed')],
+                          config, logger)
+        tasks = crawler.iter_crawl_tasks(push_api, token, config, logger)
+        self.assertEqual(len(tasks['tasks']), 2)
+        tasks['epilogue'](push_api, token,
+                          [dict(board_id='hot', cards=[], members=[]),
+                           dict(board_id='cold', cards=['c1'], members=[])],
+                          config, logger)
+
+        # the cold one is then skipped every other run
+        tasks = crawler.iter_crawl_tasks(push_api, token, config, logger)
+        self.assertEqual([seq[0].args[1] for seq in tasks['tasks']], ['hot'])
+        self.assertEqual(tasks['epilogue'].keywords, dict(skipped=['cold']))
+        tasks['epilogue'](push_api, token,
+                          [dict(board_id='hot', cards=[], members=[])],
+                          config, logger)
+        # documents of skipped boards are kept
+        self.assertFalse(push_api.delete_cards_by_id.called)
+        self.assertEqual(json.loads(kv['board:cold'])['gen'], 4)
+        tasks = crawler.iter_crawl_tasks(push_api, token, config, logger)
+        self.assertEqual(len(tasks['tasks']), 2)
+
+        # full crawls ignore refresh settings
+        config.full = True
+        tasks = crawler.iter_crawl_tasks(push_api, token, config, logger)
+        self.assertEqual(len(tasks['tasks']), 2)
+
+    @mock.patch.object(client, 'me')
+    @mock.patch.object(client, 'list_boards')
+    def test_crawler_budget(self, list_boards, me):
+        list_boards.return_value = [
+            {'id': 'big', 'dateLastActivity': '2016-01-02T00:00:00.000Z'},
+            {'id': 'small', 'dateLastActivity': '2016-01-01T00:00:00.000Z'},
+        ]
+        me.return_value = dict(id=42)
+        logger = mock.Mock()
+        token = mock.Mock()
+        kv = {}
+        push_api = mock.Mock()
+        push_api.get_kv.side_effect = kv.get
+        push_api.set_kv.side_effect = kv.__setitem__
+        trello = mock.Mock(requests=10, received_bytes=1000)
+        record_task_stats(push_api, 'big', 'cards', trello, 0)
+        trello = mock.Mock(requests=1, received_bytes=10)
+        record_task_stats(push_api, 'small', 'cards', trello, 0)
+        # runs using a shared snapshot do not reflect the board's cost
+        trello = mock.Mock(requests=1, received_bytes=10)
+        record_task_stats(push_api, 'big', 'cards', trello, 0, cached=True)
+        self.assertEqual(json.loads(kv['stats:big'])['cards']['requests'],
+                         10)
+        config = nameddict(full=False, budget=dict(requests=5))
+        crawler = TrelloCrawler(ComponentManager())
+
+        # the most recently active board fits in the budget
+        tasks = crawler.iter_crawl_tasks(push_api, token, config, logger)
+        self.assertEqual([seq[0].args[1] for seq in tasks['tasks']], ['big'])
+        self.assertEqual(tasks['plan']['planned']['requests'], 10)
+        self.assertEqual(tasks['epilogue'].keywords, dict(skipped=['small']))
+
+        # the deferred board comes first on the next run
+        tasks = crawler.iter_crawl_tasks(push_api, token, config, logger)
+        self.assertEqual([seq[0].args[1] for seq in tasks['tasks']],
+                         ['small'])
+        self.assertEqual(json.loads(kv['stats:big'])['deferred'], 1)
+        self.assertEqual(json.loads(kv['stats:small'])['deferred'], 0)
+
+    @mock.patch.object(client, 'list_list_cards')
+    @mock.patch.object(client, 'get_board')
+    @mock.patch.object(client, 'list_boards')
+    @mock.patch.object(client, 'me')
+    def test_crawler_scope(self, me, list_boards, get_board, list_cards):
+        me.return_value = dict(id=42)
+        list_boards.return_value = [
+            {'id': 'b1', 'name': 'Roadmap', 'idOrganization': 'anOrg'},
+            {'id': 'b2', 'name': 'Personal'},
+            {'id': 'b3', 'name': 'Old roadmap', 'idOrganization': 'anOrg'},
+        ]
+        get_board.return_value = {
+            'lists': [
+                {'id': 'l1', 'name': 'Doing'},
+                {'id': 'l2', 'name': 'Done (archive)'},
+            ],
+            'cards': [],
+        }
+        list_cards.return_value = []
+        logger = mock.Mock()
+        token = mock.Mock()
+        push_api = mock.Mock()
+        push_api.get_kv.return_value = None
+        config = nameddict(full=True, scope=dict(
+            personal_boards=False,
+            closed_boards=False,
+            closed_cards=False,
+            exclude_boards=['old *'],
+            exclude_lists=['*archive*'],
+        ))
+        crawler = TrelloCrawler(ComponentManager())
+
+        tasks = crawler.iter_crawl_tasks(push_api, token, config, logger)
+        list_boards.assert_called_once_with(filter='open')
+        self.assertEqual(len(tasks['tasks']), 1)
+        self.assertEqual(tasks['tasks'][0][0].args[1], 'b1')
+
+        handle_board_cards(dict(id=42), 'b1', push_api, token, None, config,
+                           logger)
+        self.assertEqual(get_board.call_args[1]['cards'], 'none')
+        # only cards of lists in scope are fetched
+        self.assertEqual(list_cards.call_count, 1)
+        self.assertEqual(list_cards.call_args[0], ('l1',))
+        self.assertEqual(list_cards.call_args[1]['filter'], 'open')
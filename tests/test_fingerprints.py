@@ -0,0 +1,99 @@
+import os
+import os.path as osp
+import shutil
+import tempfile
+import unittest
+
+from dpc_trello.fingerprints import (
+    FingerprintStore,
+    IdIndex,
+    encode_id,
+    fingerprint,
+    merge_removed,
+    write_index,
+)
+
+
+def trello_id(number):
+    return '{:024x}'.format(number)
+
+
+class TestFingerprints(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_encode_id(self):
+        self.assertEqual(len(encode_id(trello_id(42))), 12)
+        # other identifiers are hashed
+        for other in ['notAnId', trello_id(42)[:-2]]:
+            self.assertEqual(len(encode_id(other)), 12)
+        self.assertNotEqual(encode_id('notAnId'), encode_id('otherId'))
+
+    def test_fingerprint(self):
+        self.assertEqual(len(fingerprint(dict(a=1, b=2))), 8)
+        self.assertEqual(fingerprint(dict(a=1, b=2)),
+                         fingerprint(dict(b=2, a=1)))
+        self.assertNotEqual(fingerprint(dict(a=1)), fingerprint(dict(a=2)))
+
+    def test_index(self):
+        path = osp.join(self.directory, 'index.idx')
+        records = [
+            (trello_id(n), fingerprint(dict(n=n)), 3)
+            for n in range(1000, 0, -3)
+        ]
+        write_index(path, records)
+        with IdIndex(path) as index:
+            self.assertEqual(len(index), len(records))
+            self.assertEqual(index.get(trello_id(1)),
+                             (fingerprint(dict(n=1)), 3))
+            self.assertIn(trello_id(1000), index)
+            self.assertNotIn(trello_id(2), index)
+            self.assertNotIn(trello_id(5000), index)
+            ids = list(index.ids())
+            self.assertEqual(ids, sorted(r[0] for r in records))
+        # 24 bytes per record, 10 bits per id for the Bloom filter
+        self.assertLess(os.path.getsize(path), 26 * len(records) + 32)
+
+    def test_hashed_ids(self):
+        path = osp.join(self.directory, 'index.idx')
+        write_index(path, [(trello_id(1), b'12345678', 1),
+                           ('notAnId', b'12345678', 1)])
+        with IdIndex(path) as index:
+            self.assertIn('notAnId', index)
+            self.assertNotIn('otherId', index)
+            self.assertEqual(sorted(index.ids()),
+                             sorted([trello_id(1), 'notAnId']))
+            self.assertEqual([index.decode(k) for k in index.keys()],
+                             list(index.ids()))
+
+    def test_empty_index(self):
+        self.assertEqual(len(IdIndex()), 0)
+        self.assertIsNone(IdIndex().get(trello_id(1)))
+        path = osp.join(self.directory, 'empty.idx')
+        write_index(path, [])
+        self.assertEqual(list(IdIndex(path)), [])
+
+    def test_merge_removed(self):
+        self.assertEqual(
+            list(merge_removed(['a', 'b', 'd', 'e'], ['b', 'c', 'e', 'f'])),
+            ['a', 'd']
+        )
+        self.assertEqual(list(merge_removed(['a'], [])), ['a'])
+
+    def test_store(self):
+        store = FingerprintStore(self.directory)
+        self.assertEqual(len(store.open('aBoard', 'cards', None)), 0)
+        self.assertEqual(len(store.open('aBoard', 'cards', 1)), 0)
+        for version in [1, 2]:
+            store.write('aBoard', 'cards', version,
+                        [(trello_id(version), b'12345678', version)])
+        store.write('otherBoard', 'cards', 1, [])
+        self.assertIn(trello_id(2), store.open('aBoard', 'cards', 2))
+        store.purge('aBoard', keep=2)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['aBoard-cards-2.idx', 'otherBoard-cards-1.idx'])
+        store.purge('aBoard')
+        self.assertEqual(os.listdir(self.directory),
+                         ['otherBoard-cards-1.idx'])
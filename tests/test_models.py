@@ -0,0 +1,81 @@
+import unittest
+
+from dpc_trello.models import Action, Card, Member
+
+
+def trello_card(**kwargs):
+    card = dict(
+        id='aCard',
+        name='a card',
+        desc='description',
+        dateLastActivity='2016-01-01T00:00:00.000Z',
+        shortUrl='https://trello.com/c/aCard',
+        idList='aList',
+        idMembers=['aMember'],
+        attachments=[dict(
+            id='anAttachment',
+            name='file.pdf',
+            url='https://trello.com/file.pdf',
+            date='2016-01-01T00:00:00.000Z',
+            bytes=42,
+            previews=[],
+        )],
+    )
+    card.update(kwargs)
+    return card
+
+
+class TestModels(unittest.TestCase):
+
+    def test_member(self):
+        member = Member(dict(id='aMember', fullName='A Member',
+                             username='amember'))
+        self.assertEqual(member.full_name, 'A Member')
+        self.assertIsNone(member.avatar_hash)
+        with self.assertRaises(AttributeError):
+            member.extra = 'no dict per instance'
+
+    def test_action(self):
+        action = Action(dict(
+            type='createCard',
+            date='2016-01-01T00:00:00.000Z',
+            idMemberCreator='aMember',
+            data=dict(
+                card=dict(id='aCard', shortLink='c1', name='a card'),
+                list=dict(id='aList', name='a list'),
+                board=dict(id='aBoard', shortLink='b1', name='a board'),
+            ),
+        ))
+        self.assertEqual(action.links, (('board', 'b1', 'a board'),))
+        self.assertIsNone(action.text)
+        comment = Action(dict(type='commentCard', date='2016-01-01',
+                              data=dict(text='hello')))
+        self.assertEqual(comment.text, 'hello')
+        self.assertIsNone(comment.id_member_creator)
+
+    def test_card(self):
+        card = Card(
+            trello_card(),
+            checklists=[dict(name='todo', checkItems=[
+                dict(name='first', state='complete'),
+                dict(name='second', state='incomplete'),
+            ])],
+            labels=[dict(name='bug'), dict(name='')],
+        )
+        self.assertEqual(card.labels, ['bug'])
+        self.assertFalse(card.closed)
+        self.assertFalse(card.subscribed)
+        self.assertEqual(card.checklists[0].items,
+                         (('first', True), ('second', False)))
+        attachment = card.attachments[0]
+        self.assertEqual(attachment.bytes, 42)
+        self.assertIsNone(attachment.mime_type)
+        with self.assertRaises(AttributeError):
+            card.raw = 'no reference to the decoded response'
+
+    def test_partial_card(self):
+        card = Card(dict(id='aCard', subscribed=True))
+        self.assertTrue(card.subscribed)
+        self.assertIsNone(card.name)
+        self.assertEqual(card.attachments, [])
+        self.assertEqual(card.checklists, [])
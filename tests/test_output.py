@@ -0,0 +1,86 @@
+import unittest
+
+from dpc_trello.output import (
+    compact_card,
+    has_markup,
+    keeps_embed,
+    payload_size,
+    truncate,
+)
+
+AUTHOR = dict(name='aName', username='aUserName', thumbnail='aThumbnail')
+
+
+def make_card():
+    return dict(
+        id='c1',
+        description=u'plain text',
+        embed=u'<p>plain text</p>',
+        labels=['foo'],
+        attachments=[
+            dict(type=u'link', url='aShortUrl'),
+            dict(type=u'tag', name='foo'),
+        ],
+        to=[AUTHOR],
+        comments=[
+            dict(text=u'**bold** comment', embed=u'<p><strong>bold</strong>'
+                 u' comment</p>', author=AUTHOR),
+        ],
+    )
+
+
+class TestOutput(unittest.TestCase):
+
+    def test_has_markup(self):
+        self.assertFalse(has_markup(u'a plain sentence, really.'))
+        self.assertFalse(has_markup(None))
+        for text in [u'**bold**', u'a [link](url)', u'# title',
+                     u'- item', u'1. item', u'para\n\npara']:
+            self.assertTrue(has_markup(text), text)
+
+    def test_keeps_embed(self):
+        self.assertTrue(keeps_embed(u'plain', None))
+        self.assertTrue(keeps_embed(u'plain', 'eager'))
+        self.assertFalse(keeps_embed(u'plain', 'lazy'))
+        self.assertTrue(keeps_embed(u'**bold**', 'lazy'))
+        self.assertFalse(keeps_embed(u'**bold**', 'none'))
+        with self.assertRaises(ValueError):
+            keeps_embed(u'plain', 'unknown')
+
+    def test_truncate(self):
+        self.assertEqual(truncate(u'abc', None), (u'abc', False))
+        self.assertEqual(truncate(u'abc', 3), (u'abc', False))
+        self.assertEqual(truncate(u'abcd', 3), (u'ab\u2026', True))
+
+    def test_default_profile(self):
+        card = make_card()
+        self.assertEqual(compact_card(card, {}), card)
+
+    def test_embed_policies(self):
+        card = make_card()
+        lazy = compact_card(card, dict(embed='lazy'))
+        self.assertNotIn('embed', lazy)
+        self.assertIn('embed', lazy['comments'][0])
+        none = compact_card(card, dict(embed='none'))
+        self.assertNotIn('embed', none['comments'][0])
+        # given card is not modified
+        self.assertEqual(card, make_card())
+        with self.assertRaises(ValueError):
+            compact_card(card, dict(embed='unknown'))
+
+    def test_caps(self):
+        card = compact_card(make_card(), dict(max_description=5,
+                                              max_comment=6))
+        self.assertEqual(card['description'], u'plai\u2026')
+        self.assertEqual(card['embed'], u'<p>plai\u2026</p>')
+        self.assertEqual(card['comments'][0]['text'], u'**bol\u2026')
+
+    def test_dedup_and_thumbnails(self):
+        card = make_card()
+        compact = compact_card(card, dict(dedup_tags=True,
+                                          author_thumbnails=False))
+        self.assertEqual(compact['attachments'], card['attachments'][:1])
+        self.assertNotIn('thumbnail', compact['to'][0])
+        self.assertNotIn('thumbnail', compact['comments'][0]['author'])
+        self.assertIn('thumbnail', AUTHOR)
+        self.assertLess(payload_size([compact]), payload_size([card]))
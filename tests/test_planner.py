@@ -0,0 +1,58 @@
+import unittest
+
+from dpc_trello.planner import (
+    DEFAULT_ESTIMATE,
+    board_priority,
+    estimate_board,
+    plan_crawl,
+)
+
+
+def cost(requests, size=0, duration=0.0):
+    return dict(requests=requests, bytes=size, duration=duration)
+
+
+class TestPlanner(unittest.TestCase):
+
+    def test_estimate_board(self):
+        self.assertEqual(estimate_board({}, {}), DEFAULT_ESTIMATE)
+        self.assertEqual(
+            estimate_board({}, dict(default_estimate=dict(requests=5))),
+            dict(DEFAULT_ESTIMATE, requests=5)
+        )
+        stats = dict(cards=cost(3, 100, 1.0), members=cost(1, 10, 0.5),
+                     deferred=2)
+        self.assertEqual(estimate_board(stats, {}), cost(4, 110, 1.5))
+
+    def test_board_priority(self):
+        old = dict(id='old', dateLastActivity='2015-01-01T00:00:00.000Z')
+        new = dict(id='new', dateLastActivity='2016-01-01T00:00:00.000Z')
+        self.assertGreater(board_priority(new, {}), board_priority(old, {}))
+        self.assertGreater(board_priority(old, dict(deferred=1)),
+                           board_priority(new, {}))
+
+    def test_plan_crawl(self):
+        boards = [
+            dict(id='b1', dateLastActivity='2016-01-03'),
+            dict(id='b2', dateLastActivity='2016-01-02'),
+            dict(id='b3', dateLastActivity='2016-01-01'),
+        ]
+        stats = dict(
+            b1=dict(cards=cost(5)),
+            b2=dict(cards=cost(10)),
+            b3=dict(cards=cost(2)),
+        )
+        plan = plan_crawl(boards, stats, dict(requests=8))
+        self.assertEqual(
+            [(e['board_id'], e['planned']) for e in plan['boards']],
+            [('b1', True), ('b2', False), ('b3', True)]
+        )
+        self.assertEqual(plan['planned']['requests'], 7)
+        self.assertEqual(plan['deferred']['requests'], 10)
+        self.assertEqual(plan['budget'], dict(requests=8))
+
+    def test_plan_crawl_progress(self):
+        # the first board is planned even if it exceeds the budget
+        plan = plan_crawl([dict(id='b1')], dict(b1=dict(cards=cost(10))),
+                          dict(requests=1))
+        self.assertTrue(plan['boards'][0]['planned'])
@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from dpc_trello.profiling import profiled, should_profile
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_should_profile(self):
+        self.assertTrue(should_profile(dict(boards=['aBoard']), 'aBoard'))
+        self.assertFalse(should_profile(dict(boards=['aBoard']), 'another'))
+        self.assertTrue(should_profile(dict(sample_rate=1), 'another'))
+        self.assertFalse(should_profile(dict(sample_rate=0), 'another'))
+
+    def test_profiled_task(self):
+        task = mock.Mock(return_value=42)
+        output_dir = os.path.join(self.directory, 'profiles')
+        wrapped = profiled(task, 'aToken-aBoard-cards',
+                           dict(output_dir=output_dir))
+        logger = mock.Mock()
+        self.assertEqual(wrapped('push_api', 'token', None, {}, logger), 42)
+        task.assert_called_once_with('push_api', 'token', None, {}, logger)
+        profiles = os.listdir(output_dir)
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].startswith('aToken-aBoard-cards-'))
+        self.assertTrue(profiles[0].endswith('.prof'))
+
+    def test_profiled_failing_task(self):
+        task = mock.Mock(side_effect=ValueError)
+        wrapped = profiled(task, 'aName', dict(output_dir=self.directory))
+        with self.assertRaises(ValueError):
+            wrapped('push_api', 'token', None, {}, mock.Mock())
+        # profile is written anyway
+        self.assertEqual(len(os.listdir(self.directory)), 1)
@@ -0,0 +1,77 @@
+import unittest
+
+from dpc_trello.refresh import (
+    activity_timestamp,
+    change_interval,
+    is_due,
+    record_activity,
+    record_crawl,
+    schedule,
+)
+
+DAY = 24 * 3600
+SETTINGS = dict(hot_interval=DAY, cold_every=3, max_staleness=10 * DAY)
+
+
+class TestRefresh(unittest.TestCase):
+
+    def test_activity_timestamp(self):
+        self.assertEqual(activity_timestamp('1970-01-02T00:00:00.000Z'), DAY)
+
+    def test_record_activity(self):
+        state = record_activity({}, '1970-01-02T00:00:00.000Z', SETTINGS)
+        self.assertEqual(state['activity'], [DAY])
+        # unchanged boards do not grow their history
+        state = record_activity(state, '1970-01-02T00:00:00.000Z', SETTINGS)
+        self.assertEqual(state['activity'], [DAY])
+        state = record_activity(state, '1970-01-03T00:00:00.000Z',
+                                dict(history=1))
+        self.assertEqual(state['activity'], [2 * DAY])
+
+    def test_change_interval(self):
+        self.assertIsNone(change_interval({}, DAY))
+        self.assertEqual(
+            change_interval(dict(activity=[0, DAY, 2 * DAY]), 3 * DAY), DAY)
+
+    def test_is_due(self):
+        # never crawled
+        self.assertTrue(is_due({}, SETTINGS, 0))
+        hot = dict(activity=[0, 3600, 7200], crawled=7200)
+        self.assertTrue(is_due(hot, SETTINGS, 7300))
+        cold = dict(activity=[0], crawled=DAY, skipped=0)
+        self.assertFalse(is_due(cold, SETTINGS, 2 * DAY))
+        self.assertTrue(is_due(dict(cold, skipped=2), SETTINGS, 2 * DAY))
+        # maximum staleness
+        self.assertTrue(is_due(cold, SETTINGS, 11 * DAY))
+
+    def test_schedule(self):
+        date = '1970-01-01T00:00:00.000Z'
+        decisions = []
+        state = {}
+        for run in range(7):
+            due, state = schedule(state, date, SETTINGS, 10 * DAY + run)
+            if due:
+                state = record_crawl(state, 10 * DAY + run)
+            decisions.append(due)
+        # cold boards are crawled every 3 runs
+        self.assertEqual(decisions,
+                         [True, False, False, True, False, False, True])
+
+    def test_schedule_restarted_run(self):
+        date = '1970-01-01T00:00:00.000Z'
+        due, state = schedule({}, date, SETTINGS, 10 * DAY, 'aRun')
+        self.assertTrue(due)
+        state = record_crawl(state, 10 * DAY)
+        # a restarted run keeps its decision
+        due, state = schedule(state, date, SETTINGS, 10 * DAY + 1, 'aRun')
+        self.assertTrue(due)
+        due, state = schedule(state, date, SETTINGS, 10 * DAY + 2, 'aRun2')
+        self.assertFalse(due)
+
+    def test_failed_crawl(self):
+        date = '1970-01-01T00:00:00.000Z'
+        due, state = schedule({}, date, SETTINGS, 10 * DAY)
+        self.assertTrue(due)
+        # the board's tasks failed, it is not recorded as crawled
+        due, state = schedule(state, date, SETTINGS, 10 * DAY + 1)
+        self.assertTrue(due)
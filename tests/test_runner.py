@@ -0,0 +1,103 @@
+import functools
+import logging
+import os
+import time
+import unittest
+
+import mock
+
+from dpc_trello.runner import (
+    RateLimiter,
+    TaskError,
+    run_crawl,
+    run_sequence,
+    task_name,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+def create_index():
+    return 'anIndex'
+
+
+def board_task(board_id, push_api, token, prev_result, config, logger):
+    if board_id == 'broken':
+        raise ValueError(board_id)
+    return dict(prev_result or {}, board_id=board_id, index=push_api,
+                pid=os.getpid())
+
+
+class FakeCrawler(object):
+
+    def __init__(self, board_ids):
+        self.board_ids = board_ids
+        self.epilogue = mock.Mock()
+
+    def iter_crawl_tasks(self, index, token, config, logger):
+        return dict(
+            tasks=[
+                [functools.partial(board_task, board_id)]
+                for board_id in self.board_ids
+            ],
+            epilogue=self.epilogue,
+        )
+
+
+class TestRunner(unittest.TestCase):
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(100)
+        start = time.time()
+        for _ in range(5):
+            limiter()
+        self.assertGreaterEqual(time.time() - start, 0.04)
+
+    def test_task_name(self):
+        self.assertEqual(
+            task_name(functools.partial(board_task, 'aBoard')),
+            'board_task(aBoard)'
+        )
+
+    def test_run_crawl(self):
+        crawler = FakeCrawler(['b1', 'b2', 'b3'])
+        report = run_crawl(crawler, create_index, 'aToken', {}, LOGGER,
+                           processes=2, rate_limit=100)
+        self.assertEqual(report['errors'], [])
+        self.assertTrue(report['epilogue'])
+        results = [o['result'] for o in report['outcomes']]
+        self.assertEqual(sorted(r['board_id'] for r in results),
+                         ['b1', 'b2', 'b3'])
+        # tasks run in workers, with their own index
+        self.assertNotIn(os.getpid(), [r['pid'] for r in results])
+        self.assertEqual(set(r['index'] for r in results), {'anIndex'})
+        index, token, epilogue_results, config, _ = \
+            crawler.epilogue.call_args[0]
+        self.assertEqual((index, token), ('anIndex', 'aToken'))
+        self.assertEqual(sorted(epilogue_results), sorted(results))
+        self.assertFalse(config.full)
+
+    def test_run_crawl_failure(self):
+        crawler = FakeCrawler(['b1', 'broken'])
+        report = run_crawl(crawler, create_index, 'aToken', {}, LOGGER,
+                           processes=2)
+        self.assertEqual(len(report['outcomes']), 2)
+        self.assertEqual(len(report['errors']), 1)
+        error = report['errors'][0]['error']
+        self.assertIsInstance(error, TaskError)
+        self.assertIn('ValueError', error.error)
+        # old generations are only removed when every task succeeded
+        self.assertFalse(report['epilogue'])
+        self.assertFalse(crawler.epilogue.called)
+
+    def test_run_sequence_aborted(self):
+        calls = []
+        tasks = [
+            lambda *args: calls.append('first'),
+            lambda *args: calls.append('second'),
+        ]
+        with mock.patch.dict('dpc_trello.runner.WORKER', index=None,
+                             token=None, config={}, logger=LOGGER):
+            outcomes = run_sequence(tasks, lambda: bool(calls))
+        self.assertEqual(calls, ['first'])
+        self.assertEqual(len(outcomes), 1)
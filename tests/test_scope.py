@@ -0,0 +1,64 @@
+import unittest
+
+from dpc_trello.scope import (
+    board_in_scope,
+    boards_filter,
+    cards_filter,
+    cards_scope_key,
+    list_in_scope,
+)
+
+
+class TestScope(unittest.TestCase):
+
+    def test_default_scope(self):
+        self.assertTrue(board_in_scope({'id': 'b', 'closed': True}, {}))
+        self.assertTrue(list_in_scope({'name': 'Done (archive)'}, {}))
+        self.assertEqual(boards_filter({}), 'all')
+        self.assertEqual(cards_filter({}), 'open')
+
+    def test_closed(self):
+        scope = dict(closed_boards=False, closed_cards=True)
+        self.assertFalse(board_in_scope({'id': 'b', 'closed': True}, scope))
+        self.assertTrue(board_in_scope({'id': 'b', 'closed': False}, scope))
+        self.assertEqual(boards_filter(scope), 'open')
+        self.assertEqual(cards_filter(scope), 'all')
+
+    def test_organizations(self):
+        scope = dict(organizations=['o1'], personal_boards=False)
+        self.assertTrue(board_in_scope({'id': 'b', 'idOrganization': 'o1'},
+                                       scope))
+        self.assertFalse(board_in_scope({'id': 'b', 'idOrganization': 'o2'},
+                                        scope))
+        self.assertFalse(board_in_scope({'id': 'b', 'idOrganization': None},
+                                        scope))
+        # personal boards are kept unless `personal_boards` is disabled
+        scope = dict(organizations=['o1'])
+        self.assertFalse(board_in_scope({'id': 'b', 'idOrganization': 'o2'},
+                                        scope))
+        self.assertTrue(board_in_scope({'id': 'b', 'idOrganization': None},
+                                       scope))
+        self.assertTrue(board_in_scope({'id': 'b'}, scope))
+
+    def test_board_patterns(self):
+        scope = dict(include_boards=['b1', 'team *'],
+                     exclude_boards=['*archive*'])
+        self.assertTrue(board_in_scope({'id': 'b1', 'name': 'Foo'}, scope))
+        self.assertTrue(board_in_scope({'id': 'b2', 'name': 'Team A'},
+                                       scope))
+        self.assertFalse(board_in_scope({'id': 'b3', 'name': 'Foo'}, scope))
+        self.assertFalse(board_in_scope(
+            {'id': 'b4', 'name': 'Team archive'}, scope))
+
+    def test_list_patterns(self):
+        scope = dict(exclude_lists=['done*'])
+        self.assertFalse(list_in_scope({'name': 'Done (archive)'}, scope))
+        self.assertTrue(list_in_scope({'name': 'Doing'}, scope))
+
+    def test_cards_scope_key(self):
+        self.assertEqual(cards_scope_key({}),
+                         cards_scope_key(dict(closed_boards=False)))
+        self.assertEqual(cards_scope_key({}),
+                         cards_scope_key(dict(closed_cards=False)))
+        self.assertNotEqual(cards_scope_key({}),
+                            cards_scope_key(dict(closed_cards=True)))
@@ -0,0 +1,32 @@
+import shutil
+import tempfile
+import unittest
+
+from dpc_trello.snapshot import RawSnapshotStore, SnapshotNotFound
+
+
+class TestRawSnapshotStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_account(self):
+        store = RawSnapshotStore(self.directory)
+        with self.assertRaises(SnapshotNotFound):
+            store.load_account()
+        store.save_account({'id': 'me'}, [{'id': 'aBoard'}])
+        self.assertEqual(
+            store.load_account(),
+            ({'id': 'me'}, [{'id': 'aBoard'}])
+        )
+
+    def test_board(self):
+        store = RawSnapshotStore(self.directory)
+        store.save_board('aBoard', 'cards', {'lists': [], 'cards': []})
+        self.assertEqual(
+            store.load_board('aBoard', 'cards'),
+            {'lists': [], 'cards': []}
+        )
+        with self.assertRaises(SnapshotNotFound):
+            store.load_board('aBoard', 'members')
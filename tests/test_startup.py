@@ -0,0 +1,58 @@
+import json
+import os
+import os.path as osp
+import subprocess
+import sys
+import unittest
+
+# Maximum time spent importing the crawler module, in seconds
+IMPORT_BUDGET = 0.1
+
+# Modules that must not be imported until a task actually runs
+LAZY_MODULES = [
+    'dateutil.parser',
+    'docido_sdk.toolbox.date_ext',
+    'docido_sdk.toolbox.rate_limits',
+    'markdown',
+    'mimetypes',
+    'requests',
+]
+
+BENCHMARK = """
+import json
+import sys
+import time
+start = time.time()
+import dpc_trello.crawler
+elapsed = time.time() - start
+print(json.dumps(dict(elapsed=elapsed, modules=list(sys.modules))))
+"""
+
+
+def measure_import():
+    """ Import the crawler module in a fresh interpreter
+
+    :return: tuple made of the import duration and the imported modules
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [osp.dirname(osp.dirname(osp.abspath(__file__)))] +
+        [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    output = subprocess.check_output([sys.executable, '-c', BENCHMARK],
+                                     env=env)
+    result = json.loads(output.decode('utf-8'))
+    return result['elapsed'], set(result['modules'])
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_heavy_modules_are_lazy(self):
+        _, modules = measure_import()
+        for module in LAZY_MODULES:
+            self.assertNotIn(module, modules)
+
+    def test_import_budget(self):
+        # best of a few runs to absorb disk cache and scheduling noise
+        elapsed = min(measure_import()[0] for _ in range(3))
+        self.assertLess(elapsed, IMPORT_BUDGET)
@@ -1,6 +1,15 @@
 import unittest
 import mock
-from dpc_trello.trello import TrelloClient, TrelloClientException
+import threading
+
+from dpc_trello.trello import (
+    DEFAULT_TIMEOUT,
+    EndpointLatencies,
+    LatencyTracker,
+    TrelloClient,
+    TrelloClientException,
+    endpoint,
+)
 
 
 # Patch request.request to mock HTTP responses, an extra parameter will be
@@ -24,16 +33,43 @@ class TestTrelloClient(unittest.TestCase):
             }
         ]
         client = TrelloClient(self.TEST_CONSUMER_KEY, self.TEST_TOKEN)
+        mocked_request.return_value.content = '[{"id": "toto"}]'
         boards = client.list_boards()
         self.assertEqual(1, len(boards))
         self.assertEqual(boards[0]['id'], 'toto')
+        self.assertEqual(client.requests, 1)
+        self.assertEqual(client.received_bytes, 16)
         mocked_request.assert_called_once_with(
             data=None,
             method='get',
+            timeout=DEFAULT_TIMEOUT,
             params={'token': 'a_token', 'key': 'a_consumer_key'},
             url='https://api.trello.com/1/members/me/boards'
         )
 
+    def test_download(self, mocked_request):
+        mocked_request.return_value.status_code = 200
+        client = TrelloClient(self.TEST_CONSUMER_KEY, self.TEST_TOKEN)
+        url = 'https://trello.com/1/cards/c/attachments/a/download/f.txt'
+        self.assertIs(client.download(url), mocked_request.return_value)
+        mocked_request.assert_called_once_with(
+            method='get',
+            url=url,
+            stream=True,
+            timeout=DEFAULT_TIMEOUT,
+            headers={
+                'Authorization': 'OAuth oauth_consumer_key="a_consumer_key", '
+                                 'oauth_token="a_token"'
+            }
+        )
+        # credentials are only sent to trello
+        client.download('https://example.com/f.txt')
+        self.assertEqual(mocked_request.call_args[1]['headers'], {})
+        mocked_request.return_value.status_code = 404
+        with self.assertRaises(TrelloClientException):
+            client.download(url)
+        self.assertTrue(mocked_request.return_value.close.called)
+
     def test_board_members_listing(self, mocked_request):
         mocked_request.return_value.status_code = 200
         mocked_request.return_value.json = lambda: [
@@ -53,6 +89,7 @@ class TestTrelloClient(unittest.TestCase):
         mocked_request.assert_called_once_with(
             data=None,
             method='get',
+            timeout=DEFAULT_TIMEOUT,
             params={'token': 'a_token', 'key': 'a_consumer_key'},
             url='https://api.trello.com/1/boards/test_board/members'
         )
@@ -72,6 +109,137 @@ class TestTrelloClient(unittest.TestCase):
         mocked_request.assert_called_once_with(
             data=None,
             method='get',
+            timeout=DEFAULT_TIMEOUT,
             params={'token': 'a_token', 'key': 'a_consumer_key'},
             url='https://api.trello.com/1/boards/test_board/cards'
         )
+
+    def test_board_get(self, mocked_request):
+        mocked_request.return_value.status_code = 200
+        mocked_request.return_value.json = lambda: {
+            'id': 'test_board',
+            'cards': [],
+            'members': [],
+        }
+        client = TrelloClient(self.TEST_CONSUMER_KEY, self.TEST_TOKEN)
+        board = client.get_board('test_board', cards='all')
+        self.assertEqual(board['id'], 'test_board')
+        mocked_request.assert_called_once_with(
+            data=None,
+            method='get',
+            timeout=DEFAULT_TIMEOUT,
+            params={'token': 'a_token', 'key': 'a_consumer_key',
+                    'cards': 'all'},
+            url='https://api.trello.com/1/boards/test_board'
+        )
+
+    def test_board_actions_listing(self, mocked_request):
+        mocked_request.return_value.status_code = 200
+        mocked_request.return_value.json = lambda: [{'id': 'an_action'}]
+        client = TrelloClient(self.TEST_CONSUMER_KEY, self.TEST_TOKEN)
+        actions = client.list_board_actions('test_board', before='foo')
+        self.assertEqual(actions, [{'id': 'an_action'}])
+        mocked_request.assert_called_once_with(
+            data=None,
+            method='get',
+            timeout=DEFAULT_TIMEOUT,
+            params={'token': 'a_token', 'key': 'a_consumer_key',
+                    'before': 'foo'},
+            url='https://api.trello.com/1/boards/test_board/actions'
+        )
+
+    def test_card_actions_listing(self, mocked_request):
+        mocked_request.return_value.status_code = 200
+        mocked_request.return_value.json = lambda: [{'id': 'an_action'}]
+        client = TrelloClient(self.TEST_CONSUMER_KEY, self.TEST_TOKEN)
+        actions = client.list_card_actions('test_card', filter='createCard')
+        self.assertEqual(actions, [{'id': 'an_action'}])
+        mocked_request.assert_called_once_with(
+            data=None,
+            method='get',
+            timeout=DEFAULT_TIMEOUT,
+            params={'token': 'a_token', 'key': 'a_consumer_key',
+                    'filter': 'createCard'},
+            url='https://api.trello.com/1/cards/test_card/actions'
+        )
+
+    def test_timeout(self, mocked_request):
+        mocked_request.return_value.status_code = 200
+        client = TrelloClient(self.TEST_CONSUMER_KEY, self.TEST_TOKEN,
+                              timeout=(1, 2))
+        client.list_boards()
+        self.assertEqual(mocked_request.call_args[1]['timeout'], (1, 2))
+
+    def test_hedged_request(self, mocked_request):
+        latencies = EndpointLatencies()
+        for _ in range(10):
+            latencies.tracker('members/boards').add(0.01)
+        rate_limiter = mock.Mock()
+        first_sent = threading.Event()
+        release_first = threading.Event()
+        fast_response = mock.Mock(status_code=200, content='[{}]')
+        fast_response.json.return_value = [{'id': 'fast'}]
+        slow_response = mock.Mock(status_code=200, content='[]')
+
+        def request(**kwargs):
+            if not first_sent.is_set():
+                first_sent.set()
+                # stall until the hedged request answered
+                release_first.wait(5)
+                return slow_response
+            return fast_response
+
+        mocked_request.side_effect = request
+        client = TrelloClient(self.TEST_CONSUMER_KEY, self.TEST_TOKEN,
+                              hedge_percentile=90, hedge_min_samples=10,
+                              latencies=latencies,
+                              rate_limiter=rate_limiter)
+        try:
+            boards = client.list_boards()
+        finally:
+            release_first.set()
+            client.close(5)
+        self.assertEqual(boards, [{'id': 'fast'}])
+        self.assertEqual(client.hedged_requests, 1)
+        self.assertEqual(client.requests, 2)
+        # the losing attempt is released
+        self.assertTrue(slow_response.close.called)
+        self.assertFalse(fast_response.close.called)
+        # hedged requests count against the rate limit
+        self.assertEqual(rate_limiter.call_count, 2)
+        # latencies of other endpoints are not used to hedge
+        client.get_board('aBoard')
+        self.assertEqual(mocked_request.call_count, 3)
+
+    def test_no_hedging_without_samples(self, mocked_request):
+        mocked_request.return_value.status_code = 200
+        client = TrelloClient(self.TEST_CONSUMER_KEY, self.TEST_TOKEN,
+                              hedge_percentile=90,
+                              latencies=EndpointLatencies())
+        client.list_boards()
+        self.assertEqual(client.hedged_requests, 0)
+        self.assertEqual(mocked_request.call_count, 1)
+
+
+class TestLatencyTracker(unittest.TestCase):
+
+    def test_endpoint(self):
+        self.assertEqual(endpoint('/boards/b1/cards'), 'boards/cards')
+        self.assertEqual(endpoint('/boards/b1'), 'boards')
+        self.assertEqual(endpoint('/members/me/boards'), 'members/boards')
+        latencies = EndpointLatencies()
+        self.assertIs(latencies.tracker('boards'),
+                      latencies.tracker('boards'))
+        self.assertIsNot(latencies.tracker('boards'),
+                         latencies.tracker('members'))
+
+    def test_percentile(self):
+        latencies = LatencyTracker(window=100)
+        self.assertIsNone(latencies.percentile(50))
+        for latency in range(200):
+            latencies.add(latency)
+        # only the latest 100 latencies are kept
+        self.assertEqual(latencies.percentile(0), 100)
+        self.assertEqual(latencies.percentile(100), 199)
+        self.assertEqual(latencies.percentile(50), 150)
+        self.assertIsNone(latencies.percentile(50, min_samples=101))